@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+/iptal latency benchmark.
+
+Sends a photo whose download is slow, then /iptal while that download is
+still running, and measures how long /iptal takes to answer. The run is
+repeated with the old sequential dispatch and with the priority lanes
+(control commands first, media work cancellable). It also counts how often
+the cancelled photo still reached a viewer afterwards.
+
+Then /iptal is sent while a viewer that takes a while to exit is on screen:
+the answer and the event loop must not wait for that exit. Last, a stall
+inside /iptal must be charged to cancel_view in the stall history.
+
+Usage:
+    python bench_cancel.py
+    python bench_cancel.py --trials 50 --download-seconds 3
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application
+
+from soak import SLOW_EXIT_ENV, StubRequest, UpdateFactory, load_bot
+
+CANCEL_DELAY = 0.2  # seconds between the photo and /iptal, so its download is in flight
+SLOW_EXIT_SECONDS = 1.0  # how long the slow-exiting viewer takes to close after /iptal
+STALL_SECONDS = 0.3  # how long the stall attribution check blocks the loop inside /iptal
+
+
+class SlowDownloadRequest(StubRequest):
+    """Stub API whose file downloads take a while and which notes when /iptal is answered."""
+
+    def __init__(self, files, chat_id, download_seconds):
+        super().__init__(files, chat_id)
+        self.download_seconds = download_seconds
+        self.cancel_answered = None
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        if '/file/bot' in url:
+            await asyncio.sleep(self.download_seconds)
+        elif url.endswith('/sendMessage') and request_data and \
+                request_data.parameters.get('text', '').startswith('🧹 Görüntü/ses kapatıldı'):
+            self.cancel_answered.set()
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+async def run_mode(bot, lanes: bool, args) -> dict:
+    user_id = bot.AUTHORIZED_USERS[0]
+    files = {}
+    request = SlowDownloadRequest(files, user_id, args.download_seconds)
+    builder = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:bench')
+        .request(request)
+        .get_updates_request(StubRequest(files, user_id))
+        .updater(None)
+    )
+    if lanes:
+        builder = builder.concurrent_updates(bot._PriorityUpdateProcessor())
+    application = builder.build()
+    bot._add_handlers(application)
+    factory = UpdateFactory(files, user_id, seed=1)
+
+    spawned_at = []
+    spawn_viewers = bot._spawn_viewers
+
+    def _recording_spawn(*spawn_args, **spawn_kwargs):
+        spawned_at.append(time.monotonic())
+        return spawn_viewers(*spawn_args, **spawn_kwargs)
+
+    bot._spawn_viewers = _recording_spawn
+    latencies, shown_after_cancel = [], 0
+    await application.initialize()
+    await application.start()
+    try:
+        for _ in range(args.trials):
+            request.cancel_answered = asyncio.Event()
+            spawned_at.clear()
+            await application.update_queue.put(Update.de_json(factory.photo_update(), application.bot))
+            await asyncio.sleep(CANCEL_DELAY)
+
+            sent = time.monotonic()
+            await application.update_queue.put(Update.de_json(factory.command_update('/iptal'), application.bot))
+            await request.cancel_answered.wait()
+            latencies.append((time.monotonic() - sent) * 1000)
+
+            await application.update_queue.join()
+            await asyncio.sleep(0.05)
+            shown_after_cancel += any(at > sent for at in spawned_at)
+            bot._stop_viewer_subprocess()
+    finally:
+        bot._spawn_viewers = spawn_viewers
+        await application.stop()
+        await application.shutdown()
+
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'max': latencies[-1],
+        'shown_after_cancel': shown_after_cancel,
+    }
+
+
+async def run_slow_exit(bot, args) -> dict:
+    """/iptal while the viewer on screen takes SLOW_EXIT_SECONDS to close: answer time and loop lag."""
+    user_id = bot.AUTHORIZED_USERS[0]
+    files = {}
+    request = SlowDownloadRequest(files, user_id, 0)
+    application = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:bench')
+        .request(request)
+        .get_updates_request(StubRequest(files, user_id))
+        .updater(None)
+        .concurrent_updates(bot._PriorityUpdateProcessor())
+        .build()
+    )
+    bot._add_handlers(application)
+    factory = UpdateFactory(files, user_id, seed=3)
+
+    async def probe_lag(lags):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(0.01)
+            lags.append((time.monotonic() - before - 0.01) * 1000)
+
+    latencies, lags, left_running = [], [], 0
+    os.environ[SLOW_EXIT_ENV] = str(SLOW_EXIT_SECONDS)
+    await application.initialize()
+    await application.start()
+    try:
+        for _ in range(args.slow_trials):
+            fd, path = tempfile.mkstemp(suffix='.jpg')
+            os.close(fd)
+            bot._viewer_processes.update(bot._spawn_viewers('image', path, 60))
+            processes = list(bot._viewer_processes.values())
+            await asyncio.sleep(0.2)  # let the viewer install its signal handler
+
+            request.cancel_answered = asyncio.Event()
+            prober = asyncio.create_task(probe_lag(lags))
+            sent = time.monotonic()
+            await application.update_queue.put(Update.de_json(factory.command_update('/iptal'), application.bot))
+            await request.cancel_answered.wait()
+            latencies.append((time.monotonic() - sent) * 1000)
+            await application.update_queue.join()  # includes reaping the viewer
+            prober.cancel()
+            left_running += sum(process.poll() is None for process in processes)
+    finally:
+        del os.environ[SLOW_EXIT_ENV]
+        bot._stop_viewer_subprocess()
+        await application.stop()
+        await application.shutdown()
+
+    return {'p50': statistics.median(latencies), 'max': max(latencies),
+            'max_lag': max(lags, default=0.0), 'left_running': left_running}
+
+
+async def check_stall_attribution(bot) -> bool:
+    """A loop stall inside /iptal must be charged to cancel_view, not to the update processor."""
+    user_id = bot.AUTHORIZED_USERS[0]
+    files = {}
+    application = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:bench')
+        .request(StubRequest(files, user_id))
+        .get_updates_request(StubRequest(files, user_id))
+        .updater(None)
+        .concurrent_updates(bot._PriorityUpdateProcessor())
+        .build()
+    )
+    bot._add_handlers(application)
+    factory = UpdateFactory(files, user_id, seed=2)
+
+    cancel_media_work = bot._cancel_media_work
+
+    def _blocking_cancel_media_work():
+        time.sleep(STALL_SECONDS)  # blocks the event loop from inside cancel_view
+        return cancel_media_work()
+
+    bot._cancel_media_work = _blocking_cancel_media_work
+    bot._stall_history.clear()
+    await application.initialize()
+    await application.start()
+    try:
+        await application.update_queue.put(Update.de_json(factory.command_update('/iptal'), application.bot))
+        await application.update_queue.join()
+        await asyncio.sleep(bot.STALL_HEARTBEAT_INTERVAL * 4)  # let the heartbeat close the stall record
+    finally:
+        bot._cancel_media_work = cancel_media_work
+        await application.stop()
+        await application.shutdown()
+
+    handlers = [stall['handler'] for stall in bot._stall_history]
+    ok = handlers == ['cancel_view']
+    print(f"\nStall inside /iptal charged to: {', '.join(handlers) or 'nothing'} "
+          f"({'ok' if ok else 'FAIL, expected cancel_view'})")
+    return ok
+
+
+async def bench(args) -> bool:
+    temp_dir = tempfile.mkdtemp(prefix='bench_cancel_')
+    bot = load_bot(temp_dir)
+    bot._start_stall_watchdog()
+    print(f"/iptal while a {args.download_seconds:.1f} s download is in flight, {args.trials} trials\n")
+    print(f"{'dispatch':<12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'shown after /iptal':>22}")
+    try:
+        for name, lanes in (('sequential', False), ('lanes', True)):
+            result = await run_mode(bot, lanes, args)
+            print(f"{name:<12}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['max']:>10.1f}"
+                  f"{result['shown_after_cancel']:>15}/{args.trials}")
+
+        slow = await run_slow_exit(bot, args)
+        print(f"\n/iptal with a viewer that takes {SLOW_EXIT_SECONDS:g} s to exit, {args.slow_trials} trials")
+        print(f"answer p50 {slow['p50']:.1f} ms, max {slow['max']:.1f} ms; "
+              f"max event-loop lag {slow['max_lag']:.1f} ms; viewers left running {slow['left_running']}")
+        slow_ok = slow['max'] < SLOW_EXIT_SECONDS * 1000 / 2 and slow['max_lag'] < SLOW_EXIT_SECONDS * 1000 / 2 \
+            and not slow['left_running']
+        ok = await check_stall_attribution(bot) and slow_ok
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how quickly /iptal answers while media work is running")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--download-seconds", type=float, default=2.0, help="simulated download time per photo")
+    parser.add_argument("--slow-trials", type=int, default=3, help="trials with a slow-exiting viewer")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(bench(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Media fairness benchmark for several authorized users.
+
+Every download is slowed down, and each photo is timed from being sent to
+reaching the screen (handed to a viewer, new or already showing).
+
+- Flood: one user floods the bot with photos while another sends a photo now
+  and then. The run is repeated with the old sequential dispatch (one shared
+  queue in arrival order) and with the fair media lane (per-user queues taken
+  in turn). For each user it reports the time to the screen, and how long the
+  flood took to drain.
+- Weighted: three users send the same number of photos at once, first with
+  equal weights and then with USER_PRIORITIES giving the first user twice the
+  weight. It reports each user's share of the screen while all three still had
+  photos waiting, next to the share its weight promises. MEDIA_USER_MAX_IN_FLIGHT
+  is raised above MEDIA_LANE_SLOTS for this run; with the default of 1 a user
+  is never ready twice in a row, so the per-user cap, not the weight, would
+  set the shares.
+
+Usage:
+    python bench_fairness.py
+    python bench_fairness.py --flood 40 --download-seconds 0.25 --weighted 30
+"""
+
+import argparse
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application
+
+from soak import StubRequest, UpdateFactory, load_bot
+
+HEAVY_USER, LIGHT_USER = 1001, 1002
+WEIGHTED_USERS = (2001, 2002, 2003)
+
+
+class SlowDownloadRequest(StubRequest):
+    """Stub API whose file downloads take a while."""
+
+    def __init__(self, files, chat_id, download_seconds):
+        super().__init__(files, chat_id)
+        self.download_seconds = download_seconds
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        if '/file/bot' in url:
+            await asyncio.sleep(self.download_seconds)
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+class ScreenClock:
+    """Notes when each photo (by file id) is handed to a viewer, by wrapping the bot's hooks."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.shown: dict[str, float] = {}  # file_id -> time it reached the screen
+        self._file_ids: dict[str, str] = {}  # downloaded path -> file_id
+        self._originals = {name: getattr(bot, name)
+                           for name in ('_download_media', '_spawn_viewers', '_hand_over_to_viewers')}
+
+    def __enter__(self):
+        originals, file_ids = self._originals, self._file_ids
+
+        async def _download_media(media, *args, **kwargs):
+            path = await originals['_download_media'](media, *args, **kwargs)
+            file_ids[path] = media['source'].file_id
+            return path
+
+        def _spawn_viewers(kind, media_path, *args, **kwargs):
+            self._mark(media_path)
+            return originals['_spawn_viewers'](kind, media_path, *args, **kwargs)
+
+        async def _hand_over_to_viewers(kind, media_path, *args, **kwargs):
+            handed_over = await originals['_hand_over_to_viewers'](kind, media_path, *args, **kwargs)
+            if handed_over:
+                self._mark(media_path)
+            return handed_over
+
+        self.bot._download_media = _download_media
+        self.bot._spawn_viewers = _spawn_viewers
+        self.bot._hand_over_to_viewers = _hand_over_to_viewers
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self._originals.items():
+            setattr(self.bot, name, original)
+
+    def _mark(self, media_path: str):
+        file_id = self._file_ids.pop(media_path, None)
+        if file_id is not None:
+            self.shown.setdefault(file_id, time.monotonic())
+
+
+async def run_photos(bot, fair: bool, args, sends) -> tuple[dict, dict]:
+    """Run ``sends(send)`` against a fresh application; returns (sent, shown) keyed by file id."""
+    files = {}
+    chat_id = bot.AUTHORIZED_USERS[0]
+    builder = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:bench')
+        .request(SlowDownloadRequest(files, chat_id, args.download_seconds))
+        .get_updates_request(StubRequest(files, chat_id))
+        .updater(None)
+    )
+    if fair:
+        builder = builder.concurrent_updates(bot._PriorityUpdateProcessor())
+    application = builder.build()
+    bot._add_handlers(application)
+    factory = UpdateFactory(files, chat_id, seed=1)
+    sent: dict[str, tuple[int, float]] = {}  # file_id -> (user, send time)
+
+    async def send(user_id):
+        update = factory.photo_update(user_id)
+        sent[update['message']['photo'][0]['file_id']] = (user_id, time.monotonic())
+        await application.update_queue.put(Update.de_json(update, application.bot))
+
+    await application.initialize()
+    await application.start()
+    try:
+        with ScreenClock(bot) as clock:
+            await sends(send)
+            await application.update_queue.join()
+            while bot._media_lane_tasks:
+                await asyncio.sleep(0.01)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        bot._stop_viewer_subprocess()
+    missing = len(sent) - len(clock.shown)
+    if missing:
+        print(f"   ({missing} photos never reached the screen)")
+    return sent, clock.shown
+
+
+async def run_flood(bot, fair: bool, args) -> dict:
+    async def sends(send):
+        for _ in range(args.flood):
+            await send(HEAVY_USER)
+        for _ in range(args.light):
+            await asyncio.sleep(args.light_interval)
+            await send(LIGHT_USER)
+
+    started = time.monotonic()
+    sent, shown = await run_photos(bot, fair, args, sends)
+    latencies = {HEAVY_USER: [], LIGHT_USER: []}
+    for file_id, (user_id, at) in sent.items():
+        if file_id in shown:
+            latencies[user_id].append(shown[file_id] - at)
+    heavy_done = max(shown[f] for f, (user, _) in sent.items() if user == HEAVY_USER and f in shown)
+    return {'latencies': latencies, 'drain': heavy_done - started}
+
+
+async def run_weighted(bot, args) -> dict:
+    async def sends(send):
+        for _ in range(args.weighted):
+            for user_id in WEIGHTED_USERS:
+                await send(user_id)
+
+    sent, shown = await run_photos(bot, True, args, sends)
+    by_user = {user_id: sorted(shown[f] for f, (user, _) in sent.items() if user == user_id and f in shown)
+               for user_id in WEIGHTED_USERS}
+    # Shares only mean something while every user still had photos waiting
+    contended_until = min(times[-1] for times in by_user.values() if times)
+    counts = {user_id: sum(1 for at in times if at <= contended_until) for user_id, times in by_user.items()}
+    total = sum(counts.values()) or 1
+    return {
+        'share': {user_id: count / total for user_id, count in counts.items()},
+        'latency': {user_id: statistics.median(
+            shown[f] - at for f, (user, at) in sent.items() if user == user_id and f in shown
+        ) for user_id in WEIGHTED_USERS},
+    }
+
+
+async def bench(args) -> None:
+    temp_dir = tempfile.mkdtemp(prefix='bench_fairness_')
+    bot = load_bot(temp_dir)
+    try:
+        bot.AUTHORIZED_USERS = [HEAVY_USER, LIGHT_USER]
+        print(f"Flood: {args.flood} photos from one user, {args.light} from another every "
+              f"{args.light_interval:g} s, {args.download_seconds:g} s per download\n")
+        print(f"{'dispatch':<12}{'user':<8}{'p50 s':>8}{'max s':>8}{'flood drained s':>18}")
+        for name, fair in (('sequential', False), ('fair', True)):
+            result = await run_flood(bot, fair, args)
+            for user_id, label in ((HEAVY_USER, 'heavy'), (LIGHT_USER, 'light')):
+                samples = result['latencies'][user_id]
+                drain = f"{result['drain']:.1f}" if user_id == HEAVY_USER else ''
+                print(f"{name:<12}{label:<8}{statistics.median(samples):>8.2f}{max(samples):>8.2f}{drain:>18}")
+
+        bot.AUTHORIZED_USERS = list(WEIGHTED_USERS)
+        saved_priorities, saved_in_flight = bot.USER_PRIORITIES, bot.MEDIA_USER_MAX_IN_FLIGHT
+        bot.MEDIA_USER_MAX_IN_FLIGHT = bot.MEDIA_LANE_SLOTS + 1
+        print(f"\nWeighted: {args.weighted} photos from each of {len(WEIGHTED_USERS)} users at once, "
+              f"{bot.MEDIA_LANE_SLOTS} download slots, up to {bot.MEDIA_USER_MAX_IN_FLIGHT} items per user\n")
+        print(f"{'weights':<12}{'user':<8}{'weight':>8}{'share':>8}{'expected':>10}{'p50 s':>8}")
+        try:
+            for name, priorities in (('equal', {}), ('2:1:1', {WEIGHTED_USERS[0]: 2})):
+                bot.USER_PRIORITIES = priorities
+                result = await run_weighted(bot, args)
+                weights = {user_id: priorities.get(user_id, 1) for user_id in WEIGHTED_USERS}
+                for user_id in WEIGHTED_USERS:
+                    expected = weights[user_id] / sum(weights.values())
+                    print(f"{name:<12}{user_id:<8}{weights[user_id]:>8}{result['share'][user_id]:>8.0%}"
+                          f"{expected:>10.0%}{result['latency'][user_id]:>8.2f}")
+        finally:
+            bot.USER_PRIORITIES, bot.MEDIA_USER_MAX_IN_FLIGHT = saved_priorities, saved_in_flight
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-user time to the screen under a flood and with weights")
+    parser.add_argument("--flood", type=int, default=20, help="photos sent at once by the heavy user")
+    parser.add_argument("--light", type=int, default=5, help="photos sent by the light user")
+    parser.add_argument("--light-interval", type=float, default=0.5, help="seconds between the light user's photos")
+    parser.add_argument("--weighted", type=int, default=20, help="photos sent by each user in the weighted run")
+    parser.add_argument("--download-seconds", type=float, default=0.5, help="simulated download time per photo")
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Time-to-first-frame for every ffplay launch profile, and for both image backends.
+
+Generates a few sample files with ffmpeg and starts ffplay on each one with
+every profile in FFPLAY_PROFILES, with the same arguments the viewer uses.
+The samples are an H.264/AAC MP4 with its index at the end, a VP9/Opus
+WebM and an MP3. The time from spawn to the first -stats line with a
+running clock is the time to first frame (first audio for the MP3).
+
+Still images (a 12 MP JPEG and a PNG screenshot) are shown through the real
+viewer, from spawn to its 'shown' event: with the Tk backend, with the ffplay
+backend, and handed to an ffplay viewer already on screen (/gosterici ffplay
+between consecutive items). The Tk backend needs a display.
+
+Without ffplay, or with --decode-only, the benchmark times ffmpeg decoding
+the first frame with the profile's input options instead, and for images
+PIL against ffmpeg decoding and lanczos-scaling to the screen, each in a
+fresh process. That covers the decoding part of the difference, but not
+SDL, Tk or window start-up.
+
+Usage:
+    python bench_ffplay.py
+    python bench_ffplay.py --runs 10 --headless   # SDL dummy video/audio drivers
+    python bench_ffplay.py --screen 3840x2160     # images scaled for a 4K screen
+"""
+
+import argparse
+import logging
+import os
+import json
+import queue
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import screen_display_bot as bot
+
+RUN_TIMEOUT = 30  # seconds before a hanging player counts as a failed run
+INPUT_OPTIONS = ('-probesize', '-analyzeduration', '-fflags')  # the profile flags ffmpeg also takes
+FIRST_FRAME = re.compile(rb'\d+\.\d+ (?:A-V|M-V|M-A):')  # clock is "nan" until playback starts
+
+# name -> (kind, ffmpeg arguments that create it)
+TONE = ['-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000']
+PICTURE = ['-f', 'lavfi', '-i', 'testsrc2=size=1920x1080:rate=30']
+SAMPLES = {
+    # no +faststart: the moov index sits at the end, as in many phone recordings
+    'h264_aac.mp4': ('video', [*PICTURE, *TONE, '-t', '8', '-c:v', 'libx264', '-preset', 'veryfast',
+                               '-pix_fmt', 'yuv420p', '-c:a', 'aac']),
+    'vp9_opus.webm': ('video', [*PICTURE, *TONE, '-t', '8', '-c:v', 'libvpx-vp9', '-deadline', 'realtime',
+                                '-cpu-used', '8', '-c:a', 'libopus']),
+    'tone.mp3': ('audio', [*TONE, '-t', '8', '-c:a', 'libmp3lame']),
+}
+IMAGE_SAMPLES = {
+    'photo_12mp.jpg': ['-f', 'lavfi', '-i', 'testsrc2=size=4000x3000', '-frames:v', '1', '-q:v', '3'],
+    'screenshot.png': ['-f', 'lavfi', '-i', 'testsrc2=size=2560x1440', '-frames:v', '1'],
+}
+IMAGE_PATHS = ('tk', 'ffplay', 'ffplay warm')  # backends, and an ffplay viewer taking the next item
+# Decode and fit to the screen as the Tk viewer does, in a fresh interpreter
+PIL_DECODE = ("import sys; from PIL import Image; img = Image.open(sys.argv[1]); "
+              "w, h = map(int, sys.argv[2].split('x')); r = min(w / img.width, h / img.height); "
+              "img.resize((max(1, round(img.width * r)), max(1, round(img.height * r))), Image.Resampling.LANCZOS)")
+
+
+def make_samples(ffmpeg: str, directory: str, specs: dict) -> dict[str, str]:
+    samples = {}
+    for name, args in specs.items():
+        path = os.path.join(directory, name)
+        subprocess.run([ffmpeg, '-v', 'error', '-nostdin', '-y', *args, path], check=True, timeout=120)
+        samples[name] = path
+    return samples
+
+
+def time_ffplay(ffplay: str, kind: str, path: str, profile_args: list[str], env: dict) -> float | None:
+    cmd = [ffplay, '-autoexit', '-v', 'quiet', '-stats', *(['-nodisp'] if kind == 'audio' else []),
+           *profile_args, path]
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    watchdog = threading.Timer(RUN_TIMEOUT, process.kill)
+    watchdog.start()
+    seen = b''
+    try:
+        while chunk := process.stderr.read1(4096):
+            seen = (seen + chunk)[-256:]
+            if FIRST_FRAME.search(seen):
+                return time.perf_counter() - started
+        return None
+    finally:
+        watchdog.cancel()
+        process.kill()
+        process.wait()
+        process.stderr.close()
+
+
+def time_decode(ffmpeg: str, kind: str, path: str, profile_args: list[str], env: dict) -> float | None:
+    input_args = []
+    for flag, value in zip(profile_args, profile_args[1:]):
+        if flag in INPUT_OPTIONS:
+            input_args += [flag, value]
+    first = ['-map', '0:v:0', '-frames:v', '1'] if kind == 'video' else ['-map', '0:a:0', '-frames:a', '1']
+    cmd = [ffmpeg, '-v', 'error', '-nostdin', *input_args, '-i', path, *first, '-f', 'null', '-']
+    started = time.perf_counter()
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                       timeout=RUN_TIMEOUT, env=env)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    return time.perf_counter() - started
+
+
+def _linked(path: str, directory: str) -> str:
+    # Viewers delete their input when done, so every run gets its own link.
+    copy = os.path.join(directory, f"{time.monotonic_ns()}_{os.path.basename(path)}")
+    os.link(path, copy)
+    return copy
+
+
+def _read_events(stream, events: queue.Queue) -> None:
+    for line in stream:
+        try:
+            events.put(json.loads(line))
+        except ValueError:
+            continue
+    events.put(None)
+
+
+def _wait_shown(events: queue.Queue, deadline: float) -> bool:
+    while (remaining := deadline - time.perf_counter()) > 0:
+        try:
+            event = events.get(timeout=remaining)
+        except queue.Empty:
+            return False
+        if event is None:
+            return False
+        if event.get('event') == 'shown':
+            return True
+    return False
+
+
+def time_viewer(path: str, workdir: str, options: dict, env: dict, warm: bool) -> float | None:
+    """Spawn the real image viewer until it reports 'shown'; warm: until it showed a second, handed-over image."""
+    cmd = [sys.executable, os.path.abspath(bot.__file__), '--viewer', 'image', _linked(path, workdir), '30',
+           *(f"{key}={value}" for key, value in options.items())]
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True, env=env)
+    events = queue.Queue()
+    threading.Thread(target=_read_events, args=(process.stdout, events), daemon=True).start()
+    try:
+        if not _wait_shown(events, started + RUN_TIMEOUT):
+            return None
+        if warm:
+            command = {'cmd': 'play', 'kind': 'image', 'path': _linked(path, workdir), 'seconds': 30, 'options': options}
+            started = time.perf_counter()
+            process.stdin.write(json.dumps(command) + '\n')
+            process.stdin.flush()
+            if not _wait_shown(events, started + RUN_TIMEOUT):
+                return None
+        return time.perf_counter() - started
+    finally:
+        if hasattr(signal, 'SIGUSR1'):
+            process.send_signal(signal.SIGUSR1)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stdin.close()
+
+
+def time_image_decode(tool: str, path: str, screen: str, env: dict) -> float | None:
+    if tool == 'pil':
+        cmd = [sys.executable, '-c', PIL_DECODE, path, screen]
+    else:
+        width, height = screen.split('x')
+        cmd = [tool, '-v', 'error', '-nostdin', '-i', path, '-frames:v', '1',
+               '-vf', f"scale={width}:{height}:force_original_aspect_ratio=decrease:flags=lanczos", '-f', 'null', '-']
+    started = time.perf_counter()
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                       timeout=RUN_TIMEOUT, env=env)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    return time.perf_counter() - started
+
+
+def _row(name: str, label: str, times: list) -> str:
+    done = [t * 1000 for t in times if t is not None]
+    p50 = f"{statistics.median(done):.1f}" if done else "-"
+    worst = f"{max(done):.1f}" if done else "-"
+    return f"{name:<16}{label:<12}{p50:>10}{worst:>10}{len(times) - len(done):>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first frame per ffplay launch profile")
+    parser.add_argument("--runs", type=int, default=5, help="runs per sample and profile")
+    parser.add_argument("--decode-only", action="store_true", help="time ffmpeg's first decoded frame instead of ffplay")
+    parser.add_argument("--headless", action="store_true", help="use SDL's dummy drivers (no window, no sound)")
+    parser.add_argument("--screen", default="1920x1080", help="screen size images are scaled to")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    ffmpeg = bot._find_media_tool('ffmpeg')
+    ffplay = None if args.decode_only else bot._find_media_tool('ffplay')
+    if ffmpeg is None:
+        print("ffmpeg not found; it is needed to create the sample files")
+        return 1
+    env = dict(os.environ)
+    if args.headless:
+        env.update(SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+    measure, player = (time_ffplay, ffplay) if ffplay else (time_decode, ffmpeg)
+    what = "ffplay, spawn to first frame" if ffplay else "ffmpeg decode-only (ffplay not used)"
+
+    temp_dir = tempfile.mkdtemp(prefix='bench_ffplay_')
+    try:
+        samples = make_samples(ffmpeg, temp_dir, {name: args for name, (_kind, args) in SAMPLES.items()})
+        print(f"Time to first frame, {what}, {args.runs} runs\n")
+        print(f"{'sample':<16}{'profile':<12}{'p50 ms':>10}{'max ms':>10}{'failed':>8}")
+        for name, path in samples.items():
+            kind = SAMPLES[name][0]
+            for profile in bot.FFPLAY_PROFILES:
+                profile_args = bot._ffplay_profile_args({'profile': profile}, kind)
+                times = [measure(player, kind, path, profile_args, env) for _ in range(args.runs)]
+                print(_row(name, profile, times))
+
+        images = make_samples(ffmpeg, temp_dir, IMAGE_SAMPLES)
+        if ffplay:
+            print(f"\nStill images, spawn (or handover) to the viewer's 'shown' event, {args.screen} screen\n")
+            options = {'tk': {}, 'ffplay': {'backend': 'ffplay', 'ffplay': ffplay, 'screen': args.screen}}
+            print(f"{'sample':<16}{'path':<12}{'p50 ms':>10}{'max ms':>10}{'failed':>8}")
+            for name, path in images.items():
+                for label in IMAGE_PATHS:
+                    backend, _, warm = label.partition(' ')
+                    times = [time_viewer(path, temp_dir, options[backend], env, bool(warm)) for _ in range(args.runs)]
+                    print(_row(name, label, times))
+        else:
+            print(f"\nStill images, decode and lanczos scale to {args.screen} in a fresh process (no windows)\n")
+            print(f"{'sample':<16}{'decoder':<12}{'p50 ms':>10}{'max ms':>10}{'failed':>8}")
+            for name, path in images.items():
+                for label, tool in (('pil', 'pil'), ('ffmpeg', ffmpeg)):
+                    times = [time_image_decode(tool, path, args.screen, env) for _ in range(args.runs)]
+                    print(_row(name, label, times))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
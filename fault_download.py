@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Fault-injection harness for the resumable downloader.
+
+Serves a random file from a local HTTP server that answers ranged GETs but
+breaks some of them on purpose: 503 responses, bodies cut off half way,
+connections dropped before any response, a Content-Range that does not
+match the requested range and 206 responses without a body. For every scenario it checks that
+
+- each retry asks for the byte right after the last one that arrived,
+- the wait before a retry follows DOWNLOAD_RETRY_BASE_DELAY doubling,
+- the finished file has the served file's SHA-256, and
+- too many consecutive failures end in DownloadError without a .part file.
+
+Usage:
+    python fault_download.py
+    python fault_download.py --size-kib 2048 --chunk-kib 128
+"""
+
+import argparse
+import asyncio
+import hashlib
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from soak import load_bot
+
+BACKOFF_TOLERANCE = 0.9  # a retry may come this fraction of the nominal delay early (timer granularity)
+
+# Fault per request number; requests not listed are served normally.
+SCENARIOS = {
+    '503': {1: '503', 3: '503', 4: '503'},
+    'truncated': {1: 'truncate', 2: 'truncate', 5: 'truncate'},
+    'dropped': {0: 'drop', 2: 'drop', 3: 'drop'},
+    'wrong-range': {1: 'wrong-range', 4: 'wrong-range'},
+    'empty': {1: 'empty', 2: 'empty', 4: 'empty'},
+    'mixed': {0: '503', 1: 'truncate', 2: 'drop', 3: 'wrong-range', 6: 'truncate', 7: '503'},
+}
+
+
+class FaultyRangeServer(http.server.ThreadingHTTPServer):
+    """Serves ``payload`` with Range support and applies ``faults`` by request number."""
+
+    daemon_threads = True
+
+    def __init__(self, payload: bytes):
+        super().__init__(('127.0.0.1', 0), _FaultyHandler)
+        self.payload = payload
+        self.faults = {}
+        self.log = []  # one dict per request: start, fault, arrived, finished, sent
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/file.bin"
+
+    def reset(self, faults: dict):
+        with self.lock:
+            self.faults = faults
+            self.log = []
+
+
+class _FaultyHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        payload = server.payload
+        start, _, end = self.headers['Range'].removeprefix('bytes=').partition('-')
+        start, end = int(start), min(int(end), len(payload) - 1)
+        with server.lock:
+            entry = {'start': start, 'fault': server.faults.get(len(server.log)),
+                     'arrived': time.monotonic(), 'sent': 0}
+            server.log.append(entry)
+        fault = entry['fault']
+        try:
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif fault == 'drop':
+                self.close_connection = True
+            elif fault == '503':
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                body_start = start
+                if fault == 'wrong-range':
+                    # Data from further on, labelled as such; writing it at ``start`` would corrupt the file.
+                    body_start = min(start + 4096, len(payload) - 1)
+                body = payload[body_start:body_start + end + 1 - start]
+                if fault == 'empty':
+                    body = b''  # no progress; retrying at once would spin
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {body_start}-{body_start + max(len(body), 1) - 1}/{len(payload)}")
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if fault == 'truncate':
+                    body = body[:len(body) // 2]
+                    self.close_connection = True
+                self.wfile.write(body)
+                self.wfile.flush()
+                entry['sent'] = len(body)
+        finally:
+            entry['finished'] = time.monotonic()
+
+
+def check_log(log: list[dict], bot) -> list[str]:
+    """Resume offsets and backoff delays that differ from what the downloader promises."""
+    problems, failures = [], 0
+    for previous, current in zip(log, log[1:]):
+        fault = previous['fault']
+        if fault is None:
+            expected = previous['start'] + previous['sent']
+            failures = 0
+        else:
+            # Only bytes that actually arrived at the right offset count.
+            expected = previous['start'] + (previous['sent'] if fault == 'truncate' else 0)
+            failures += 1
+            delay = bot.DOWNLOAD_RETRY_BASE_DELAY * 2 ** (failures - 1)
+            waited = current['arrived'] - previous['finished']
+            if waited < delay * BACKOFF_TOLERANCE:
+                problems.append(f"retry after {fault} waited {waited * 1000:.0f} ms, expected {delay * 1000:.0f} ms")
+        if current['start'] != expected:
+            problems.append(f"after {fault or 'ok'} resumed at byte {current['start']}, expected {expected}")
+    return problems
+
+
+async def run_scenario(bot, server, name: str, faults: dict, temp_dir: str, digest: str) -> list[str]:
+    server.reset(faults)
+    dest = os.path.join(temp_dir, f"{name}.bin")
+    started = time.monotonic()
+    try:
+        await bot._download_resumable(server.url, dest, len(server.payload))
+    except bot.DownloadError as e:
+        return [f"download failed: {e}"]
+    elapsed = time.monotonic() - started
+
+    problems = check_log(server.log, bot)
+    with open(dest, 'rb') as f:
+        if hashlib.sha256(f.read()).hexdigest() != digest:
+            problems.append("SHA-256 of the downloaded file does not match")
+    os.remove(dest)
+    print(f"{name:<14}{len(server.log):>10}{len(faults):>8}{elapsed * 1000:>12.0f}   {'ok' if not problems else 'FAIL'}")
+    return problems
+
+
+async def run_give_up(bot, server, temp_dir: str) -> list[str]:
+    """More consecutive failures than DOWNLOAD_MAX_RETRIES must raise and leave nothing behind."""
+    server.reset({n: '503' for n in range(1, bot.DOWNLOAD_MAX_RETRIES + 2)})
+    dest = os.path.join(temp_dir, 'give_up.bin')
+    try:
+        await bot._download_resumable(server.url, dest, len(server.payload))
+        problems = ["download succeeded although every retry failed"]
+    except bot.DownloadError:
+        problems = check_log(server.log, bot)
+    if os.path.exists(dest) or os.path.exists(dest + '.part'):
+        problems.append("partial file left behind after giving up")
+    expected = bot.DOWNLOAD_MAX_RETRIES + 2  # one good chunk, the first try and every retry
+    if len(server.log) != expected:
+        problems.append(f"{len(server.log)} requests before giving up, expected {expected}")
+    print(f"{'give-up':<14}{len(server.log):>10}{bot.DOWNLOAD_MAX_RETRIES + 1:>8}{'':>12}   {'ok' if not problems else 'FAIL'}")
+    return problems
+
+
+async def run(args) -> int:
+    temp_dir = tempfile.mkdtemp(prefix='fault_download_')
+    bot = load_bot(temp_dir)
+    bot.DOWNLOAD_CHUNK_SIZE = args.chunk_kib * 1024
+    bot.DOWNLOAD_RETRY_BASE_DELAY = args.base_delay
+    payload = os.urandom(args.size_kib * 1024)
+    digest = hashlib.sha256(payload).hexdigest()
+
+    server = FaultyRangeServer(payload)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"{args.size_kib} KiB in {args.chunk_kib} KiB ranges, retry base delay {args.base_delay * 1000:.0f} ms\n")
+    print(f"{'scenario':<14}{'requests':>10}{'faults':>8}{'time ms':>12}   result")
+    failed = {}
+    try:
+        for name, faults in SCENARIOS.items():
+            problems = await run_scenario(bot, server, name, faults, temp_dir, digest)
+            if problems:
+                failed[name] = problems
+        problems = await run_give_up(bot, server, temp_dir)
+        if problems:
+            failed['give-up'] = problems
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    for name, problems in failed.items():
+        for problem in problems:
+            print(f"{name}: {problem}")
+    print("\nPASS" if not failed else "\nFAIL")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inject HTTP faults into the resumable downloader and verify recovery")
+    parser.add_argument("--size-kib", type=int, default=1024, help="size of the served file")
+    parser.add_argument("--chunk-kib", type=int, default=64, help="DOWNLOAD_CHUNK_SIZE for the run")
+    parser.add_argument("--base-delay", type=float, default=0.05, help="DOWNLOAD_RETRY_BASE_DELAY for the run")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Replay a capture recorded with `python screen_display_bot.py --record DIR`.
+
+Feeds the recorded updates through the bot's real handlers, with the same
+lanes and rate limiter as main(), at their original pace or faster. The
+recorded media is served from DIR/media by a stubbed Telegram API and shown
+by the soak harness's fake viewers. Nothing talks to Telegram. At the end
+it prints how long every stage took, so a slow period seen in production
+can be profiled offline, as often as needed.
+
+Usage:
+    python replay.py captures/aksam
+    python replay.py captures/aksam --speed 10      # ten times faster
+    python replay.py captures/aksam --speed 0       # back to back (a recorded /iptal then
+                                                    # cancels everything queued before it)
+    python replay.py captures/aksam --host-tools    # real ffprobe/loudness/poster stages
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+from telegram import Update
+from telegram.ext import Application
+
+from soak import ErrorCounter, StubRequest, load_bot
+
+IDLE_TIMEOUT = 120  # seconds to wait for media work still running after the last update
+PIPELINE_STAGES = ('queue', 'download', 'probe', 'prepare', 'handover', 'spawn')  # report order
+
+
+class ReplayRequest(StubRequest):
+    """Stub API that serves the captured media by file_id."""
+
+    def __init__(self, media_dir: str, chat_id: int):
+        super().__init__({}, chat_id)
+        names = os.listdir(media_dir) if os.path.isdir(media_dir) else []
+        # file_ids never contain dots, so everything from the first dot on is the extension
+        self._media = {name.split('.', 1)[0]: os.path.join(media_dir, name) for name in names}
+        self.missing: set[str] = set()
+
+    def _path(self, url: str) -> str:
+        return self._media[url.rsplit('/', 1)[-1].split('.', 1)[0]]
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        if '/file/bot' in url:
+            self.calls += 1
+            return 200, await asyncio.to_thread(_read_bytes, self._path(url))
+        if url.endswith('/getFile'):
+            self.calls += 1
+            file_id = request_data.parameters['file_id']
+            path = self._media.get(file_id)
+            if path is None:
+                self.missing.add(file_id)
+                error = {'ok': False, 'error_code': 400, 'description': 'Bad Request: file is not in the capture'}
+                return 400, json.dumps(error).encode()
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': os.path.getsize(path),
+                      'file_path': f"replay/{os.path.basename(path)}"}
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+    async def serve_range(self, request: httpx.Request) -> httpx.Response:
+        """Ranged GETs for the resumable downloader (files above LARGE_DOWNLOAD_THRESHOLD)."""
+        path = self._path(str(request.url))
+        size = os.path.getsize(path)
+        start, _, end = request.headers['range'].removeprefix('bytes=').partition('-')
+        start, end = int(start), min(int(end), size - 1)
+        if start >= size:
+            return httpx.Response(416)
+        body = await asyncio.to_thread(_read_bytes, path, start, end - start + 1)
+        return httpx.Response(206, headers={'content-range': f"bytes {start}-{end}/{size}"}, content=body)
+
+
+def _read_bytes(path: str, offset: int = 0, length: int = -1) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def load_capture(capture_dir: str) -> list[dict]:
+    with open(os.path.join(capture_dir, 'updates.jsonl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _wait_until_idle(bot) -> bool:
+    """Wait for queued media, album flushes and cache fills; scheduled items are not waited for."""
+    deadline = time.monotonic() + IDLE_TIMEOUT
+    while bot._media_lane_tasks or bot._album_buffers or bot._background_tasks:
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def print_report(bot) -> None:
+    print(f"\n{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}")
+    # Pipeline stages in order, then the whole-update times per update type
+    order = {stage: index for index, stage in enumerate(PIPELINE_STAGES)}
+    for stage in sorted(bot._stage_timings, key=lambda name: (order.get(name, len(order)), name)):
+        samples = sorted(bot._stage_timings[stage])
+        if not samples:
+            continue
+        print(f"{stage:<22}{len(samples):>7}{_percentile(samples, 0.5) * 1000:>10.1f}"
+              f"{_percentile(samples, 0.95) * 1000:>10.1f}{samples[-1] * 1000:>10.1f}{sum(samples):>10.2f}")
+
+
+async def replay(args) -> int:
+    entries = load_capture(args.capture)
+    if not entries:
+        print(f"{args.capture}: capture is empty")
+        return 1
+    temp_dir = tempfile.mkdtemp(prefix='replay_')
+    bot = load_bot(temp_dir, host_tools=args.host_tools)
+    bot.STAGE_HISTORY_SIZE = None  # keep every sample for the report
+    if args.host_tools:
+        tools = await bot._media_tools_ready()
+        if tools.get('ffplay') is None:
+            # Viewers are fake, so a missing ffplay must not turn video/audio away.
+            tools['ffplay'] = {'path': sys.executable, 'version': 'replay'}
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+
+    user_id = bot.AUTHORIZED_USERS[0]
+    request = ReplayRequest(os.path.join(args.capture, 'media'), user_id)
+    bot._download_resumable = functools.partial(
+        bot._download_resumable, client=httpx.AsyncClient(transport=httpx.MockTransport(request.serve_range))
+    )
+    builder = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:replay')
+        .request(request)
+        .get_updates_request(StubRequest({}, user_id))
+        .updater(None)
+        .concurrent_updates(bot._PriorityUpdateProcessor())
+    )
+    if not args.no_rate_limit:
+        builder = builder.rate_limiter(bot._ChatRateLimiter())
+    application = builder.build()
+    bot._add_handlers(application)
+
+    span = entries[-1]['t']
+    pace = f"{args.speed:g}x" if args.speed > 0 else "back to back"
+    print(f"Replaying {len(entries)} updates recorded over {span:.1f} s ({pace}) from {args.capture}")
+    await application.initialize()
+    await application.start()
+    bot._start_stall_watchdog()
+    started = time.monotonic()
+    try:
+        for entry in entries:
+            if args.speed > 0:
+                delay = started + entry['t'] / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await application.update_queue.put(Update.de_json(entry['update'], application.bot))
+        await application.update_queue.join()
+        idle = await _wait_until_idle(bot)
+        elapsed = time.monotonic() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        bot._stop_viewer_subprocess()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print_report(bot)
+    print(f"\n{len(entries)} updates in {elapsed:.1f} s, {request.calls} API calls, {errors.count} logged errors")
+    print(f"Loop stalls: {bot._stall_summary()}")
+    print(f"Media per user: {bot._user_media_summary()}")
+    if request.missing:
+        print(f"⚠️ {len(request.missing)} files were not in the capture (downloads failed as 'file not found')")
+    if not idle:
+        print(f"⚠️ Media work was still running {IDLE_TIMEOUT} s after the last update")
+    return 0 if idle else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded update stream offline and report stage timings")
+    parser.add_argument("capture", help="directory written by `screen_display_bot.py --record`")
+    parser.add_argument("--speed", type=float, default=1.0, help="pace multiplier; 0 sends updates back to back")
+    parser.add_argument("--host-tools", action="store_true",
+                        help="use this machine's ffprobe/ffmpeg for probing, loudness and posters")
+    parser.add_argument("--no-rate-limit", action="store_true", help="skip the outbound rate limiter")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(replay(args)))
+
+
+if __name__ == "__main__":
+    main()
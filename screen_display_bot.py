@@ -8,8 +8,25 @@ import signal
 import importlib.util
 import asyncio
 import threading
+import hashlib
+import json
+import math
+import queue
+import re
+import shutil
+import contextlib
+import contextvars
+import functools
+import itertools
+import inspect
+import traceback
+from collections import Counter, OrderedDict, defaultdict, deque
+from datetime import datetime, timedelta
 from pathlib import Path
 
+# Cold-start reference point for the "time to first getUpdates" report
+_PROCESS_STARTED = time.perf_counter()
+
 
 def _bootstrap_python_deps() -> None:
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -45,20 +62,17 @@ def _bootstrap_python_deps() -> None:
     os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), *sys.argv[1:]])
 
 
+import httpx
 from dotenv import load_dotenv
 from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, BaseRateLimiter, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
-from PIL import Image, ImageTk
-import tkinter as tk
-from tkinter import ttk
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
-# Audio imports
-try:
-    import simpleaudio as sa
-    SIMPLEAUDIO_AVAILABLE = True
-except ImportError:
-    SIMPLEAUDIO_AVAILABLE = False
+# PIL, ImageTk and tkinter are only needed by the viewers and the legacy
+# MediaDisplay, so they are imported where they are used; the bot process
+# stays light and reaches its first getUpdates sooner.
 
 try:
     import subprocess
@@ -84,8 +98,21 @@ logging.getLogger('telegram').setLevel(logging.INFO)
 
 logger = logging.getLogger(__name__)
 
-VIDEO_AVAILABLE = importlib.util.find_spec('cv2') is not None
-AUDIO_AVAILABLE = SIMPLEAUDIO_AVAILABLE or SUBPROCESS_AUDIO_AVAILABLE
+
+
+@functools.lru_cache(maxsize=None)
+def _module_available(name: str) -> bool:
+    """Capability check, deferred until first asked and cached afterwards."""
+    return importlib.util.find_spec(name) is not None
+
+
+def _video_available() -> bool:
+    return _module_available('cv2')
+
+
+def _audio_available() -> bool:
+    return SUBPROCESS_AUDIO_AVAILABLE or _module_available('simpleaudio')
+
 
 # Load environment variables
 load_dotenv()
@@ -96,12 +123,411 @@ TELEGRAM_BOT_TOKEN = "8006349550:AAFOvRAVED05Q7Ijro9HKYKW_NHhDgjJQ34"
 AUTHORIZED_USERS = [7435892118]  # Your Telegram Chat ID
 DEFAULT_DISPLAY_TIME = 10  # Default display time in seconds
 
+# Animated GIF/WebP playback
+ANIMATION_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Above this, frames are decoded on the fly
+ANIMATION_DEFAULT_FRAME_MS = 100  # Browsers use 100 ms for missing/too short durations
+
+# Per-viewer memory budgets in MB, enforced with RLIMIT_DATA on Linux (inherited by ffplay)
+VIEWER_MEMORY_BUDGET_MB = {'image': 512, 'slideshow': 768, 'video': 1024, 'audio': 256}
+IMAGE_THUMBNAIL_TIMEOUT = 30  # seconds for ffmpeg to scale down an image too large to decode in-process
+MEMORY_HISTORY_SIZE = 20
+
+# Media probing (runs before any viewer is spawned)
+PROBE_CACHE_MAX_ENTRIES = 256
+PROBE_TIMEOUT = 15  # seconds for a single ffprobe run
+
+# Albums (media groups) are collected and shown as one slideshow
+ALBUM_COLLECT_WINDOW = 1.5  # seconds without a new part before the album is shown
+
+# Large downloads: ranged chunks, resumed after a dropped connection
+LARGE_DOWNLOAD_THRESHOLD = 5 * 1024 * 1024  # bytes; smaller files use a single plain download
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_RETRIES = 5  # consecutive failures before giving up
+DOWNLOAD_RETRY_BASE_DELAY = 0.5  # seconds, doubled after every consecutive failure
+DOWNLOAD_PROGRESS_INTERVAL = 2.0  # seconds between progress message edits
+
+# Scheduled playback (/zamanla)
+SCHEDULE_PREPARE_LEAD = 10  # seconds before the start time the viewer is spawned and warmed up
+SCHEDULE_MAX_AHEAD = 24 * 3600  # furthest allowed start time, in seconds
+SCHEDULE_SPIN_SECONDS = 0.02  # last stretch before a start deadline is busy-waited for precision
+SCHEDULE_HISTORY_SIZE = 20
+
+# Viewers are this script re-run with --viewer; the soak harness swaps in a fake one
+VIEWER_COMMAND = [sys.executable, os.path.abspath(__file__)]
+VIEWER_STARTUP_GRACE = 0.35  # seconds a new viewer gets before an early exit is reported
+VIEWER_SEEK_TIMEOUT = 3.0  # seconds for a viewer to restart ffplay at the /sar position
+VIEWER_HANDOVER_TIMEOUT = 1.0  # seconds for the ffplay viewer on screen to accept the next item
+
+# Outbound Bot API calls: token buckets per chat and overall; RetryAfter is waited out
+OUTBOUND_CHAT_RATE = 1.0  # sustained messages per second into one chat
+OUTBOUND_CHAT_BURST = 5
+OUTBOUND_GLOBAL_RATE = 25.0  # calls per second overall (Telegram allows about 30)
+OUTBOUND_MAX_RETRIES = 3  # RetryAfter retries before the error is passed on
+
+# Update lanes: control commands run at once, media work is shared fairly between users
+MEDIA_LANE_MAX_UPDATES = 1024  # concurrently accepted updates (queued media included)
+MEDIA_LANE_COMMANDS = {'zamanla', 'schedule'}  # commands that download media
+MEDIA_LANE_SLOTS = 2  # media downloads at once, across all users; showing them is one at a time
+MEDIA_USER_MAX_IN_FLIGHT = 1  # items one user may have between download and screen; 1 keeps them in order
+MEDIA_USER_MAX_QUEUED = 20  # waiting media per user; more is turned away until the queue drains
+USER_PRIORITIES = {}  # user id -> weight of its turns (default 1); {111: 2} gives 111 two turns per round
+USER_STATS_WINDOW = 600  # seconds of completed media behind the per-user throughput in /durum
+
+# Per-stage timings of update handling (/durum and the replay report)
+STAGE_HISTORY_SIZE = 200  # recent samples kept per stage; None keeps every sample
+
+# Event-loop stall watchdog
+STALL_HEARTBEAT_INTERVAL = 0.05  # seconds between loop heartbeats
+STALL_THRESHOLD = 0.1  # loop lag in seconds reported as a stall
+STALL_HISTORY_SIZE = 20
+
+# FFmpeg tools resolved once at startup; their -version/-codecs output is cached on disk
+# beside this script, never in the shared temp dir where anyone could plant a cache
+MEDIA_TOOLS = ('ffplay', 'ffmpeg', 'ffprobe')
+MEDIA_TOOLS_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".media_tools.json")
+MEDIA_TOOL_TIMEOUT = 10  # seconds for a single -version/-codecs run
+
+# Loudness normalization: measured once per content hash, applied as a plain ffplay volume gain
+LOUDNESS_TARGET_LUFS = -16.0  # integrated loudness to aim for; None disables normalization
+LOUDNESS_TRUE_PEAK_DB = -1.0  # never raise the gain past this true peak
+LOUDNESS_MAX_GAIN_DB = 15.0
+LOUDNESS_MIN_GAIN_DB = 0.5  # smaller corrections are not worth a filter
+LOUDNESS_MAX_DURATION = 20 * 60  # seconds; longer items are played as they are
+LOUDNESS_ANALYSIS_TIMEOUT = 60
+LOUDNESS_CACHE_MAX_ENTRIES = 512
+LOUDNESS_RENDITION_AFTER_PLAYS = 3  # store a pre-normalized copy from this play on; 0 disables
+# Beside this script like the tool cache: viewers play these files, so nobody else may plant one
+LOUDNESS_RENDITION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".loudnorm")
+LOUDNESS_RENDITION_MAX_FILES = 20
+LOUDNESS_RENDER_TIMEOUT = 120  # seconds for rendering one normalized copy
+
+# ffplay launch profiles: input probing, buffering, frame dropping and sync per media kind.
+# Chosen globally with /profil or per item with "profil=<ad>" in the caption.
+FFPLAY_PROFILES = {
+    # ffplay's own defaults: probes up to 5 MB / 5 s of input before the first frame
+    'standart': {'video': [], 'audio': []},
+    # First frame as early as possible: little probing, frames shown on the wall clock instead of
+    # waiting for the audio device, late frames dropped. (-fflags nobuffer is for live streams;
+    # on local files it discards the probed packets and re-reads them, over a second on MP4.
+    # -analyzeduration 0 means "unset" to libavformat, i.e. the 5 s default, so it is kept small but positive.)
+    'hizli': {
+        'video': ['-probesize', '262144', '-analyzeduration', '500000', '-framedrop', '-sync', 'ext'],
+        'audio': ['-probesize', '65536', '-analyzeduration', '500000'],
+    },
+    # Thorough probing for odd files, every frame shown, audio as the master clock
+    'kalite': {
+        'video': ['-probesize', '50000000', '-analyzeduration', '10000000', '-noframedrop', '-sync', 'audio'],
+        'audio': ['-probesize', '50000000', '-analyzeduration', '10000000'],
+    },
+}
+FFPLAY_PROFILE_ALIASES = {'low-latency': 'hizli', 'quality': 'kalite', 'default': 'standart'}
+FFPLAY_DEFAULT_PROFILE = 'standart'
+
+# Poster frame shown while ffplay starts: Telegram's thumbnail, later a cached first frame.
+# Kept beside this script, like the renditions, so nobody else can plant a poster.
+POSTER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".posters")
+POSTER_CACHE_MAX_FILES = 50
+POSTER_MAX_SECONDS = 5.0  # the poster (or a handed-over item's predecessor) goes away after this even if
+                          # ffplay never reports a frame
+
+# Still images: 'tk' decodes and scales them with PIL into a Tk window, 'ffplay' shows them with the
+# video player and its lanczos scaler, so an image after a video (or the other way round) is handed
+# to the viewer already on screen. Chosen with /gosterici.
+IMAGE_BACKENDS = ('tk', 'ffplay')
+IMAGE_BACKEND = 'tk'
+
+
+def _find_media_tool(name: str) -> str | None:
+    """Absolute path of an FFmpeg tool: the bundled ffmpeg/bin copy first, then PATH."""
+    local_tool = Path("ffmpeg") / "bin" / (f"{name}.exe" if sys.platform == "win32" else name)
+    if local_tool.exists():
+        return str(local_tool.resolve())
+    found = shutil.which(name)
+    return os.path.abspath(found) if found else None
+
+
+def _loudness_source(media_path: str, options: dict[str, str]) -> tuple[str, list[str]]:
+    """File to play and ffplay audio filter arguments for the loudness options from the bot."""
+    rendition = options.get('rendition')
+    if rendition and os.path.exists(rendition):
+        return rendition, []  # already normalized
+    if options.get('gain_db'):
+        return media_path, ['-af', f"volume={options['gain_db']}dB"]
+    return media_path, []
+
+
+def _ffplay_profile_args(options: dict[str, str], kind: str) -> list[str]:
+    """ffplay input/playback arguments of the launch profile the bot picked for this item."""
+    profile = FFPLAY_PROFILES.get(options.get('profile') or FFPLAY_DEFAULT_PROFILE, {})
+    return list(profile.get(kind, []))
+
+
+def _fit_size(width: int, height: int, screen_width: int, screen_height: int) -> tuple[int, int]:
+    """Largest size that fits the screen while keeping the aspect ratio."""
+    img_ratio = width / height
+    screen_ratio = screen_width / screen_height
+    if img_ratio > screen_ratio:
+        return screen_width, max(1, int(screen_width / img_ratio))
+    return max(1, int(screen_height * img_ratio)), screen_height
+
+
+def _frame_duration_ms(img) -> int:
+    duration = int(img.info.get('duration') or 0)
+    if duration <= 10:
+        return ANIMATION_DEFAULT_FRAME_MS
+    return duration
+
+
+def _scaled_frame(img, size: tuple[int, int]):
+    from PIL import Image
+
+    frame = img.convert('RGBA') if img.mode in ('P', 'PA', 'LA', 'RGBA') else img.convert('RGB')
+    return frame.resize(size, Image.Resampling.LANCZOS)
+
+
+_viewer_memory_budget: int | None = None  # bytes, set in the viewer process from its options
+_viewer_ffmpeg: str | None = None  # ffmpeg the viewer may use for oversized images, from its options
+
+
+def _apply_memory_budget(budget_bytes: int) -> None:
+    """Cap this viewer's (and its children's) data segment where the OS supports it."""
+    global _viewer_memory_budget
+    _viewer_memory_budget = budget_bytes
+    # Only Linux enforces RLIMIT_DATA for mmap'd memory; RLIMIT_AS would count the
+    # huge shared mappings on macOS. Elsewhere the budget only drives the fallbacks below.
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        import resource
+        _soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        if hard != resource.RLIM_INFINITY:
+            budget_bytes = min(budget_bytes, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (budget_bytes, hard))
+    except Exception as e:
+        logger.warning(f"Memory budget could not be applied: {e}")
+
+
+def _peak_rss_windows() -> int | None:
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    counters = _ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def _peak_rss() -> tuple[int | None, int | None]:
+    """Peak resident set size in bytes of this viewer and of its reaped children (ffplay)."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            return _peak_rss_windows(), None
+        except Exception:
+            return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, KiB elsewhere
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    )
+
+
+def _decode_budget() -> int | None:
+    # Leave half of the budget for the interpreter, Tk and the scaled copies.
+    return _viewer_memory_budget // 2 if _viewer_memory_budget else None
+
+
+def _ffmpeg_thumbnail(path: str, size: tuple[int, int]):
+    """Scale ``path`` down to ``size`` in an ffmpeg child and open the result.
+
+    The full-size decode happens in ffmpeg, which inherits the viewer's RLIMIT_DATA,
+    so only the screen-sized copy ever lives in the viewer. Raises MemoryError
+    when ffmpeg cannot do it within the budget either.
+    """
+    from PIL import Image
+
+    fd, thumbnail_path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    try:
+        result = subprocess.run(
+            [_viewer_ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', path, '-frames:v', '1',
+             '-vf', f"scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease:flags=area",
+             '-update', '1', thumbnail_path],
+            stdin=subprocess.DEVNULL, capture_output=True, timeout=IMAGE_THUMBNAIL_TIMEOUT,
+        )
+        if result.returncode != 0 or not os.path.getsize(thumbnail_path):
+            raise MemoryError(f"ffmpeg could not scale the image down (exit {result.returncode})")
+        img = Image.open(thumbnail_path)
+        img.load()
+        return img
+    except subprocess.TimeoutExpired as e:
+        raise MemoryError("ffmpeg took too long to scale the image down") from e
+    finally:
+        try:
+            os.remove(thumbnail_path)
+        except OSError:
+            pass
+
+
+def _open_image_within_budget(path: str, screen_size: tuple[int, int]):
+    """Open an image so that decoding it stays inside the viewer's memory budget.
+
+    Oversized JPEGs are decoded directly at a reduced scale (draft mode); other
+    formats are scaled down by ffmpeg when the viewer has one, and raise
+    MemoryError instead of thrashing otherwise. The peak RSS right after the
+    decode is reported as a 'memory' event with stage 'decode'.
+    """
+    from PIL import Image
+
+    try:
+        img = Image.open(path)
+        budget = _decode_budget()
+        if budget and img.width * img.height * 4 > budget:
+            original = img.size
+            target = _fit_size(img.width, img.height, *screen_size)
+            img.draft('RGB', target)
+            if img.width * img.height * 4 > budget:
+                if not _viewer_ffmpeg:
+                    img.close()
+                    raise MemoryError(f"{original[0]}x{original[1]} image exceeds the memory budget")
+                img.close()
+                img = _ffmpeg_thumbnail(path, target)
+            logger.info(f"Decoding {original[0]}x{original[1]} image at {img.width}x{img.height} to stay in budget")
+        return img
+    finally:
+        peak_rss, children_peak_rss = _peak_rss()
+        _emit_viewer_event('memory', stage='decode', peak_rss=peak_rss, children_peak_rss=children_peak_rss,
+                           budget=_viewer_memory_budget)
+
+
+def _prepare_animation(root, label, img, size: tuple[int, int]):
+    """Prepare an animated image for ``label`` and return the function that starts it.
+
+    All frames are decoded and pre-scaled once when they fit into
+    ``ANIMATION_CACHE_MAX_BYTES``; longer animations are decoded frame by frame.
+    Playback uses Tk ``after()`` scheduling on a monotonic clock.
+    """
+    from PIL import ImageTk
+
+    frame_count = getattr(img, 'n_frames', 1)
+    cached_frames: list[tuple[ImageTk.PhotoImage, int]] = []
+
+    cache_limit = min(ANIMATION_CACHE_MAX_BYTES, _decode_budget() or ANIMATION_CACHE_MAX_BYTES)
+    if size[0] * size[1] * 4 * frame_count <= cache_limit:
+        for index in range(frame_count):
+            img.seek(index)
+            cached_frames.append((ImageTk.PhotoImage(_scaled_frame(img, size)), _frame_duration_ms(img)))
+    else:
+        logger.info(f"Animation too large to cache ({frame_count} frames), decoding on the fly")
+
+    def _frame_at(index: int):
+        if cached_frames:
+            return cached_frames[index]
+        img.seek(index)
+        return ImageTk.PhotoImage(_scaled_frame(img, size)), _frame_duration_ms(img)
+
+    index = 0
+    next_due = 0.0
+
+    def _start():
+        nonlocal next_due
+        next_due = time.monotonic()
+        _tick()
+
+    def _tick():
+        nonlocal index, next_due
+        try:
+            photo, duration_ms = _frame_at(index)
+        except Exception as e:
+            logger.error(f"Animation frame {index} could not be decoded: {e}")
+            return
+        label.configure(image=photo)
+        label.image = photo  # keep a reference, Tk does not
+
+        index = (index + 1) % frame_count
+        next_due += duration_ms / 1000
+        now = time.monotonic()
+        if next_due < now:
+            # Fell behind (slow decode or a stalled loop): skip cached frames to stay on the
+            # clock; when decoding on the fly, resync instead of bursting through frames.
+            if cached_frames:
+                while next_due + cached_frames[index][1] / 1000 < now:
+                    next_due += cached_frames[index][1] / 1000
+                    index = (index + 1) % frame_count
+            else:
+                next_due = now
+        root.after(max(1, int((next_due - now) * 1000)), _tick)
+
+    return _start
+
+
+def _emit_viewer_event(event: str, **fields) -> None:
+    """Report an event from a viewer to the bot (one JSON object per stdout line)."""
+    try:
+        print(json.dumps({'event': event, **fields}), flush=True)
+    except Exception:
+        pass
+
+
+def _monotonic_deadline(start_at: float) -> float:
+    # Convert the wall-clock target once; everything after runs on the monotonic clock.
+    return time.monotonic() + (start_at - time.time())
+
+
+def _sleep_until(deadline: float, stop_requested=lambda: False) -> bool:
+    """Sleep until a monotonic deadline, spinning the last few ms. False if stopped first."""
+    while not stop_requested():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        if remaining > SCHEDULE_SPIN_SECONDS:
+            time.sleep(min(0.1, remaining - SCHEDULE_SPIN_SECONDS))
+    return False
+
+
+def _parse_geometry(geometry: str) -> tuple[int, int, int, int]:
+    """Parse a Tk style ``WxH+X+Y`` string into (width, height, x, y)."""
+    match = re.fullmatch(r'(\d+)x(\d+)([+-]-?\d+)([+-]-?\d+)', geometry)
+    if not match:
+        raise ValueError(f"invalid geometry: {geometry}")
+    width, height, x, y = match.groups()
+    return int(width), int(height), int(x.lstrip('+')), int(y.lstrip('+'))
+
+
+def _open_viewer_window(geometry: str | None = None):
+    """Create the locked-down fullscreen Tk window shared by the still-image viewers.
+
+    Returns (root, label, (screen_width, screen_height), close).
+    """
+    import tkinter as tk
+    from tkinter import ttk
 
-def _run_viewer_image(image_path: str, display_time: int) -> None:
     root = tk.Tk()
-    root.attributes('-fullscreen', True)
+    if geometry:
+        # A specific display: cover exactly its area instead of the primary screen.
+        screen_width, screen_height, _x, _y = _parse_geometry(geometry)
+        root.geometry(geometry)
+    else:
+        root.attributes('-fullscreen', True)
+        screen_width = root.winfo_screenwidth()
+        screen_height = root.winfo_screenheight()
     root.configure(bg='black')
     root.overrideredirect(True)
+    if not geometry:
+        # Lets the bot pick download sizes when it cannot enumerate displays itself.
+        _emit_viewer_event('screen', width=screen_width, height=screen_height)
 
     def _block_event(_event=None):
         return 'break'
@@ -115,25 +541,9 @@ def _run_viewer_image(image_path: str, display_time: int) -> None:
     root.bind('<Control-w>', _block_event)
     root.bind('<Meta-w>', _block_event)
 
-    img = Image.open(image_path)
-    screen_width = root.winfo_screenwidth()
-    screen_height = root.winfo_screenheight()
-
-    img_ratio = img.width / img.height
-    screen_ratio = screen_width / screen_height
-    if img_ratio > screen_ratio:
-        new_width = screen_width
-        new_height = int(screen_width / img_ratio)
-    else:
-        new_height = screen_height
-        new_width = int(screen_height * img_ratio)
-
-    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    photo = ImageTk.PhotoImage(img)
-
     frame = tk.Frame(root, bg='black')
     frame.place(relx=0.5, rely=0.5, anchor='center')
-    label = ttk.Label(frame, image=photo, background='black')
+    label = ttk.Label(frame, background='black')
     label.pack()
 
     def _close():
@@ -166,14 +576,378 @@ def _run_viewer_image(image_path: str, display_time: int) -> None:
     # Local emergency exit (safety): Ctrl+Shift+Esc
     root.bind('<Control-Shift-Escape>', lambda e: _close())
 
-    root.after(max(1, int(display_time)) * 1000, _close)
+    return root, label, (screen_width, screen_height), _close
+
+
+def _run_viewer_image(image_path: str, display_time: int, geometry: str | None = None,
+                      start_at: float | None = None) -> None:
+    from PIL import Image, ImageTk
+
+    root, label, screen_size, _close = _open_viewer_window(geometry)
+    if start_at is not None:
+        # Scheduled: stay hidden while decoding and scaling, reveal at start_at.
+        root.withdraw()
+
+    img = _open_image_within_budget(image_path, screen_size)
+    size = _fit_size(img.width, img.height, *screen_size)
+
+    start_animation = None
+    if getattr(img, 'is_animated', False):
+        start_animation = _prepare_animation(root, label, img, size)
+    else:
+        photo = ImageTk.PhotoImage(img.resize(size, Image.Resampling.LANCZOS))
+        label.configure(image=photo)
+        label.image = photo
+
+    def _begin():
+        if start_animation:
+            start_animation()
+        root.after(max(1, int(display_time)) * 1000, _close)
+
+    if start_at is None:
+        _begin()
+        root.update()
+        _emit_viewer_event('shown', kind='image')
+    else:
+        deadline = _monotonic_deadline(start_at)
+
+        def _reveal():
+            _sleep_until(deadline)
+            root.deiconify()
+            _begin()
+            root.update()
+            _emit_viewer_event('started', error_ms=round((time.monotonic() - deadline) * 1000, 1))
+
+        root.after(max(0, int((deadline - time.monotonic() - SCHEDULE_SPIN_SECONDS) * 1000)), _reveal)
+
+    root.mainloop()
+
+
+def _read_slideshow_manifest(manifest_path: str) -> list[str]:
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _run_viewer_slideshow(manifest_path: str, slide_time: int, geometry: str | None = None) -> None:
+    """Show an album: every slide is decoded and pre-scaled before the first one appears."""
+    from PIL import ImageTk
+
+    slide_paths = _read_slideshow_manifest(manifest_path)
+    try:
+        root, label, screen_size, _close = _open_viewer_window(geometry)
+
+        slides = []
+        for path in slide_paths:
+            try:
+                with _open_image_within_budget(path, screen_size) as img:
+                    size = _fit_size(img.width, img.height, *screen_size)
+                    slides.append(ImageTk.PhotoImage(_scaled_frame(img, size)))
+            except Exception as e:
+                logger.error(f"Slide could not be loaded ({path}): {e}")
+        if not slides:
+            _close()
+            return
+
+        slide_seconds = max(1, int(slide_time))
+        started = time.monotonic()
+
+        def _show(index: int):
+            if index >= len(slides):
+                _close()
+                return
+            label.configure(image=slides[index])
+            label.image = slides[index]
+            # Deadlines come from the monotonic start so per-slide drift never accumulates.
+            due = started + (index + 1) * slide_seconds
+            root.after(max(1, int((due - time.monotonic()) * 1000)), _show, index + 1)
+
+        _show(0)
+        root.mainloop()
+    finally:
+        for path in slide_paths:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+
+def _show_poster(poster_path: str, geometry: str | None = None):
+    """Open the viewer window with the poster image on it; returns (root, close)."""
+    from PIL import Image, ImageTk
+
+    root, label, screen_size, close = _open_viewer_window(geometry)
+    img = _open_image_within_budget(poster_path, screen_size)
+    size = _fit_size(img.width, img.height, *screen_size)
+    photo = ImageTk.PhotoImage(img.convert('RGB').resize(size, Image.Resampling.LANCZOS))
+    label.configure(image=photo)
+    label.image = photo
+    root.update()
+    return root, close
+
+
+_PLAYER_CLOCK = re.compile(rb'(\d+\.\d+) (?:A-V|M-V|M-A):')
+
+
+class _FfplaySession:
+    """The ffplay behind a viewer: trim, cap and loop arguments, live position, seeks.
+
+    ``playback`` holds the bot's caption settings: start (seconds into the file),
+    duration (cap), loops (0 = forever) and length (file duration, when known).
+    A still image has ``hold`` instead: ffplay keeps showing it, so the session
+    ends that many seconds after launch. A seek replaces only ffplay; the viewer
+    process around it stays.
+    """
+
+    def __init__(self, command: list[str], media_path: str, playback: dict[str, str]):
+        self.command = command  # ffplay and its arguments, without trim/loop and the input
+        self.media_path = media_path
+        self.start = float(playback.get('start') or 0)
+        duration = float(playback.get('duration') or 0)
+        self.end = self.start + duration if duration > 0 else None
+        self.loops = int(playback.get('loops') or 1)
+        self.length = float(playback.get('length') or 0) or None
+        self.hold = float(playback.get('hold') or 0) or None
+        self.first_frame = threading.Event()
+        self.first_frame_at: float | None = None  # monotonic time ffplay first reported its clock
+        self.process: subprocess.Popen | None = None
+        self._state = {'clock': None, 'wraps': 0}
+        self._launch = (0.0, 0.0, 1)  # (position, monotonic time, loops) of the running ffplay
+        self._loops_after: int | None = None  # after a seek: loops to play from the start (0 = forever)
+
+    def launch(self, position: float, loops: int) -> subprocess.Popen:
+        args = [*self.command, '-stats']  # status lines carry the clock (and show the first frame)
+        if position > 0:
+            args += ['-ss', f"{position:.3f}"]
+        if self.end is not None:
+            args += ['-t', f"{max(0.1, self.end - position):.3f}"]
+        if loops != 1:
+            args += ['-loop', str(loops)]
+        self.process = subprocess.Popen(
+            [*args, self.media_path], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        self._state = {'clock': None, 'wraps': 0}
+        self._launch = (position, time.monotonic(), loops)
+        threading.Thread(target=self._watch_stats, args=(self.process.stderr, self._state), daemon=True).start()
+        return self.process
+
+    def _watch_stats(self, stream, state: dict) -> None:
+        # ffplay -stats writes "\r"-terminated status lines. The clock in front of "A-V:"/"M-V:"/"M-A:"
+        # is "nan" until playback really started; the first number means a frame is on screen.
+        # The pipe is drained to the end so ffplay never blocks on a full stderr.
+        seen = b''
+        try:
+            while chunk := stream.read1(4096):
+                seen = (seen + chunk)[-256:]
+                last = None
+                for last in _PLAYER_CLOCK.finditer(seen):
+                    pass
+                if last is None:
+                    continue
+                clock = float(last.group(1))
+                if state['clock'] is not None and clock < state['clock'] - 1.0:
+                    state['wraps'] += 1  # -loop went back to the start
+                state['clock'] = clock
+                seen = seen[last.end():]
+                if self.first_frame_at is None:
+                    self.first_frame_at = time.monotonic()
+                self.first_frame.set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.first_frame.set()
+
+    def showing(self) -> bool:
+        """ffplay has put a frame on screen (first_frame is also set when it dies without one)."""
+        return self.first_frame.is_set() and self._state['clock'] is not None
+
+    def report_start(self, deadline: float, is_stopped) -> None:
+        """Emit 'started' for a scheduled start once ffplay has a frame (or sound) out, timed against ``deadline``."""
+        give_up = time.monotonic() + SCHEDULE_PREPARE_LEAD
+        while not self.first_frame.wait(0.02) and not is_stopped() and time.monotonic() < give_up:
+            pass
+        if self.showing():
+            _emit_viewer_event('started', error_ms=round((self.first_frame_at - deadline) * 1000, 1))
+
+    def finished(self) -> bool:
+        if self.hold is not None and time.monotonic() >= self._launch[1] + self.hold:
+            return True
+        return self.process.poll() is not None
+
+    def position(self) -> float:
+        if self._state['clock'] is not None:
+            return self._state['clock']
+        position, launched_at, _ = self._launch
+        return position + time.monotonic() - launched_at
+
+    def seek(self, target: float) -> float:
+        """Restart ffplay at ``target`` seconds; returns the position actually used."""
+        limit = self.end if self.end is not None else self.length
+        target = max(0.0, target if limit is None else min(target, limit - 0.5))
+        _, _, loops = self._launch
+        if loops == 0 or self._loops_after == 0:
+            loops_after = 0
+        else:
+            # This iteration continues from the target; the ones still owed play from the start.
+            owed = (loops - self._state['wraps'] - 1) + (self._loops_after or 0)
+            loops_after = owed if owed > 0 else None
+        self.stop()
+        self.launch(target, 1)
+        self._loops_after = loops_after
+        return target
+
+    def continue_after_exit(self) -> bool:
+        """ffplay finished; start the loops still owed after a seek. False when playback is over."""
+        if self._loops_after is None:
+            return False
+        loops, self._loops_after = self._loops_after, None
+        self.launch(self.start, loops)
+        return True
+
+    def stop(self) -> None:
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            process.terminate()
+            process.wait(timeout=2)
+        except Exception:
+            try:
+                process.kill()
+            except Exception:
+                pass
+
+
+def _read_viewer_commands(commands: queue.Queue) -> None:
+    # Runs in a daemon thread: JSON command lines the bot writes to the viewer's stdin, until EOF.
+    try:
+        for line in sys.stdin:
+            try:
+                commands.put(json.loads(line))
+            except ValueError:
+                continue
+    except (OSError, ValueError):
+        pass
+
+
+def _play_until_done(session: _FfplaySession, is_stopped, geometry: str | None = None,
+                     kind: str | None = None, item_path: str | None = None) -> None:
+    """Wait for ffplay to finish, applying commands from the bot without a new viewer.
+
+    seek restarts ffplay at another position. play (video and ffplay-shown images)
+    takes over the next item: its ffplay starts while the current one stays up and
+    the current one is closed once the new window has a frame, so the screen never
+    goes blank and no viewer has to start. ``item_path`` is the current item's file,
+    removed once the viewer is past it. Stops whichever session is current at the end.
+    """
+    commands = queue.Queue()
+    threading.Thread(target=_read_viewer_commands, args=(commands,), daemon=True).start()
+    shown = False
+    try:
+        while not is_stopped():
+            if not shown and session.showing():
+                shown = True
+                _emit_viewer_event('shown', kind=kind)
+            try:
+                command = commands.get(timeout=0.1 if shown else 0.01)
+            except queue.Empty:
+                if session.finished() and not session.continue_after_exit():
+                    return
+                continue
+            if command.get('cmd') == 'seek' and session.hold is None:
+                target = float(command['to']) if 'to' in command else session.position() + float(command.get('by', 0))
+                _emit_viewer_event('seeked', position=round(session.seek(target), 2))
+            elif command.get('cmd') == 'play':
+                kind = command['kind']
+                following = _ffplay_item_session(kind, command['path'], int(command['seconds']), geometry,
+                                                 command.get('options') or {})
+                _emit_viewer_event('loaded', path=command['path'])
+                following.launch(following.start, following.loops)
+                give_up = time.monotonic() + POSTER_MAX_SECONDS
+                while not following.first_frame.wait(0.02) and not is_stopped() and time.monotonic() < give_up:
+                    pass
+                session.stop()
+                if item_path:
+                    _remove_quietly(item_path)
+                session, item_path, shown = following, command['path'], False
+    finally:
+        session.stop()
+        if item_path:
+            _remove_quietly(item_path)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _hold_poster(root, close, handed_over) -> None:
+    """Keep the poster up until ``handed_over()`` or POSTER_MAX_SECONDS, then close it."""
+    give_up = time.monotonic() + POSTER_MAX_SECONDS
+
+    def _poll():
+        if handed_over() or time.monotonic() > give_up:
+            close()
+        else:
+            root.after(10, _poll)
+
+    root.after(10, _poll)
     root.mainloop()
 
 
-def _run_viewer_video(video_path: str, display_time: int) -> int:
-    """Play video with audio using FFmpeg for perfect sync."""
+def _ffplay_placement(geometry: str | None) -> list[str]:
+    if geometry:
+        # Borderless window covering one specific display
+        width, height, left, top = _parse_geometry(geometry)
+        return ['-noborder', '-left', str(left), '-top', str(top), '-x', str(width), '-y', str(height)]
+    if sys.platform == "win32":  # Windows
+        return ['-fs', '-x', '1920', '-y', '1080']  # Fullscreen, forced size
+    return ['-fs']  # Fullscreen (macOS / Linux)
+
+
+def _ffplay_item_session(kind: str, media_path: str, display_time: int, geometry: str | None,
+                         options: dict[str, str]) -> _FfplaySession:
+    """The ffplay session for one video, or one still image with the ffplay image backend."""
+    # The bot passes the ffplay it discovered at startup; look it up only when run standalone
+    command = [options.get('ffplay') or _find_media_tool('ffplay') or "ffplay", *_ffplay_placement(geometry),
+               '-v', 'quiet']
+    if kind == 'image':
+        # Scaled once by the player's lanczos filter, like the Tk path, instead of per frame by SDL.
+        if geometry:
+            size = _parse_geometry(geometry)[:2]
+        elif options.get('screen'):
+            size = tuple(int(n) for n in options['screen'].split('x'))
+        else:
+            size = None  # unknown screen: ffplay's window scaling fits it instead
+        if size:
+            command += ['-vf', f"scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease:flags=lanczos"]
+        # No -autoexit: ffplay keeps the last frame up until the hold is over
+        playback = {'hold': str(max(1, int(display_time))), 'loops': '0' if options.get('animated') else '1'}
+        return _FfplaySession([*command, '-an'], media_path, playback)
+
+    play_path, audio_filter = _loudness_source(media_path, options)
+    return _FfplaySession([
+        *command,
+        '-autoexit',  # Exit when video ends
+        *_ffplay_profile_args(options, kind),  # launch profile: probing, buffering, frame dropping, sync
+        *audio_filter,
+    ], play_path, options)
+
+
+def _run_viewer_ffplay(kind: str, media_path: str, display_time: int, geometry: str | None = None,
+                       start_at: float | None = None, options: dict[str, str] | None = None) -> int:
+    """Play video with audio using FFmpeg for perfect sync; still images too with the ffplay backend.
+
+    With a poster (video only, not for scheduled starts), the poster is shown in the viewer
+    window right away and replaced by ffplay once it reports its first frame.
+    Trim, cap, loop and live seeks come from ``options`` (see _FfplaySession), and the
+    bot can hand the viewer its next video/image while it is on screen (see _play_until_done).
+    """
     
     stopped = False
+    session = None
+    options = options or {}
     
     def signal_handler(signum, frame):
         nonlocal stopped
@@ -184,146 +958,149 @@ def _run_viewer_video(video_path: str, display_time: int) -> int:
         signal.signal(signal.SIGUSR1, signal_handler)
 
     try:
-        # Check for local FFmpeg installation first
-        local_ffmpeg = Path("ffmpeg")
-        ffplay_path = None
-        
-        if sys.platform == "win32":
-            ffplay_exe = local_ffmpeg / "bin" / "ffplay.exe"
-            if ffplay_exe.exists():
-                ffplay_path = str(ffplay_exe)
-        
-        # Use system or local FFmpeg
-        ffplay_cmd = ffplay_path if ffplay_path else "ffplay"
-        
-        # Use FFmpeg for both video and audio playback
-        if sys.platform == "win32":  # Windows
-            cmd = [
-                ffplay_cmd, 
-                '-fs',  # Fullscreen
-                '-autoexit',  # Exit when video ends
-                '-v', 'quiet',  # Suppress verbose output
-                '-x', '1920',  # Force width
-                '-y', '1080',  # Force height
-                video_path
-            ]
-        elif sys.platform == "darwin":  # macOS
-            cmd = [
-                ffplay_cmd, 
-                '-fs',  # Fullscreen
-                '-autoexit',  # Exit when video ends
-                '-v', 'quiet',  # Suppress verbose output
-                video_path
-            ]
-        else:  # Linux
-            cmd = [
-                ffplay_cmd, 
-                '-fs',  # Fullscreen
-                '-autoexit',
-                '-v', 'quiet',
-                video_path
-            ]
+        session = _ffplay_item_session(kind, media_path, display_time, geometry, options)
         
+        if start_at is not None:
+            deadline = _monotonic_deadline(start_at)
+            if not _sleep_until(deadline, lambda: stopped):
+                return 0
+
         # Start FFmpeg process
-        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # Wait for process to complete or manual stop
-        while process.poll() is None and not stopped:
-            time.sleep(0.1)
-        
-        # Clean up if still running (shouldn't happen with -autoexit)
-        if process.poll() is None:
+        process = session.launch(session.start, session.loops)
+        if start_at is not None:
+            session.report_start(deadline, lambda: stopped)
+
+        poster_path = options.get('poster')
+        if start_at is None and poster_path and os.path.exists(poster_path):
+            # ffplay keeps its window hidden until the first frame, so the poster window
+            # opened meanwhile stays visible up to the moment the video covers it.
             try:
-                process.terminate()
-                process.wait(timeout=2)
-            except Exception:
-                try:
-                    process.kill()
-                except Exception:
-                    pass
+                root, close = _show_poster(poster_path, geometry)
+                if hasattr(signal, 'SIGUSR1'):
+                    signal.signal(signal.SIGUSR1, signal_handler)  # the window installed its own
+                _hold_poster(root, close, lambda: session.first_frame.is_set() or stopped or process.poll() is not None)
+            except (Exception, MemoryError) as e:
+                # The video itself still plays; only the poster is lost.
+                logger.warning(f"Poster not shown: {e!r}")
         
+        # Wait for the item to complete or manual stop; seeks and handed-over items restart only ffplay
+        _play_until_done(session, lambda: stopped, geometry, kind, media_path)
         return 0
         
     except FileNotFoundError:
         # FFmpeg not found
         return 7
     except Exception as e:
-        logger.error(f"Video playback error: {e}")
+        logger.error(f"{kind.capitalize()} playback error: {e}")
         return 8
+    finally:
+        if session is not None:
+            session.stop()
 
 
-def _run_viewer_audio(audio_path: str, display_time: int) -> int:
+def _run_viewer_audio(audio_path: str, display_time: int, start_at: float | None = None,
+                      ffplay_path: str | None = None, audio_filter: list[str] | None = None,
+                      profile_args: list[str] | None = None, playback: dict[str, str] | None = None) -> int:
     """Play audio file in background without any visual display."""
-    audio_process = None
+    session = None
+    stopped = False
+
+    def signal_handler(signum, frame):
+        nonlocal stopped
+        stopped = True
+
+    # Handle remote cancel signal; without it SIGUSR1 would kill the viewer and orphan ffplay
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, signal_handler)
     
     try:
-        # Check for local FFmpeg installation first
-        local_ffmpeg = Path("ffmpeg")
-        ffplay_path = None
-        
-        if sys.platform == "win32":
-            ffplay_exe = local_ffmpeg / "bin" / "ffplay.exe"
-            if ffplay_exe.exists():
-                ffplay_path = str(ffplay_exe)
-        
-        # Use system or local FFmpeg
-        ffplay_cmd = ffplay_path if ffplay_path else "ffplay"
+        if start_at is not None:
+            deadline = _monotonic_deadline(start_at)
+            if not _sleep_until(deadline, lambda: stopped):
+                return 0
+
+        ffplay_cmd = ffplay_path or _find_media_tool('ffplay') or "ffplay"
         
         if SUBPROCESS_AUDIO_AVAILABLE:
-            # Use FFmpeg for audio playback to ensure proper duration
-            if sys.platform == "win32":  # Windows
-                audio_process = subprocess.Popen([
-                    ffplay_cmd, '-nodisp', '-autoexit', '-v', 'quiet', audio_path
-                ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            elif sys.platform == "darwin":  # macOS
-                audio_process = subprocess.Popen([
-                    ffplay_cmd, '-nodisp', '-autoexit', '-v', 'quiet', audio_path
-                ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            else:  # Linux
-                audio_process = subprocess.Popen([
-                    ffplay_cmd, '-nodisp', '-autoexit', '-v', 'quiet', audio_path
-                ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            # Use FFmpeg for audio playback to ensure proper duration (same command on every platform)
+            session = _FfplaySession([
+                ffplay_cmd, '-nodisp', '-autoexit', '-v', 'quiet', *(profile_args or []), *(audio_filter or []),
+            ], audio_path, playback or {})
+            session.launch(session.start, session.loops)
         else:
             return 5  # No audio available
 
+        if start_at is not None:
+            session.report_start(deadline, lambda: stopped)
         logger.info(f"Playing audio: {audio_path}")
 
-        # Wait for audio to finish naturally (let -autoexit handle it)
-        while audio_process.poll() is None:
-            time.sleep(0.1)
-
+        # Wait for audio to finish naturally (let -autoexit handle it) or manual stop
+        _play_until_done(session, lambda: stopped, kind='audio')
         return 0
 
     except Exception as e:
         logger.error(f"Error playing audio: {e}")
         return 6
+    finally:
+        if session is not None:
+            session.stop()
+
+
+def _parse_viewer_options(args: list[str]) -> dict[str, str]:
+    options = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            raise ValueError(f"invalid viewer option: {arg}")
+        options[key] = value
+    return options
 
 
 def _viewer_main(argv: list[str]) -> int:
-    # argv: [--viewer, kind, path, seconds]
+    # argv: [--viewer, kind, path, seconds, key=value...]
     try:
         kind = argv[2]
         media_path = argv[3]
         seconds = int(argv[4])
+        options = _parse_viewer_options(argv[5:])
+        start_at = float(options['start_at']) if 'start_at' in options else None
+        memory_mb = int(options['memory_mb']) if 'memory_mb' in options else None
     except Exception:
         return 2
 
+    if memory_mb:
+        _apply_memory_budget(memory_mb * 1024 * 1024)
+    global _viewer_ffmpeg
+    _viewer_ffmpeg = options.get('ffmpeg')
+
     try:
-        if kind == 'image':
-            _run_viewer_image(media_path, seconds)
+        if kind == 'image' and options.get('backend') == 'ffplay':
+            return _run_viewer_ffplay(kind, media_path, seconds, options.get('geometry'), start_at, options)
+        elif kind == 'image':
+            _run_viewer_image(media_path, seconds, options.get('geometry'), start_at)
         elif kind == 'video':
-            return _run_viewer_video(media_path, seconds)
+            return _run_viewer_ffplay(kind, media_path, seconds, options.get('geometry'), start_at, options)
+        elif kind == 'slideshow':
+            _run_viewer_slideshow(media_path, seconds, options.get('geometry'))
         elif kind == 'audio':
-            return _run_viewer_audio(media_path, seconds)
+            play_path, audio_filter = _loudness_source(media_path, options)
+            return _run_viewer_audio(play_path, seconds, start_at, options.get('ffplay'), audio_filter,
+                                     _ffplay_profile_args(options, kind), options)
         else:
             # Unsupported viewer kind
             return 3
+    except MemoryError as e:
+        logger.error(f"Viewer memory budget exceeded: {e}")
+        return 9
     finally:
         try:
             if os.path.exists(media_path):
                 os.remove(media_path)
         except Exception:
             pass
+        peak_rss, children_peak_rss = _peak_rss()
+        _emit_viewer_event('memory', kind=kind, peak_rss=peak_rss, children_peak_rss=children_peak_rss,
+                           budget=memory_mb * 1024 * 1024 if memory_mb else None)
 
     return 0
 
@@ -339,6 +1116,10 @@ class MediaDisplay:
     
     def display_image(self, image_path: str, display_time: int = None):
         """Display an image in fullscreen mode."""
+        from PIL import Image, ImageTk
+        import tkinter as tk
+        from tkinter import ttk
+
         try:
             # Clean up any existing display
             self._cleanup()
@@ -505,105 +1286,1470 @@ class MediaDisplay:
 # Global variables
 media_display = MediaDisplay()
 should_exit = False  # bot paused flag
-_viewer_process: subprocess.Popen | None = None
+_viewer_processes: dict[int, subprocess.Popen] = {}  # display index -> viewer (audio uses 0)
+_display_target: int | str = 1  # 1-based display number, or 'all' to mirror
+_ffplay_profile = FFPLAY_DEFAULT_PROFILE  # launch profile for video/audio without profil= in the caption
+_image_backend = IMAGE_BACKEND
+_displays: list[tuple[int, int, int, int]] | None = None  # (x, y, width, height), primary first
+_album_buffers: dict[str, dict] = {}  # media_group_id -> collected album parts
+_scheduled_items: dict[int, dict] = {}  # schedule id -> pending item
+_schedule_history: deque = deque(maxlen=SCHEDULE_HISTORY_SIZE)  # measured start errors
+_schedule_ids = itertools.count(1)
+_reported_screen_size: tuple[int, int] | None = None  # primary screen size as reported by a viewer
+_metrics: Counter = Counter()
+_memory_history: deque = deque(maxlen=MEMORY_HISTORY_SIZE)  # peak RSS of recent viewers
+_media_tools: dict[str, dict | None] | None = None  # tool name -> path/version/decoders (None: missing)
+_media_tools_task: asyncio.Future | None = None
+
+
+def _query_media_tool(name: str, path: str) -> dict | None:
+    """Version of one tool, plus the decodable codecs for ffmpeg; None if it does not run."""
+    try:
+        result = subprocess.run([path, '-hide_banner', '-version'], capture_output=True, text=True,
+                                timeout=MEDIA_TOOL_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"{name} at {path} could not be run: {e}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"{name} at {path} exited with {result.returncode}")
+        return None
+    match = re.search(r'version (\S+)', result.stdout)
+    info = {'version': match.group(1) if match else None}
+
+    if name == 'ffmpeg':
+        # " DEV.LS h264    H.264 / AVC ..." -- a leading D means the codec can be decoded
+        try:
+            codecs = subprocess.run([path, '-hide_banner', '-codecs'], capture_output=True, text=True,
+                                    timeout=MEDIA_TOOL_TIMEOUT).stdout
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"ffmpeg codec list unavailable: {e}")
+            codecs = ''
+        codecs = codecs.partition(' -------')[2]  # skip the flag legend above the table
+        info['decoders'] = sorted(
+            match.group(1) for match in re.finditer(r'^ D[E.][VASDT.]\S*\s+(\S+)', codecs, re.MULTILINE)
+        )
+    return info
 
 
-def _start_viewer_subprocess(kind: str, media_path: str, seconds: int) -> None:
-    global _viewer_process
+def _owned_by_this_user(path: str) -> bool:
+    """True if ``path`` belongs to this user and nobody else can write it (always True on Windows)."""
+    if not hasattr(os, 'getuid'):
+        return True
+    stat = os.stat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
 
-    _stop_viewer_subprocess()
 
-    cmd = [sys.executable, os.path.abspath(__file__), '--viewer', kind, media_path, str(int(seconds))]
-    _viewer_process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def _private_cache_dir(path: str) -> bool:
+    """Create the cache directory ``path`` for this user only; False if it is not safe to use."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if _owned_by_this_user(path):
+            return True
+        logger.warning(f"Not using {path}: it belongs to another user or others can write to it")
+    except OSError as e:
+        logger.warning(f"Not using {path}: {e}")
+    return False
+
+
+def _discover_media_tools() -> dict[str, dict | None]:
+    """Resolve ffplay, ffmpeg and ffprobe once: absolute path, version and decodable codecs.
+
+    Tool output is cached on disk by path, size and modification time, so a
+    restart only re-runs the tools after they changed. Blocking; runs in a
+    worker thread started from post_init.
+    """
+    global _media_tools
+    try:
+        if not _owned_by_this_user(MEDIA_TOOLS_CACHE_PATH):
+            raise PermissionError("media tool cache is writable by another user")
+        with open(MEDIA_TOOLS_CACHE_PATH, encoding='utf-8') as f:
+            cache = json.load(f)
+    except PermissionError as e:
+        logger.warning(f"Ignoring {MEDIA_TOOLS_CACHE_PATH}: {e}")
+        cache = {}
+    except (OSError, ValueError):
+        cache = {}
+
+    tools = {}
+    for name in MEDIA_TOOLS:
+        path = _find_media_tool(name)
+        if path is None:
+            tools[name] = None
+            continue
+        stat = os.stat(path)
+        fingerprint = [path, stat.st_size, stat.st_mtime_ns]
+        cached = cache.get(name)
+        if cached and cached.get('fingerprint') == fingerprint and cached.get('path') == path:
+            tools[name] = cached
+            continue
+        info = _query_media_tool(name, path)
+        tools[name] = info and {'path': path, 'fingerprint': fingerprint, **info}
+
+    if tools != cache:
+        temp_path = f"{MEDIA_TOOLS_CACHE_PATH}.{os.getpid()}"
+        try:
+            # Private to this user from the first byte, and swapped in whole
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w',
+                           encoding='utf-8') as f:
+                json.dump(tools, f)
+            os.replace(temp_path, MEDIA_TOOLS_CACHE_PATH)
+        except OSError as e:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            logger.debug(f"Media tool cache not written: {e}")
+
+    _media_tools = tools
+    logger.info("Medya araçları: " + ", ".join(
+        f"{name} {tool['version']} ({tool['path']})" if tool else f"{name} yok" for name, tool in tools.items()
+    ))
+    return tools
+
+
+async def _media_tools_ready() -> dict[str, dict | None]:
+    """Discovery result, waiting for the background pass if it is still running."""
+    global _media_tools_task
+    if _media_tools is not None:
+        return _media_tools
+    if _media_tools_task is None:
+        _media_tools_task = asyncio.ensure_future(asyncio.to_thread(_discover_media_tools))
+    return await asyncio.shield(_media_tools_task)
+
+
+def _media_tool_path(name: str) -> str | None:
+    if _media_tools is not None:
+        tool = _media_tools.get(name)
+        return tool['path'] if tool else None
+    return _find_media_tool(name)
+
+
+def _decodable_codecs() -> set[str]:
+    # Empty when unknown (discovery pending or ffmpeg missing): nothing is rejected then.
+    ffmpeg = (_media_tools or {}).get('ffmpeg')
+    return set(ffmpeg.get('decoders') or ()) if ffmpeg else set()
+
+
+def _media_tools_summary() -> str:
+    if _media_tools is None:
+        return "kontrol ediliyor"
+    return ", ".join(
+        f"{name} {tool['version'] or '?'}" if tool else f"{name} yok" for name, tool in _media_tools.items()
+    )
 
 
-async def _ensure_viewer_started_or_report(update: Update, kind: str) -> None:
-    # Give the viewer a moment to initialize; if it exits immediately, report.
-    await asyncio.sleep(0.35)
-    if _viewer_process is None:
-        return
-    code = _viewer_process.poll()
-    if code is None:
-        return
+class MediaProbeError(Exception):
+    """Raised when a downloaded file is corrupt or cannot be played."""
 
-    elif kind == 'video':
-        if code == 3:
-            await update.effective_message.reply_text(
-                "❌ Video açılamadı: `opencv-python` kurulu değil.\n"
-                "Terminalde şunu çalıştır: `python -m pip install -r requirements.txt`"
-            )
-        elif code == 4:
-            await update.effective_message.reply_text("❌ Video dosyası açılamadı / bozuk olabilir.")
-        elif code == 7:
-            await update.effective_message.reply_text(
-                "❌ Video açılamadı: FFmpeg kurulu değil.\n"
-                "macOS için: `brew install ffmpeg`\n"
-                "Windows/Linux için: FFmpeg indirip kurun"
-            )
-        elif code == 8:
-            await update.effective_message.reply_text("❌ Video oynatma hatası.")
-        else:
-            await update.effective_message.reply_text("❌ Video viewer başlatılamadı.")
-    elif kind == 'audio':
-            if code == 5:
-                await update.effective_message.reply_text(
-                    "❌ Ses açılamadı: Ses kütüphanesi kurulu değil.\n"
-                    "macOS için: afplay zaten kurulu olmalı\n"
-                    "Windows/Linux için: FFmpeg kurun"
-                )
-            elif code == 6:
-                await update.effective_message.reply_text("❌ Ses dosyası açılamadı / bozuk olabilir.")
-            else:
-                await update.effective_message.reply_text("❌ Ses oynatıcı başlatılamadı.")
-    else:
-        await update.effective_message.reply_text("❌ Görsel viewer başlatılamadı.")
 
+# content hash -> metadata (kind, duration, width, height, codec, frames)
+_probe_cache: "OrderedDict[str, dict]" = OrderedDict()
+_probe_cache_lock = threading.Lock()  # probes run in several worker threads at once
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _probe_image(path: str) -> dict:
+    # Image.open only parses the header; pixel data is decoded later by the viewer.
+    from PIL import Image
 
-def _stop_viewer_subprocess() -> None:
-    global _viewer_process
-    if _viewer_process is None:
-        return
     try:
-        if _viewer_process.poll() is None:
-            # Preferred: viewer listens SIGUSR1 for remote cancel.
-            if hasattr(signal, 'SIGUSR1'):
-                try:
-                    _viewer_process.send_signal(signal.SIGUSR1)
-                except Exception:
-                    pass
+        with Image.open(path) as img:
+            return {
+                'kind': 'image',
+                'duration': None,
+                'width': img.width,
+                'height': img.height,
+                'codec': (img.format or '').lower() or None,
+                'frames': getattr(img, 'n_frames', 1),
+            }
+    except Exception as e:
+        raise MediaProbeError(f"unreadable image: {e}") from e
+
+
+def _probe_av(path: str, kind: str) -> dict:
+    unprobed = {'kind': kind, 'duration': None, 'width': None, 'height': None, 'codec': None, 'frames': None}
+    ffprobe = _media_tool_path('ffprobe')
+    if ffprobe is None:
+        # Without ffprobe we cannot verify the file; let the viewer try.
+        logger.warning("ffprobe not found, skipping media probe")
+        return unprobed
+    cmd = [
+        ffprobe, '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', path,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except FileNotFoundError:
+        logger.warning("ffprobe not found, skipping media probe")
+        return unprobed
+    except subprocess.TimeoutExpired as e:
+        raise MediaProbeError("ffprobe timed out") from e
 
-            try:
-                _viewer_process.wait(timeout=2)
-            except Exception:
-                # Fallback
-                try:
-                    _viewer_process.terminate()
-                except Exception:
-                    pass
-                try:
-                    _viewer_process.wait(timeout=2)
-                except Exception:
-                    try:
-                        _viewer_process.kill()
-                    except Exception:
-                        pass
+    if result.returncode != 0:
+        raise MediaProbeError(result.stderr.strip() or f"ffprobe exited with {result.returncode}")
+    try:
+        data = json.loads(result.stdout or '{}')
+    except ValueError as e:
+        raise MediaProbeError(f"invalid ffprobe output: {e}") from e
+
+    streams = data.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    main_stream = video if kind == 'video' else audio
+    if main_stream is None:
+        raise MediaProbeError(f"no {kind} stream found")
+    decoders = _decodable_codecs()
+    if decoders and main_stream.get('codec_name') not in decoders:
+        raise MediaProbeError(f"no decoder for {main_stream.get('codec_name')}")
+
+    try:
+        duration = float((data.get('format') or {}).get('duration') or main_stream.get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    try:
+        frames = int(main_stream['nb_frames']) if video is not None and 'nb_frames' in main_stream else None
+    except (TypeError, ValueError):
+        frames = None
+
+    return {
+        'kind': kind,
+        'duration': duration,
+        'width': video.get('width') if video else None,
+        'height': video.get('height') if video else None,
+        'codec': main_stream.get('codec_name'),
+        'frames': frames,
+    }
+
+
+def _probe_media(path: str, kind: str) -> dict:
+    """Read the media headers and return its metadata, cached by content hash.
+
+    Raises MediaProbeError for corrupt or unsupported files so they can be
+    rejected before a viewer is spawned. Blocking; call via ``asyncio.to_thread``.
+    """
+    content_hash = _file_sha256(path)
+    cache_key = f"{kind}:{content_hash}"
+    with _probe_cache_lock:
+        cached = _probe_cache.get(cache_key)
+        if cached is not None:
+            _probe_cache.move_to_end(cache_key)
+            return dict(cached)
+
+    started = time.monotonic()
+    info = _probe_image(path) if kind == 'image' else _probe_av(path, kind)
+    info['hash'] = content_hash
+    logger.debug(f"Probed {kind} in {time.monotonic() - started:.3f}s: {info}")
+
+    with _probe_cache_lock:
+        _probe_cache[cache_key] = info
+        while len(_probe_cache) > PROBE_CACHE_MAX_ENTRIES:
+            _probe_cache.popitem(last=False)
+    return dict(info)
+
+
+# content hash -> {'gain_db', 'plays', 'rendering'}; gain_db stays None until the analysis is done
+_loudness_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _analyze_loudness(path: str) -> float | None:
+    """Gain in dB that brings the first audio stream to LOUDNESS_TARGET_LUFS, or None.
+
+    One full decode through ffmpeg's loudnorm analysis; blocking, call via
+    ``asyncio.to_thread``. None means there is nothing to correct or it could
+    not be measured (no ffmpeg, no audio stream, silence, timeout).
+    """
+    ffmpeg = _media_tool_path('ffmpeg')
+    if ffmpeg is None:
+        return None
+    cmd = [
+        ffmpeg, '-hide_banner', '-nostats', '-i', path, '-map', '0:a:0', '-vn',
+        '-af', f'loudnorm=I={LOUDNESS_TARGET_LUFS}:TP={LOUDNESS_TRUE_PEAK_DB}:print_format=json',
+        '-f', 'null', '-',
+    ]
+    started = time.monotonic()
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=LOUDNESS_ANALYSIS_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Loudness analysis failed for {path}: {e}")
+        return None
+    # loudnorm prints its measurement as the last JSON block on stderr
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', result.stderr)
+    if result.returncode != 0 or match is None:
+        logger.debug(f"No loudness measurement for {path}: {result.stderr.strip()[-200:]}")
+        return None
+    try:
+        measured = json.loads(match.group(0))
+        input_i = float(measured['input_i'])
+        input_tp = float(measured['input_tp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if input_i == float('-inf'):
+        return None  # silence
+
+    gain = min(LOUDNESS_TARGET_LUFS - input_i, LOUDNESS_TRUE_PEAK_DB - input_tp)
+    gain = max(-LOUDNESS_MAX_GAIN_DB, min(LOUDNESS_MAX_GAIN_DB, gain))
+    logger.info(f"Loudness {input_i:.1f} LUFS (peak {input_tp:.1f} dBTP), gain {gain:+.1f} dB, "
+                f"measured in {time.monotonic() - started:.2f}s")
+    return gain if abs(gain) >= LOUDNESS_MIN_GAIN_DB else None
+
+
+def _measure_loudness(source_path: str, entry: dict) -> None:
+    """Fill in ``entry``'s gain from ``source_path`` (which is consumed); runs in a worker thread."""
+    try:
+        entry['gain_db'] = _analyze_loudness(source_path)
     finally:
-        _viewer_process = None
+        try:
+            os.remove(source_path)
+        except OSError:
+            pass
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Kullanıcı /start komutunu gönderdiğinde bir karşılama mesajı gönderir."""
-    if not _is_authorized(update):
-        return
-        
-    user = update.effective_user
-    welcome_message = (
-        f"👋 Merhaba {user.first_name}!\n\n"
-        "📸 Bana bir resim veya video gönderin, tam ekran olarak göstereyim.\n"
-        "🎵 MP3 ses dosyalarını arka planda çalabilirim.\n"
-        "⏱️ Görüntüleme süresini ayarla: /sure 10\n"
-        "🧹 Aktif görüntüyü/sesi kapat: /iptal\n"
-        "🔒 Görüntü açıkken yerelden kapatma engellenir (süre bitene kadar).\n"
-        "⏹️  Acil durdur: /durdur\n"
+
+def _trim_cache_dir(directory: str, pattern: str, max_files: int) -> None:
+    """Delete all but the ``max_files`` most recently used files matching ``pattern``."""
+    files = sorted(Path(directory).glob(pattern), key=lambda p: p.stat().st_mtime)
+    for old in files[:-max_files]:
+        old.unlink(missing_ok=True)
+
+
+def _rendition_path(content_hash: str) -> str:
+    return os.path.join(LOUDNESS_RENDITION_DIR, f"{content_hash}.mkv")
+
+
+def _render_normalized(source_path: str, content_hash: str, gain_db: float) -> None:
+    """Write a pre-normalized copy of ``source_path`` (which is consumed) into the rendition cache."""
+    rendition = _rendition_path(content_hash)
+    part_path = rendition + '.part'
+    try:
+        ffmpeg = _media_tool_path('ffmpeg')
+        if ffmpeg is None or not _private_cache_dir(LOUDNESS_RENDITION_DIR):
+            return
+        # Matroska takes any video codec as is; the audio is re-encoded losslessly after the gain.
+        cmd = [
+            ffmpeg, '-hide_banner', '-nostats', '-y', '-i', source_path, '-map', '0:v?', '-map', '0:a:0',
+            '-c:v', 'copy', '-af', f'volume={gain_db:.2f}dB', '-c:a', 'flac', '-f', 'matroska', part_path,
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=LOUDNESS_RENDER_TIMEOUT)
+        if result.returncode != 0:
+            logger.warning(f"Normalized rendition failed: {result.stderr.strip()[-200:]}")
+            return
+        os.replace(part_path, rendition)
+        logger.info(f"Stored normalized rendition {rendition}")
+
+        _trim_cache_dir(LOUDNESS_RENDITION_DIR, '*.mkv', LOUDNESS_RENDITION_MAX_FILES)
+    except Exception as e:
+        logger.warning(f"Normalized rendition failed: {e}")
+    finally:
+        for path in (source_path, part_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def _loudness_options(kind: str, path: str, media_info: dict) -> dict:
+    """Viewer options that play this item at the target loudness.
+
+    The analysis runs once per content hash in the background: the first play
+    starts right away at the original level and the gain applies from the next
+    play on. Once an item has been played LOUDNESS_RENDITION_AFTER_PLAYS times
+    a normalized copy is rendered in the background and later plays use it
+    instead of a live volume filter.
+    """
+    content_hash = media_info.get('hash')
+    if kind not in ('audio', 'video') or LOUDNESS_TARGET_LUFS is None or not content_hash:
+        return {}
+    duration = media_info.get('duration')
+    if duration is not None and duration > LOUDNESS_MAX_DURATION:
+        return {}
+
+    entry = _loudness_cache.get(content_hash)
+    if entry is None:
+        entry = _loudness_cache[content_hash] = {'gain_db': None, 'plays': 0, 'rendering': None}
+        while len(_loudness_cache) > LOUDNESS_CACHE_MAX_ENTRIES:
+            _loudness_cache.popitem(last=False)
+        _metrics['loudness_analyses'] += 1
+        # A full decode can take most of LOUDNESS_ANALYSIS_TIMEOUT; never make the screen wait for it.
+        # The viewer deletes its input when done, so the analysis works on its own link/copy.
+        _run_in_background(_measure_loudness, _clone_file(path, 'lufs'), entry)
+    else:
+        _loudness_cache.move_to_end(content_hash)
+    entry['plays'] += 1
+    if entry['gain_db'] is None:
+        return {}
+
+    rendition = _rendition_path(content_hash)
+    if os.path.exists(rendition) and _private_cache_dir(LOUDNESS_RENDITION_DIR):
+        os.utime(rendition)  # most recently used survives the cleanup
+        return {'rendition': rendition}
+    if (LOUDNESS_RENDITION_AFTER_PLAYS and entry['plays'] >= LOUDNESS_RENDITION_AFTER_PLAYS
+            and entry['rendering'] is None):
+        # The viewer deletes its input when done, so the renderer works on its own link/copy.
+        source = _clone_file(path, 'loud')
+        entry['rendering'] = asyncio.create_task(
+            asyncio.to_thread(_render_normalized, source, content_hash, entry['gain_db'])
+        )
+    return {'gain_db': f"{entry['gain_db']:.2f}"}
+
+
+def _enumerate_displays_windows() -> list[tuple[int, int, int, int]]:
+    import ctypes
+    from ctypes import wintypes
+
+    displays = []
+    monitor_enum_proc = ctypes.WINFUNCTYPE(
+        ctypes.c_int, wintypes.HMONITOR, wintypes.HDC, ctypes.POINTER(wintypes.RECT), wintypes.LPARAM
+    )
+
+    def _callback(_monitor, _dc, rect, _data):
+        r = rect.contents
+        displays.append((r.left, r.top, r.right - r.left, r.bottom - r.top))
+        return 1
+
+    ctypes.windll.user32.EnumDisplayMonitors(None, None, monitor_enum_proc(_callback), 0)
+    # The primary monitor is the one at the virtual desktop origin.
+    return sorted(displays, key=lambda d: ((d[0], d[1]) != (0, 0), d[0], d[1]))
+
+
+def _enumerate_displays_xrandr() -> list[tuple[int, int, int, int]]:
+    result = subprocess.run(['xrandr', '--listmonitors'], capture_output=True, text=True, timeout=5)
+    displays = []
+    # " 0: +*HDMI-1 1920/531x1080/299+0+0  HDMI-1"; '*' marks the primary monitor
+    for line in result.stdout.splitlines():
+        match = re.match(r'\s*\d+:\s+\+?(\*?)\S+\s+(\d+)/\d+x(\d+)/\d+\+(-?\d+)\+(-?\d+)', line)
+        if match:
+            primary, width, height, x, y = match.groups()
+            displays.append((not primary, int(x), int(y), int(width), int(height)))
+    return [d[1:] for d in sorted(displays)]
+
+
+def _enumerate_displays(refresh: bool = False) -> list[tuple[int, int, int, int]]:
+    """Return the connected displays as (x, y, width, height), primary first.
+
+    An empty list means the layout is unknown; viewers then go fullscreen on
+    the primary screen as before.
+    """
+    global _displays
+    if _displays is not None and not refresh:
+        return _displays
+
+    displays = []
+    try:
+        if sys.platform == "win32":
+            displays = _enumerate_displays_windows()
+        elif sys.platform != "darwin" and shutil.which('xrandr'):
+            displays = _enumerate_displays_xrandr()
+    except Exception as e:
+        logger.warning(f"Display enumeration failed: {e}")
+
+    _displays = displays
+    logger.info(f"Displays: {displays or 'unknown (primary only)'}")
+    return displays
+
+
+def _target_displays() -> list[tuple[int, int, int, int]]:
+    """Displays selected by the current target; empty when the layout is unknown."""
+    displays = _enumerate_displays()
+    if _display_target == 'all' or not displays:
+        return displays
+    index = _display_target - 1
+    return [displays[index if 0 <= index < len(displays) else 0]]
+
+
+def _display_geometries() -> list[str | None]:
+    """Viewer geometries for the current display target (None = primary fullscreen)."""
+    if len(_enumerate_displays()) < 2:
+        return [None]
+    return [f"{w}x{h}+{x}+{y}" for x, y, w, h in _target_displays()]
+
+
+def _remember_screen_size(event: dict) -> None:
+    global _reported_screen_size
+    if _reported_screen_size is None:
+        _reported_screen_size = (int(event['width']), int(event['height']))
+        logger.info(f"Viewer reported screen size {_reported_screen_size[0]}x{_reported_screen_size[1]}")
+
+
+def _record_viewer_memory(event: dict) -> None:
+    # The heavier of the viewer itself and its ffplay child is what counts against the host.
+    peak = max(event.get('peak_rss') or 0, event.get('children_peak_rss') or 0) or None
+    _memory_history.append({'kind': event.get('kind'), 'peak_rss': peak, 'budget': event.get('budget')})
+    if peak and event.get('budget') and peak > 0.8 * event['budget']:
+        logger.warning(f"{event.get('kind')} viewer peaked at {peak / 2**20:.0f} MB "
+                       f"of its {event['budget'] / 2**20:.0f} MB budget")
+
+
+def _memory_summary() -> str:
+    if not _memory_history:
+        return "-"
+    last = _memory_history[-1]
+    if last['peak_rss'] is None:
+        return f"bilinmiyor ({last['kind']})"
+    peaks = [m['peak_rss'] for m in _memory_history if m['peak_rss']]
+    budget = f" / {last['budget'] / 2**20:.0f} MB" if last['budget'] else ""
+    return (f"{last['peak_rss'] / 2**20:.0f} MB{budget} ({last['kind']}), "
+            f"son {len(peaks)} öğede en yüksek {max(peaks) / 2**20:.0f} MB")
+
+
+def _target_screen_size() -> tuple[int, int] | None:
+    """Largest width/height media will be shown at, or None when unknown."""
+    targets = _target_displays()
+    if targets:
+        return max(w for _x, _y, w, _h in targets), max(h for _x, _y, _w, h in targets)
+    return _reported_screen_size
+
+
+def _select_photo_size(photo_sizes):
+    """Smallest PhotoSize that still covers the target screen, else the largest one.
+
+    A size covers the screen when fitting it needs no upscaling, i.e. it is at
+    least as wide or at least as tall as the screen.
+    """
+    largest = photo_sizes[-1]
+    screen_size = _target_screen_size()
+    if screen_size is None:
+        return largest
+
+    screen_width, screen_height = screen_size
+    covering = [p for p in photo_sizes if p.width >= screen_width or p.height >= screen_height]
+    if not covering:
+        return largest
+    chosen = min(covering, key=lambda p: p.width * p.height)
+
+    if chosen is not largest and chosen.file_size and largest.file_size:
+        _metrics['photo_bytes_saved'] += largest.file_size - chosen.file_size
+        logger.debug(f"Photo {chosen.width}x{chosen.height} instead of {largest.width}x{largest.height}")
+    return chosen
+
+
+def _clone_file(path: str, index: int | str) -> str:
+    base, ext = os.path.splitext(path)
+    clone_path = f"{base}_d{index}{ext}"
+    try:
+        os.link(path, clone_path)
+    except OSError:
+        shutil.copyfile(path, clone_path)
+    return clone_path
+
+
+def _clone_for_display(kind: str, media_path: str, index: int) -> str:
+    # Every viewer deletes its own files on exit, so mirrored viewers need their own copy.
+    clone_path = _clone_file(media_path, index)
+    if kind == 'slideshow':
+        slides = [_clone_file(path, index) for path in _read_slideshow_manifest(media_path)]
+        with open(clone_path, 'w', encoding='utf-8') as f:
+            json.dump(slides, f)
+    return clone_path
+
+
+def _read_viewer_events(process: subprocess.Popen) -> None:
+    # Runs in a daemon thread per viewer until the viewer closes its stdout.
+    decode_sample = None
+    try:
+        for line in process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            logger.debug(f"Viewer {process.pid} event: {event}")
+            process.viewer_events.append(event)
+            if event.get('event') == 'screen':
+                _remember_screen_size(event)
+            elif event.get('event') == 'memory' and event.get('stage') == 'decode':
+                decode_sample = {**event, 'kind': process.viewer_kind}
+            elif event.get('event') == 'memory':
+                _record_viewer_memory(event)
+                decode_sample = None
+    except Exception as e:
+        logger.debug(f"Viewer {process.pid} event stream closed: {e}")
+    finally:
+        # A viewer killed before its exit report still leaves the peak sampled at decode time.
+        if decode_sample:
+            _record_viewer_memory(decode_sample)
+        try:
+            process.stdout.close()
+            if process.stdin is not None:
+                process.stdin.close()  # control channel of video/audio viewers
+        except Exception:
+            pass
+
+
+def _spawn_viewers(kind: str, media_path: str, seconds: int, options: dict | None = None) -> dict[int, subprocess.Popen]:
+    """Spawn the viewer(s) for the current display target without registering them."""
+    # Audio has no surface; visual media get one viewer per target display so a
+    # slow panel never holds up the others. A display's surface lives as long as
+    # its viewer, not for the whole session: each item gets a fresh process with
+    # its own memory budget, so one item's crash or leak never outlives it. The
+    # ffplay viewers on screen do take the next item of their kind over the
+    # control channel (_hand_over_to_viewers), which keeps their surface up.
+    geometries = [None] if kind == 'audio' else _display_geometries()
+    processes = {}
+    for index, geometry in enumerate(geometries):
+        path = media_path if index == 0 else _clone_for_display(kind, media_path, index)
+        cmd = [*VIEWER_COMMAND, '--viewer', kind, path, str(int(seconds))]
+        if geometry:
+            cmd.append(f"geometry={geometry}")
+        if kind in VIEWER_MEMORY_BUDGET_MB:
+            cmd.append(f"memory_mb={VIEWER_MEMORY_BUDGET_MB[kind]}")
+        plays = kind in ('video', 'audio') or (options or {}).get('backend') == 'ffplay'
+        if plays and (ffplay := _media_tool_path('ffplay')):
+            cmd.append(f"ffplay={ffplay}")
+        elif kind in ('image', 'slideshow') and (ffmpeg := _media_tool_path('ffmpeg')):
+            cmd.append(f"ffmpeg={ffmpeg}")  # scales down images too large to decode in the viewer
+        cmd.extend(f"{key}={value}" for key, value in (options or {}).items())
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE if plays else None,  # control channel (/sar, handovers)
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding='utf-8'
+        )
+        process.viewer_kind = kind
+        process.geometry = geometry
+        process.memory_mb = VIEWER_MEMORY_BUDGET_MB.get(kind)  # fixed for the viewer's life, ffplay included
+        # ffplay on a screen can take the next video/image; scheduled viewers wait for their start
+        process.takes_items = plays and kind != 'audio' and 'start_at' not in (options or {})
+        process.viewer_events = []
+        process.media_files = [path, *(_read_slideshow_manifest(path) if kind == 'slideshow' else [])]
+        process.event_reader = threading.Thread(target=_read_viewer_events, args=(process,), daemon=True)
+        process.event_reader.start()
+        processes[index] = process
+    return processes
+
+
+async def _wait_for_viewer_event(process: subprocess.Popen, name: str, timeout: float,
+                                 after: int = 0) -> dict | None:
+    """First ``name`` event among the viewer's events from index ``after`` on."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for event in process.viewer_events[after:]:
+            if event.get('event') == name:
+                return event
+        if not process.event_reader.is_alive():
+            return None
+        await asyncio.sleep(0.02)
+    return None
+
+
+def _send_viewer_command(process: subprocess.Popen, command: dict) -> bool:
+    """Write one JSON command line to a video/audio viewer's stdin; False if it is not listening."""
+    if process.stdin is None or process.poll() is not None:
+        return False
+    try:
+        process.stdin.write(json.dumps(command) + '\n')
+        process.stdin.flush()
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+_background_tasks: set = set()  # fire-and-forget work (cache fills, album flushes), referenced until done
+
+
+def _remember_task(task: asyncio.Task) -> None:
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _run_in_background(func, *args) -> None:
+    _remember_task(asyncio.create_task(asyncio.to_thread(func, *args)))
+
+
+def _poster_path(content_hash: str) -> str:
+    return os.path.join(POSTER_CACHE_DIR, f"{content_hash}.jpg")
+
+
+def _extract_poster(source_path: str, content_hash: str) -> None:
+    """Cache the first frame of ``source_path`` (which is consumed) as the item's poster."""
+    poster = _poster_path(content_hash)
+    part_path = poster + '.part'
+    try:
+        ffmpeg = _media_tool_path('ffmpeg')
+        if ffmpeg is None or not _private_cache_dir(POSTER_CACHE_DIR):
+            return
+        cmd = [ffmpeg, '-hide_banner', '-v', 'error', '-y', '-i', source_path,
+               '-frames:v', '1', '-q:v', '3', '-f', 'image2', part_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+        if result.returncode != 0:
+            logger.warning(f"Poster frame not extracted: {result.stderr.strip()[-200:]}")
+            return
+        os.replace(part_path, poster)  # supersedes the low-resolution Telegram thumbnail
+        _trim_cache_dir(POSTER_CACHE_DIR, '*.jpg', POSTER_CACHE_MAX_FILES)
+    except Exception as e:
+        logger.warning(f"Poster frame not extracted: {e}")
+    finally:
+        for path in (source_path, part_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def _poster_options(kind: str, file_path: str, media_info: dict, thumbnail=None) -> dict:
+    """Viewer option naming a poster to show until ffplay has its first frame.
+
+    A cached first frame wins. On the first play Telegram's thumbnail stands in
+    and the first frame is extracted in the background for the next time.
+    """
+    content_hash = media_info.get('hash')
+    if kind != 'video' or not content_hash or not _private_cache_dir(POSTER_CACHE_DIR):
+        return {}
+    poster = _poster_path(content_hash)
+    if os.path.exists(poster):
+        os.utime(poster)  # most recently used survives the cleanup
+        return {'poster': poster}
+
+    if _media_tool_path('ffmpeg'):
+        # The viewer deletes its input when done, so the extractor works on its own link/copy.
+        _run_in_background(_extract_poster, _clone_file(file_path, 'poster'), content_hash)
+    if thumbnail is None:
+        return {}
+    # Downloaded into the cache itself: a link from the temp dir fails across file systems.
+    thumbnail_path = f"{poster}.thumb{time.time_ns()}"
+    try:
+        file = await thumbnail.get_file()
+        await file.download_to_drive(thumbnail_path)
+        try:
+            os.link(thumbnail_path, poster)  # never overwrites an extracted frame that was quicker
+        except FileExistsError:
+            pass
+    except Exception as e:
+        logger.debug(f"Thumbnail not used as poster: {e}")
+        return {}
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(thumbnail_path)
+    return {'poster': poster}
+
+
+async def _start_viewer_subprocess(kind: str, media_path: str, seconds: int, options: dict | None = None) -> None:
+    with _timed_stage('spawn'):
+        await _stop_viewers()
+        _viewer_processes.update(_spawn_viewers(kind, media_path, seconds, options))
+
+
+# Downloads run in parallel, but only one item at a time takes the screen: its handover or
+# spawn and the startup check that follows, so no item replaces another's viewer before that
+# check and no item is blamed for another's exit code.
+_presentation_lock = asyncio.Lock()
+
+
+def _viewer_on_screen(process: subprocess.Popen) -> bool:
+    """The viewer shows its current item and is reading commands (not starting up or switching)."""
+    if process.poll() is not None:
+        return False
+    for event in reversed(process.viewer_events):
+        if event.get('event') in ('shown', 'loaded'):
+            return event['event'] == 'shown'
+    return False
+
+
+async def _hand_over_to_viewers(kind: str, media_path: str, seconds: int, options: dict) -> bool:
+    """Give a video/image to the ffplay viewers already on screen instead of spawning new ones.
+
+    Only viewers whose current item is already on screen are asked, so the answer
+    is immediate. Every viewer gets its own link of the file and answers 'loaded';
+    True when all of them took it (``media_path`` itself is then left to the caller).
+    Anything else (no such viewer, another display target, a viewer running under
+    another kind's memory budget, no answer in time) is False and the caller spawns
+    as usual, which also stops these viewers and their links.
+    """
+    if kind not in ('video', 'image') or (kind == 'image' and options.get('backend') != 'ffplay'):
+        return False
+    processes = list(_viewer_processes.values())
+    geometries = _display_geometries()
+    if not processes or len(processes) != len(geometries) or any(
+        not process.takes_items or not _viewer_on_screen(process) or process.geometry != geometry
+        or process.memory_mb != VIEWER_MEMORY_BUDGET_MB.get(kind)
+        for process, geometry in zip(processes, geometries)
+    ):
+        return False
+
+    options = {'ffplay': _media_tool_path('ffplay'), **options}
+    seen = []
+    for index, process in enumerate(processes):
+        path = _clone_file(media_path, f"h{index}")
+        process.media_files.append(path)
+        command = {'cmd': 'play', 'kind': kind, 'path': path, 'seconds': int(seconds),
+                   'options': {key: str(value) for key, value in options.items() if value is not None}}
+        seen.append(len(process.viewer_events))
+        if not _send_viewer_command(process, command):
+            return False
+    # Waits are only created once every send went through, so none is left un-awaited.
+    waits = [_wait_for_viewer_event(process, 'loaded', VIEWER_HANDOVER_TIMEOUT, after=after)
+             for process, after in zip(processes, seen)]
+    with _timed_stage('handover'):
+        if not all(await asyncio.gather(*waits)):
+            return False
+    for process in processes:
+        process.viewer_kind = kind
+    return True
+
+
+def _image_render_options(kind: str, media_info: dict) -> dict:
+    """Viewer options that put a still image on ffplay when that backend is chosen and usable."""
+    if kind != 'image' or _image_backend != 'ffplay' or _media_tool_path('ffplay') is None:
+        return {}
+    animated = (media_info.get('frames') or 1) > 1
+    if animated and media_info.get('codec') == 'webp':
+        return {}  # FFmpeg before 8.0 cannot decode animated WebP; Tk plays it
+    options = {'backend': 'ffplay'}
+    if animated:
+        options['animated'] = '1'
+    if (screen := _target_screen_size()) is not None:
+        options['screen'] = f"{screen[0]}x{screen[1]}"
+    return options
+
+
+def _message_media(message) -> dict | None:
+    """Describe the playable media in a message, or None if there is nothing to show.
+
+    ``extension`` is taken from the sender's file name when there is one,
+    otherwise from Telegram's file path, falling back to ``default_extension``.
+    """
+    if message.photo:
+        return {'kind': 'image', 'source': _select_photo_size(message.photo), 'extension': None,
+                'default_extension': '.jpg', 'prefix': 'photo', 'ack': "✅ Görsel gösteriliyor (viewer açıldı)."}
+
+    if message.document:
+        mime_type = message.document.mime_type or ''
+        file_extension = os.path.splitext(message.document.file_name or '')[-1]
+        if 'image' in mime_type:
+            return {'kind': 'image', 'source': message.document, 'extension': file_extension or None,
+                    'default_extension': '.jpg', 'prefix': 'doc', 'ack': "✅ Görsel gösteriliyor (viewer açıldı)."}
+        # Handle audio files (MP3, WAV, etc.)
+        if 'audio' in mime_type or file_extension.lower() in ['.mp3', '.wav', '.m4a', '.ogg', '.flac']:
+            return {'kind': 'audio', 'source': message.document, 'extension': file_extension.lower() or None,
+                    'default_extension': '.mp3', 'prefix': 'audio', 'ack': "🎵 Ses dosyası çalınıyor (arka planda)."}
+
+    if message.video:
+        return {'kind': 'video', 'source': message.video, 'extension': None, 'poster': message.video.thumbnail,
+                'default_extension': '.mp4', 'prefix': 'video', 'ack': "✅ Video gösteriliyor (sesli, viewer açıldı)."}
+
+    # Handle audio messages
+    if message.audio:
+        return {'kind': 'audio', 'source': message.audio,
+                'extension': os.path.splitext(message.audio.file_name or '')[-1] or None,
+                'default_extension': '.mp3', 'prefix': 'voice', 'ack': "🎵 Ses mesajı çalınıyor (arka planda)."}
+
+    # Handle voice notes
+    if message.voice:
+        return {'kind': 'audio', 'source': message.voice, 'extension': '.ogg',
+                'default_extension': '.ogg', 'prefix': 'voice', 'ack': "🎵 Sesli mesaj çalınıyor (arka planda)."}
+
+    return None
+
+
+def _caption_settings(message) -> dict[str, str]:
+    """key=value words of a media caption; the other words are ordinary caption text."""
+    settings = {}
+    for word in (message.caption or '').split():
+        key, sep, value = word.partition('=')
+        if sep and key:
+            settings[key.lower()] = value
+    return settings
+
+
+def _resolve_profile(name: str) -> str:
+    name = name.lower()
+    name = FFPLAY_PROFILE_ALIASES.get(name, name)
+    if name not in FFPLAY_PROFILES:
+        raise ValueError(f"Bilinmeyen profil: {name} (seçenekler: {', '.join(FFPLAY_PROFILES)})")
+    return name
+
+
+def _parse_clock(text: str) -> float:
+    """Seconds from "90", "1:30" or "1:02:03" (fractions allowed in the last part)."""
+    parts = text.split(':')
+    if len(parts) > 3 or not all(parts):
+        raise ValueError(text)
+    seconds = 0.0
+    for part in parts[:-1]:
+        seconds = seconds * 60 + int(part)
+    seconds = seconds * 60 + float(parts[-1]) if len(parts) > 1 else float(parts[-1])
+    if seconds < 0 or seconds != seconds or seconds == float('inf'):
+        raise ValueError(text)
+    return seconds
+
+
+def _playback_options(kind: str, message) -> dict:
+    """Viewer options for ffplay-played media from the caption.
+
+    profil= (otherwise the /profil choice), sure= caps playback at N seconds,
+    bas= starts at an offset, dongu= plays it N times (0: until /iptal).
+    Raises ValueError with a user-facing message for a bad value.
+    """
+    if kind not in ('video', 'audio'):
+        return {}
+    settings = _caption_settings(message)
+    options = {'profile': _resolve_profile(settings.get('profil') or settings.get('profile') or _ffplay_profile)}
+    if duration := settings.get('sure') or settings.get('duration'):
+        try:
+            seconds = _parse_clock(duration)
+        except ValueError:
+            seconds = 0
+        if seconds <= 0:
+            raise ValueError(f"Geçersiz süre: sure={duration} (ör. sure=15 veya sure=1:30)")
+        options['duration'] = f"{seconds:g}"
+    if start := settings.get('bas') or settings.get('start'):
+        try:
+            options['start'] = f"{_parse_clock(start):g}"
+        except ValueError:
+            raise ValueError(f"Geçersiz başlangıç: bas={start} (ör. bas=45 veya bas=1:30)") from None
+    if loops := settings.get('dongu') or settings.get('loop'):
+        if not loops.isdigit():
+            raise ValueError(f"Geçersiz döngü: dongu={loops} (tekrar sayısı, 0 = /iptal edilene kadar)")
+        options['loops'] = str(int(loops))
+    return options
+
+
+def _with_media_length(kind: str, playback: dict, media_info: dict) -> dict:
+    """Add the probed duration (used to clamp seeks); a start past the end is a user error."""
+    duration = media_info.get('duration')
+    if kind not in ('video', 'audio') or not duration:
+        return playback
+    if float(playback.get('start', 0)) >= duration:
+        raise ValueError(f"Başlangıç (bas=) dosyanın süresinden ({_format_clock(duration)}) sonra.")
+    return {**playback, 'length': f"{duration:g}"}
+
+
+def _format_clock(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+_stage_timings: dict[str, deque] = defaultdict(lambda: deque(maxlen=STAGE_HISTORY_SIZE))  # stage -> seconds
+
+
+@contextlib.contextmanager
+def _timed_stage(stage: str):
+    """Add the wall time of the block to ``stage``; blocks that raise are not counted."""
+    started = time.perf_counter()
+    yield
+    _stage_timings[stage].append(time.perf_counter() - started)
+
+
+def _stage_summary() -> str:
+    medians = [
+        f"{stage} {sorted(samples)[len(samples) // 2] * 1000:.0f} ms"
+        for stage, samples in _stage_timings.items()
+        if samples and not stage.startswith('update:')
+    ]
+    return ", ".join(medians) or "-"
+
+
+class _UpdateCapture:
+    """Record mode (--record DIR): arriving updates with their arrival times, plus the media they downloaded.
+
+    DIR/updates.jsonl holds one {"t": seconds since start, "update": {...}} line per
+    update and DIR/media/<file_id><ext> the downloaded files; replay.py plays it back.
+    """
+
+    def __init__(self, directory: str):
+        self.media_dir = os.path.join(directory, 'media')
+        os.makedirs(self.media_dir, exist_ok=True)
+        # 'x': an earlier capture is never appended to, its arrival times would not line up
+        self._log = open(os.path.join(directory, 'updates.jsonl'), 'x', encoding='utf-8')
+        self._started = time.monotonic()
+
+    def record_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            return
+        entry = {'t': round(time.monotonic() - self._started, 4), 'update': update.to_dict()}
+        self._log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._log.flush()
+
+    def store_media(self, file_id: str, path: str) -> None:
+        target = os.path.join(self.media_dir, file_id + os.path.splitext(path)[1])
+        if os.path.exists(target):
+            return
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+
+    def close(self) -> None:
+        self._log.close()
+
+
+_capture: _UpdateCapture | None = None
+
+
+async def _capture_media(file, file_path: str) -> None:
+    if _capture is None:
+        return
+    try:
+        await asyncio.to_thread(_capture.store_media, file.file_id, file_path)
+    except OSError as e:
+        logger.warning(f"Kayıt: {file.file_id} saklanamadı: {e}")
+
+
+class DownloadError(Exception):
+    """Raised when a download still fails after all retries."""
+
+
+def _content_range_total(response: httpx.Response) -> int | None:
+    # "bytes 0-1048575/73400320"
+    total = response.headers.get('content-range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _content_range_start(response: httpx.Response) -> int | None:
+    start = response.headers.get('content-range', '').partition(' ')[2].partition('-')[0]
+    return int(start) if start.isdigit() else None
+
+
+async def _download_resumable(url: str, dest_path: str, total_size: int | None = None,
+                              on_progress=None, client: httpx.AsyncClient | None = None) -> None:
+    """Download ``url`` in ranged chunks, resuming from the last written byte after a failure.
+
+    Retries transport errors, 5xx and empty responses with exponential backoff;
+    ``on_progress(done, total)`` is awaited after every chunk.
+    """
+    part_path = dest_path + '.part'
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0), follow_redirects=True)
+
+    failures = 0
+    try:
+        with open(part_path, 'wb') as out:
+            offset = 0
+            while total_size is None or offset < total_size:
+                end = offset + DOWNLOAD_CHUNK_SIZE - 1
+                try:
+                    async with client.stream('GET', url, headers={'Range': f'bytes={offset}-{end}'}) as response:
+                        if response.status_code == 416 and total_size is None and offset > 0:
+                            break  # size was unknown and we already have every byte
+                        response.raise_for_status()
+                        if response.status_code == 200:
+                            # Ranges not supported: the whole body follows, start over.
+                            out.seek(0)
+                            out.truncate()
+                            offset = 0
+                        else:
+                            start = _content_range_start(response)
+                            if start != offset:
+                                # Writing these bytes at ``offset`` would corrupt the file; ask again.
+                                raise httpx.RemoteProtocolError(
+                                    f"Content-Range starts at {start}, expected {offset}", request=response.request
+                                )
+                            total_size = _content_range_total(response) or total_size
+                        received = 0
+                        async for chunk in response.aiter_bytes():
+                            out.write(chunk)
+                            offset += len(chunk)
+                            received += len(chunk)
+                        if not received and (response.status_code == 206 or total_size):
+                            # No progress: asking again at once would spin forever; back off like any failure.
+                            raise httpx.RemoteProtocolError("Response carried no bytes", request=response.request)
+                    if response.status_code == 200:
+                        total_size = offset
+                    failures = 0
+                except httpx.HTTPError as e:
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                        raise DownloadError(f"HTTP {e.response.status_code}") from e
+                    failures += 1
+                    if failures > DOWNLOAD_MAX_RETRIES:
+                        raise DownloadError(f"gave up at byte {offset}: {type(e).__name__}") from e
+                    delay = DOWNLOAD_RETRY_BASE_DELAY * 2 ** (failures - 1)
+                    logger.warning(
+                        f"Download interrupted at byte {offset} ({type(e).__name__}), resuming in {delay:.1f}s"
+                    )
+                    # Bytes already written are valid; the next range starts right after them.
+                    out.flush()
+                    await asyncio.sleep(delay)
+                    continue
+                if on_progress:
+                    await on_progress(offset, total_size)
+        os.replace(part_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+class _StatusMessage:
+    """The one chat message that tells the user about one item.
+
+    The first text is sent as a reply, later texts edit it. While a send or edit
+    waits for the rate limiter, newer texts replace the queued one, so a burst
+    of updates costs a single API call.
+    """
+
+    def __init__(self, reply_to):
+        self._reply_to = reply_to
+        self._message = None
+        self._text = None
+        self._pending = None
+        self._lock = asyncio.Lock()
+
+    async def set(self, text: str) -> None:
+        self._pending = text
+        async with self._lock:
+            text, self._pending = self._pending, None
+            if text is None or text == self._text:
+                return  # an earlier caller already sent the latest text
+            try:
+                if self._message is None:
+                    self._message = await self._reply_to.reply_text(text)
+                else:
+                    await self._message.edit_text(text)
+                self._text = text
+            except TelegramError as e:
+                logger.warning(f"Status message not updated: {e}")
+
+    def post(self, text: str) -> None:
+        """Like ``set`` without waiting for it, for progress that must not hold up the work."""
+        _remember_task(asyncio.create_task(self.set(text)))
+
+
+async def _download_media(media: dict, status: _StatusMessage | None = None) -> str:
+    file_path = None
+    try:
+        with _timed_stage('download'):
+            file = await media['source'].get_file()
+            file_extension = (
+                media['extension'] or os.path.splitext(file.file_path or '')[-1] or media['default_extension']
+            )
+            file_path = os.path.join(tempfile.gettempdir(), f"hack_{media['prefix']}_{time.time_ns()}{file_extension}")
+            await _download_file(file, file_path, status)
+    except asyncio.CancelledError:
+        # /iptal during the download: drop whatever part of the file arrived
+        try:
+            if file_path:
+                os.remove(file_path)
+        except OSError:
+            pass
+        raise
+    _end_download_turn()
+    await _capture_media(file, file_path)
+    return file_path
+
+
+async def _download_file(file, file_path: str, status: _StatusMessage | None = None) -> None:
+    file_size = file.file_size or 0
+    if file_size < LARGE_DOWNLOAD_THRESHOLD or not (file.file_path or '').startswith('http'):
+        await file.download_to_drive(file_path)
+        return
+
+    # Large file: resumable download, progress shown in the item's status message.
+    last_edit = time.monotonic()
+    size_mb = file_size / (1024 * 1024)
+    if status is not None:
+        status.post(f"📥 İndiriliyor: %0 ({size_mb:.1f} MB)")
+
+    async def _report_progress(done: int, total: int | None) -> None:
+        nonlocal last_edit
+        now = time.monotonic()
+        if status is None or now - last_edit < DOWNLOAD_PROGRESS_INTERVAL:
+            return
+        last_edit = now
+        percent = int(done * 100 / (total or file_size))
+        status.post(f"📥 İndiriliyor: %{percent} ({size_mb:.1f} MB)")
+
+    try:
+        await _download_resumable(file.file_path, file_path, file_size, _report_progress)
+    except DownloadError:
+        if status is not None:
+            await status.set("❌ İndirme başarısız oldu (bağlantı sorunu), lütfen tekrar gönderin.")
+        raise
+    if status is not None:
+        status.post(f"📥 İndirildi ({size_mb:.1f} MB)")
+
+
+async def _present_media(status: _StatusMessage, kind: str, file_path: str, ack_text: str, thumbnail=None,
+                         playback: dict | None = None) -> None:
+    """Probe a downloaded file, then hand it to a viewer; bad files never reach one."""
+    try:
+        with _timed_stage('probe'):
+            media_info = await asyncio.to_thread(_probe_media, file_path, kind)
+    except MediaProbeError as e:
+        logger.warning(f"Rejected {kind} {file_path}: {e}")
+        await status.set("❌ Dosya açılamadı: bozuk ya da desteklenmeyen bir format.")
+        try:
+            os.remove(file_path)
+        except Exception:
+            pass
+        return
+
+    try:
+        playback = _with_media_length(kind, playback or {}, media_info)
+    except ValueError as e:
+        await status.set(f"❌ {e}")
+        try:
+            os.remove(file_path)
+        except Exception:
+            pass
+        return
+
+    logger.info(f"Presenting {kind} ({media_info.get('codec')}, {media_info.get('duration')}s)")
+    with _timed_stage('prepare'):
+        loudness, poster = await asyncio.gather(
+            _loudness_options(kind, file_path, media_info),
+            _poster_options(kind, file_path, media_info, thumbnail),
+        )
+    options = {**loudness, **poster, **playback, **_image_render_options(kind, media_info)}
+    try:
+        async with _presentation_lock:
+            if await _hand_over_to_viewers(kind, file_path, DEFAULT_DISPLAY_TIME, options):
+                os.remove(file_path)
+            else:
+                await _start_viewer_subprocess(kind, file_path, DEFAULT_DISPLAY_TIME, options)
+            status.post(ack_text)
+            await _ensure_viewer_started_or_report(status, kind)
+    except asyncio.CancelledError:
+        # /iptal or /durdur, which also close the viewers (and the links they were handed)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+
+def _is_album_image(message) -> bool:
+    return bool(message.photo) or bool(message.document and 'image' in (message.document.mime_type or ''))
+
+
+def _album_image_source(message):
+    """Downloadable image of an album part."""
+    if message.photo:
+        return _select_photo_size(message.photo)
+    return message.document
+
+
+async def _collect_album_part(update: Update) -> None:
+    group_id = update.message.media_group_id
+    album = _album_buffers.get(group_id)
+    if album is None:
+        album = _album_buffers[group_id] = {'update': update, 'messages': [], 'last_seen': 0.0}
+        album['task'] = asyncio.create_task(_flush_album_when_complete(group_id))
+        _remember_task(album['task'])  # still referenced once the buffer entry is gone
+    album['messages'].append(update.message)
+    album['last_seen'] = time.monotonic()
+
+
+async def _flush_album_when_complete(group_id: str) -> None:
+    album = _album_buffers[group_id]
+    # Telegram sends album parts back to back; wait until none arrived for a while.
+    while (remaining := album['last_seen'] + ALBUM_COLLECT_WINDOW - time.monotonic()) > 0:
+        await asyncio.sleep(remaining)
+    del _album_buffers[group_id]
+
+    if should_exit:
+        return
+    status = _StatusMessage(album['update'].message)
+    try:
+        await _present_album(status, sorted(album['messages'], key=lambda m: m.message_id))
+    except Exception as e:
+        logger.error(f"Error presenting album {group_id}: {e}", exc_info=True)
+        await status.set("❌ Albüm işlenirken hata oluştu.")
+
+
+async def _download_album_slide(message, index: int) -> str:
+    with _timed_stage('download'):
+        file = await _album_image_source(message).get_file()
+        file_extension = os.path.splitext(file.file_path or '')[-1] or '.jpg'
+        file_path = os.path.join(
+            tempfile.gettempdir(), f"hack_album_{message.media_group_id}_{index}{file_extension}"
+        )
+        await file.download_to_drive(file_path)
+    await _capture_media(file, file_path)
+    return file_path
+
+
+async def _present_album(status: _StatusMessage, messages: list) -> None:
+    """Download and probe every album part in parallel, then show them as one slideshow."""
+    group_id = messages[0].media_group_id
+    downloads = await asyncio.gather(
+        *(_download_album_slide(message, index) for index, message in enumerate(messages)),
+        return_exceptions=True,
+    )
+    downloaded = []
+    for result in downloads:
+        if isinstance(result, BaseException):
+            logger.error(f"Album {group_id} part could not be downloaded: {result}")
+        else:
+            downloaded.append(result)
+
+    with _timed_stage('probe'):
+        probes = await asyncio.gather(
+            *(asyncio.to_thread(_probe_media, path, 'image') for path in downloaded),
+            return_exceptions=True,
+        )
+    slide_paths = []
+    for path, probe in zip(downloaded, probes):
+        if isinstance(probe, BaseException):
+            logger.warning(f"Rejected album slide {path}: {probe}")
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+        else:
+            slide_paths.append(path)
+
+    if not slide_paths:
+        await status.set("❌ Albümdeki görseller açılamadı.")
+        return
+
+    manifest_path = os.path.join(tempfile.gettempdir(), f"hack_album_{group_id}.json")
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(slide_paths, f)
+
+    async with _presentation_lock:
+        await _start_viewer_subprocess('slideshow', manifest_path, DEFAULT_DISPLAY_TIME)
+        status.post(f"🖼️ Albüm gösteriliyor ({len(slide_paths)} görsel, her biri {DEFAULT_DISPLAY_TIME} saniye).")
+        await _ensure_viewer_started_or_report(status, 'slideshow')
+
+
+def _missing_ffmpeg_text(kind: str) -> str:
+    what = {'video': 'Video', 'image': 'Görsel'}.get(kind, 'Ses')
+    return (
+        f"❌ {what} açılamadı: FFmpeg (ffplay) kurulu değil.\n"
+        "macOS için: `brew install ffmpeg`\n"
+        "Windows/Linux için: FFmpeg indirip kurun"
+    )
+
+
+async def _reject_if_player_missing(status: _StatusMessage, kind: str) -> bool:
+    """Report a missing ffplay before anything is downloaded or spawned."""
+    if kind not in ('video', 'audio'):
+        return False
+    tools = await _media_tools_ready()
+    if tools.get('ffplay') is not None:
+        return False
+    await status.set(_missing_ffmpeg_text(kind))
+    return True
+
+
+async def _ensure_viewer_started_or_report(status: _StatusMessage, kind: str) -> None:
+    # Give the viewer a moment to initialize; if it exits immediately, report.
+    await asyncio.sleep(VIEWER_STARTUP_GRACE)
+    code = None
+    for process in list(_viewer_processes.values()):
+        code = process.poll()
+        if code is not None:
+            break
+    if code is None:
+        return
+
+    elif code == 9:
+        await status.set("❌ Medya bellek sınırını aşıyor (çok büyük), gösterilemedi.")
+    elif kind == 'video':
+        if code == 3:
+            await status.set(
+                "❌ Video açılamadı: `opencv-python` kurulu değil.\n"
+                "Terminalde şunu çalıştır: `python -m pip install -r requirements.txt`"
+            )
+        elif code == 4:
+            await status.set("❌ Video dosyası açılamadı / bozuk olabilir.")
+        elif code == 7:
+            await status.set(_missing_ffmpeg_text(kind))
+        elif code == 8:
+            await status.set("❌ Video oynatma hatası.")
+        else:
+            await status.set("❌ Video viewer başlatılamadı.")
+    elif kind == 'audio':
+            if code == 5:
+                await status.set(
+                    "❌ Ses açılamadı: Ses kütüphanesi kurulu değil.\n"
+                    "macOS için: afplay zaten kurulu olmalı\n"
+                    "Windows/Linux için: FFmpeg kurun"
+                )
+            elif code == 6:
+                await status.set("❌ Ses dosyası açılamadı / bozuk olabilir.")
+            else:
+                await status.set("❌ Ses oynatıcı başlatılamadı.")
+    elif code == 7:
+        await status.set(_missing_ffmpeg_text(kind))
+    else:
+        await status.set("❌ Görsel viewer başlatılamadı.")
+
+
+def _remove_viewer_files(process: subprocess.Popen) -> None:
+    # Viewers delete their own input, but one signalled before it installed its
+    # handler dies without cleaning up; call only once the process is reaped.
+    for path in getattr(process, 'media_files', ()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.debug(f"Viewer file {path} not removed: {e}")
+
+
+def _signal_viewers() -> list[subprocess.Popen]:
+    """Take every viewer off the screen and ask it to close; returns them for reaping."""
+    previous = list(_viewer_processes.values())
+    _viewer_processes.clear()
+
+    # Preferred: viewer listens SIGUSR1 for remote cancel. Signal every display
+    # first so all panels close together, then reap them.
+    if hasattr(signal, 'SIGUSR1'):
+        for process in previous:
+            if process.poll() is None:
+                try:
+                    process.send_signal(signal.SIGUSR1)
+                except Exception:
+                    pass
+    return previous
+
+
+def _reap_viewer(process: subprocess.Popen) -> None:
+    # Blocks for up to a few seconds; from the event loop go through _reap_viewers.
+    try:
+        process.wait(timeout=2)
+    except Exception:
+        # Fallback
+        try:
+            process.terminate()
+        except Exception:
+            pass
+        try:
+            process.wait(timeout=2)
+        except Exception:
+            try:
+                process.kill()
+            except Exception:
+                pass
+    if process.poll() is not None:
+        _remove_viewer_files(process)
+
+
+async def _reap_viewers(processes: list[subprocess.Popen]) -> None:
+    """Reap signalled viewers off the event loop, one worker thread each."""
+    await asyncio.gather(*(asyncio.to_thread(_reap_viewer, process) for process in processes))
+
+
+def _stop_viewer_subprocess() -> None:
+    for process in _signal_viewers():
+        _reap_viewer(process)
+
+
+async def _stop_viewers() -> None:
+    """_stop_viewer_subprocess for the event loop: signal now, wait for the exits in threads."""
+    await _reap_viewers(_signal_viewers())
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Kullanıcı /start komutunu gönderdiğinde bir karşılama mesajı gönderir."""
+    if not _is_authorized(update):
+        return
+        
+    user = update.effective_user
+    welcome_message = (
+        f"👋 Merhaba {user.first_name}!\n\n"
+        "📸 Bana bir resim veya video gönderin, tam ekran olarak göstereyim.\n"
+        "🎵 MP3 ses dosyalarını arka planda çalabilirim.\n"
+        "⏱️ Görüntüleme süresini ayarla: /sure 10\n"
+        "🧹 Aktif görüntüyü/sesi kapat: /iptal\n"
+        "🔒 Görüntü açıkken yerelden kapatma engellenir (süre bitene kadar).\n"
+        "⏹️  Acil durdur: /durdur\n"
         "▶️ Devam ettir: /devam\n"
         "🧨 Programı kapat: /kapat\n"
         "ℹ️  Durum kontrolü: /durum\n"
@@ -623,15 +2769,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 /yardim - Bu yardım mesajını göster
 /sure [saniye] - Görüntüleme süresini saniye cinsinden ayarla (varsayılan: 10)
 /durum - Bot durumunu göster
-/iptal - Açık olan görüntüyü/sesi kapat (sadece viewer kapanır)
+/ekran [numara|hepsi] - Medyanın gösterileceği ekranı seç (hepsi: tüm ekranlara ayna)
+/profil [hizli|kalite|standart] - Video/ses başlatma profilini seç (tek medya için açıklamaya profil=hizli)
+/gosterici [tk|ffplay] - Resimleri gösteren motoru seç (ffplay: videolarla aynı oynatıcı)
+/sar [+saniye|-saniye|DD:ss] - Oynayan video/sesi ileri/geri sar veya bir konuma git
+/zamanla [SS:DD[:ss]|+saniye|iptal] - Yanıtlanan medyayı belirli bir zamanda göster
+/iptal - Açık olan görüntüyü/sesi ve bekleyen medyayı iptal et (sadece viewer kapanır)
 /durdur - Botu duraklat (yeni medya kabul etmez)
 /devam - Botu tekrar aktif et
 /kapat - Ana programı kapat
 
 <b>Kullanım:</b>
 - Tam ekranda göstermek için bir resim gönderin
+- Albüm olarak gönderilen resimler slayt gösterisi olarak oynatılır (her biri /sure kadar)
 - Sesli video göstermek için bir video gönderin
 - Arka planda ses çalmak için MP3 dosyası gönderin
+- Video/ses açıklamasına yazılabilenler: sure=15 (en fazla 15 sn), bas=1:30 (1:30'dan başla), dongu=3 (3 kez, 0: /iptal edilene kadar), profil=hizli
 - Görsel/video/ses belirtilen süre boyunca gösterilecek, sonra sadece görüntü penceresi kapanacak
 - Görüntü açıkken yerelden kapatma (Cmd+Q / Alt+F4 vb.) best-effort engellenir
 - Acil durumda Telegram'dan /iptal her zaman çalışır
@@ -667,22 +2820,345 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_authorized(update):
         return
         
-    viewer_running = _viewer_process is not None and _viewer_process.poll() is None
-    video_status = "Evet (OpenCV)" if VIDEO_AVAILABLE else "Hayır (opencv-python kurulu değil)"
-    audio_status = "Evet (Sistem ses)" if AUDIO_AVAILABLE else "Hayır (ses kütüphanesi yok)"
+    viewer_running = any(p.poll() is None for p in _viewer_processes.values())
+    video_status = "Evet (OpenCV)" if _video_available() else "Hayır (opencv-python kurulu değil)"
+    audio_status = "Evet (Sistem ses)" if _audio_available() else "Hayır (ses kütüphanesi yok)"
     paused_status = "Evet" if should_exit else "Hayır"
     status_message = (
         "📊 Bot Durumu\n"
         f"🔄 Bot aktif: {'Hayır' if should_exit else 'Evet'}\n"
         f"⏸️ Duraklatıldı: {paused_status}\n"
         f"🖼️ Viewer açık: {'Evet' if viewer_running else 'Hayır'}\n"
+        f"🖥️ Hedef ekran: {_display_target_label()}\n"
+        f"🎛️ Oynatma profili: {_ffplay_profile}\n"
+        f"🖼️ Resim gösterici: {_image_backend}\n"
         f"⏱️ Görüntüleme süresi: {DEFAULT_DISPLAY_TIME} saniye\n"
         f"🎥 Video oynatma: {video_status}\n"
-        f"🎵 Ses oynatma: {audio_status}"
+        f"🎵 Ses oynatma: {audio_status}\n"
+        f"🎬 FFmpeg araçları: {_media_tools_summary()}\n"
+        f"🔊 Ses seviyesi analizi: {_metrics['loudness_analyses']} dosya\n"
+        f"📨 Telegram bekletmeleri (RetryAfter): {_metrics['retry_after']}\n"
+        f"⏱️ Aşama süreleri (medyan): {_stage_summary()}\n"
+        f"👥 Kullanıcı medya sırası (son {USER_STATS_WINDOW // 60} dk hızı): {_user_media_summary()}\n"
+        f"🐢 Döngü takılmaları (>{STALL_THRESHOLD * 1000:.0f} ms): {_stall_summary()}\n"
+        f"🧠 Viewer bellek zirvesi: {_memory_summary()}\n"
+        f"📉 Küçük boyut seçimiyle tasarruf: {_metrics['photo_bytes_saved'] / 1024:.0f} KB\n"
+        f"🚀 Açılış süresi: {f'{_cold_start_seconds:.2f} sn' if _cold_start_seconds is not None else '-'}"
     )
     
     await update.message.reply_text(status_message)
 
+def _display_target_label() -> str:
+    return "Tümü (ayna)" if _display_target == 'all' else f"Ekran {_display_target}"
+
+
+async def select_display(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Medyanın gösterileceği ekranı seçer veya ekranları listeler."""
+    global _display_target
+
+    if not _is_authorized(update):
+        return
+
+    displays = await asyncio.to_thread(_enumerate_displays, True)
+
+    if not context.args:
+        lines = [f"🖥️ Hedef ekran: {_display_target_label()}"]
+        if displays:
+            for number, (x, y, w, h) in enumerate(displays, start=1):
+                lines.append(f"{number}. {w}x{h} (+{x}+{y}){' - ana ekran' if number == 1 else ''}")
+        else:
+            lines.append("Ekran düzeni algılanamadı, ana ekran kullanılıyor.")
+        lines.append("Kullanım: /ekran [numara|hepsi]")
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    choice = context.args[0].lower()
+    if choice in ('hepsi', 'all'):
+        _display_target = 'all'
+    else:
+        try:
+            number = int(choice)
+        except ValueError:
+            await update.message.reply_text("Kullanım: /ekran [numara|hepsi]")
+            return
+        if number < 1 or number > max(1, len(displays)):
+            await update.message.reply_text(f"Lütfen 1 ile {max(1, len(displays))} arasında bir ekran seçin.")
+            return
+        _display_target = number
+
+    await update.message.reply_text(f"🖥️ Hedef ekran: {_display_target_label()}")
+
+
+async def select_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Video/ses için ffplay başlatma profilini seçer veya profilleri listeler."""
+    global _ffplay_profile
+
+    if not _is_authorized(update):
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            f"🎛️ Oynatma profili: {_ffplay_profile}\n"
+            "hizli - ilk kare en kısa sürede (az analiz, ses cihazı beklenmez, geciken kareler atlanır)\n"
+            "kalite - dosya tam analiz edilir, hiçbir kare atlanmaz\n"
+            "standart - ffplay varsayılanları\n"
+            "Kullanım: /profil [hizli|kalite|standart]; tek bir medya için açıklamaya profil=hizli yazın"
+        )
+        return
+
+    try:
+        _ffplay_profile = _resolve_profile(context.args[0])
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    await update.message.reply_text(f"🎛️ Oynatma profili: {_ffplay_profile}")
+
+
+async def select_image_backend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Resimlerin Tk ile mi yoksa videolarla aynı oynatıcıyla (ffplay) mı gösterileceğini seçer."""
+    global _image_backend
+
+    if not _is_authorized(update):
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            f"🖼️ Resim gösterici: {_image_backend}\n"
+            "tk - resim Pillow ile ölçeklenip ayrı bir pencerede gösterilir\n"
+            "ffplay - videolarla aynı oynatıcı; ekrandaki oynatıcı sonraki resmi/videoyu boşluksuz devralır\n"
+            "Kullanım: /gosterici [tk|ffplay] (albümler ve planlı resimler her zaman tk ile gösterilir)"
+        )
+        return
+
+    choice = context.args[0].lower()
+    if choice not in IMAGE_BACKENDS:
+        await update.message.reply_text(f"❌ Bilinmeyen gösterici: {choice} (seçenekler: {', '.join(IMAGE_BACKENDS)})")
+        return
+    if choice == 'ffplay' and (await _media_tools_ready()).get('ffplay') is None:
+        await update.message.reply_text(_missing_ffmpeg_text('image'))
+        return
+    _image_backend = choice
+    await update.message.reply_text(f"🖼️ Resim gösterici: {_image_backend}")
+
+
+async def seek_playback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Oynayan video/sesi ileri/geri sarar; sadece ffplay yeniden başlar, viewer açık kalır."""
+    if not _is_authorized(update):
+        return
+
+    usage = "Kullanım: /sar +30 (ileri), /sar -10 (geri) veya /sar 1:30 (konuma git)"
+    if not context.args:
+        await update.message.reply_text(usage)
+        return
+    text = context.args[0]
+    try:
+        if text[0] in '+-':
+            command = {'cmd': 'seek', 'by': _parse_clock(text[1:]) * (-1 if text[0] == '-' else 1)}
+        else:
+            command = {'cmd': 'seek', 'to': _parse_clock(text)}
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+
+    # Every display of a mirrored video seeks; the first one answers for all.
+    listening = []
+    for process in list(_viewer_processes.values()):
+        seen = len(process.viewer_events)
+        if process.viewer_kind in ('video', 'audio') and _send_viewer_command(process, command):
+            listening.append((process, seen))
+    if not listening:
+        await update.message.reply_text("ℹ️ Şu anda oynayan bir video/ses yok.")
+        return
+    process, seen = listening[0]
+    event = await _wait_for_viewer_event(process, 'seeked', VIEWER_SEEK_TIMEOUT, after=seen)
+    if event is None:
+        await update.message.reply_text("❌ Oynatıcı sarma komutuna yanıt vermedi.")
+        return
+    await update.message.reply_text(f"⏩ Konum: {_format_clock(event['position'])}")
+
+
+def _parse_start_time(text: str) -> float:
+    """Epoch seconds for '+SECONDS' or the next local 'HH:MM[:SS[.fff]]'."""
+    if text.startswith('+'):
+        offset = float(text[1:])
+        if not math.isfinite(offset) or offset < 0:
+            raise ValueError(f"invalid start offset: {text}")
+        return time.time() + offset
+    parts = text.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"invalid start time: {text}")
+    now = datetime.now()
+    target = now.replace(hour=int(parts[0]), minute=int(parts[1]), second=0, microsecond=0)
+    if len(parts) == 3:
+        seconds = float(parts[2])
+        if not math.isfinite(seconds) or not 0 <= seconds < 60:
+            raise ValueError(f"invalid start time: {text}")
+        target += timedelta(seconds=seconds)
+    if target <= now:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+
+def _format_start_time(start_at: float) -> str:
+    return datetime.fromtimestamp(start_at).strftime('%H:%M:%S.%f')[:-3]
+
+
+async def _run_scheduled_item(item: dict) -> None:
+    """Warm up a viewer ahead of ``start_at`` and record how precisely it started."""
+    try:
+        await asyncio.sleep(max(0.0, item['start_at'] - SCHEDULE_PREPARE_LEAD - time.time()))
+        if should_exit:
+            # Scheduled while /durdur was still downloading it; never reveal it while paused.
+            await item['status'].set(f"⏸️ Planlı medya #{item['id']} bot duraklatıldığı için iptal edildi.")
+            with contextlib.suppress(OSError):
+                os.remove(item['path'])
+            return
+        # The viewer decodes and pre-scales now, then reveals itself at start_at on its own
+        # monotonic timer, so spawn jitter is paid before the start instead of after it.
+        item['processes'] = _spawn_viewers(
+            item['kind'], item['path'], item['seconds'], {**item['options'], 'start_at': repr(item['start_at'])}
+        )
+
+        await asyncio.sleep(max(0.0, item['start_at'] - time.time()))
+        # Hand the screen over: whatever was showing goes away as the scheduled item appears.
+        # It is signalled now and reaped in threads while the new viewers report their start.
+        previous = _signal_viewers()
+        _viewer_processes.update(item['processes'])
+
+        events, _ = await asyncio.gather(
+            asyncio.gather(*(
+                _wait_for_viewer_event(process, 'started', SCHEDULE_PREPARE_LEAD)
+                for process in item['processes'].values()
+            )),
+            _reap_viewers(previous),
+        )
+        errors = [event['error_ms'] for event in events if event]
+        if not errors:
+            await item['status'].set(f"❌ Planlı medya #{item['id']} başlatılamadı.")
+            return
+
+        error_ms = max(errors, key=abs)
+        _schedule_history.append({'id': item['id'], 'kind': item['kind'], 'start_at': item['start_at'], 'error_ms': error_ms})
+        logger.info(f"Scheduled item #{item['id']} started, error {error_ms:+.1f} ms (per display: {errors})")
+        await item['status'].set(f"▶️ Planlı medya #{item['id']} başladı (sapma: {error_ms:+.1f} ms).")
+    except asyncio.CancelledError:
+        processes = list(item['processes'].values())
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        # Reap off the event loop; the files are only removed once the viewer is gone.
+        await asyncio.gather(*(asyncio.to_thread(process.wait) for process in processes))
+        for process in processes:
+            _remove_viewer_files(process)
+        if not item['processes']:
+            try:
+                os.remove(item['path'])
+            except Exception:
+                pass
+        raise
+    except Exception as e:
+        logger.error(f"Scheduled item #{item['id']} failed: {e}", exc_info=True)
+    finally:
+        _scheduled_items.pop(item['id'], None)
+
+
+def _schedule_summary() -> str:
+    lines = ["⏰ Planlı medya"]
+    for item in sorted(_scheduled_items.values(), key=lambda i: i['start_at']):
+        lines.append(f"#{item['id']} {item['kind']} - {_format_start_time(item['start_at'])}")
+    if len(lines) == 1:
+        lines.append("Bekleyen planlı medya yok.")
+    if _schedule_history:
+        lines.append("Son başlangıç sapmaları:")
+        for result in _schedule_history:
+            lines.append(f"#{result['id']} {result['kind']}: {result['error_ms']:+.1f} ms")
+    lines.append("Kullanım: bir medyayı yanıtlayıp /zamanla SS:DD[:ss] veya /zamanla +saniye")
+    return "\n".join(lines)
+
+
+async def schedule_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Yanıtlanan medyayı belirtilen saatte (veya +saniye sonra) göstermek üzere planlar."""
+    if not _is_authorized(update):
+        return
+
+    if not context.args:
+        await update.message.reply_text(_schedule_summary())
+        return
+
+    if context.args[0].lower() in ('iptal', 'cancel'):
+        items = list(_scheduled_items.values())
+        for item in items:
+            item['task'].cancel()
+        await update.message.reply_text(f"🧹 {len(items)} planlı medya iptal edildi.")
+        return
+
+    if should_exit:
+        await update.message.reply_text("⛔ Bot şu anda duraklatılmış durumda. /devam komutu ile tekrar aktif edebilirsiniz.")
+        return
+
+    try:
+        start_at = _parse_start_time(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Kullanım: bir medyayı yanıtlayıp /zamanla SS:DD[:ss] veya /zamanla +saniye")
+        return
+    if start_at - time.time() > SCHEDULE_MAX_AHEAD:
+        await update.message.reply_text("Lütfen en fazla 24 saat sonrası için planlayın.")
+        return
+
+    target = update.message.reply_to_message
+    media = _message_media(target) if target else None
+    if media is None:
+        await update.message.reply_text("❌ Planlamak için bir resim, video veya ses mesajını yanıtlayın.")
+        return
+    status = _StatusMessage(update.message)
+    if await _reject_if_player_missing(status, media['kind']):
+        return
+    try:
+        playback = _playback_options(media['kind'], target)
+    except ValueError as e:
+        await status.set(f"❌ {e}")
+        return
+
+    # Download and probe right away so only the reveal itself is left for the start time.
+    try:
+        file_path = await _download_media(media, status)
+    except DownloadError as e:
+        logger.error(f"Scheduled download failed: {e}")
+        return
+    try:
+        media_info = await asyncio.to_thread(_probe_media, file_path, media['kind'])
+        playback = _with_media_length(media['kind'], playback, media_info)
+    except MediaProbeError as e:
+        logger.warning(f"Rejected scheduled {media['kind']} {file_path}: {e}")
+        await status.set("❌ Dosya açılamadı: bozuk ya da desteklenmeyen bir format.")
+        try:
+            os.remove(file_path)
+        except Exception:
+            pass
+        return
+    except ValueError as e:
+        await status.set(f"❌ {e}")
+        try:
+            os.remove(file_path)
+        except Exception:
+            pass
+        return
+
+    item = {
+        'id': next(_schedule_ids),
+        'kind': media['kind'],
+        'path': file_path,
+        'start_at': start_at,
+        'seconds': DEFAULT_DISPLAY_TIME,
+        'options': {**await _loudness_options(media['kind'], file_path, media_info), **playback},
+        'status': status,
+        'processes': {},
+    }
+    item['task'] = asyncio.create_task(_run_scheduled_item(item))
+    _scheduled_items[item['id']] = item
+    await status.set(f"⏰ Planlı medya #{item['id']}: {_format_start_time(start_at)}")
+
+
 async def emergency_stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Botu duraklatır (ana program çalışmaya devam eder)."""
     if not _is_authorized(update):
@@ -690,9 +3166,14 @@ async def emergency_stop(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
     global should_exit
     should_exit = True
-    _stop_viewer_subprocess()
+    _cancel_media_work()
+    # Scheduled items would otherwise still reveal themselves at their start time.
+    for item in list(_scheduled_items.values()):
+        item['task'].cancel()
+    processes = _signal_viewers()
     await update.message.reply_text("⏸️ Bot duraklatıldı. /devam ile tekrar açabilirsiniz.")
     logger.info("Bot kullanıcı tarafından duraklatıldı.")
+    await _reap_viewers(processes)
 
 async def start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Botu tekrar aktif eder."""
@@ -713,15 +3194,20 @@ async def cancel_view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     """Sadece görüntü penceresini veya ses çalmayı kapatır."""
     if not _is_authorized(update):
         return
-    _stop_viewer_subprocess()
-    await update.message.reply_text("🧹 Görüntü/ses kapatıldı.")
+    cancelled = _cancel_media_work()
+    # Answer as soon as the viewers are signalled; a slow-exiting one is reaped afterwards.
+    processes = _signal_viewers()
+    await update.message.reply_text(
+        "🧹 Görüntü/ses kapatıldı." + (f" ({cancelled} bekleyen medya iptal edildi)" if cancelled else "")
+    )
+    await _reap_viewers(processes)
 
 
 async def shutdown_bot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Ana programı kapatır."""
     if not _is_authorized(update):
         return
-    _stop_viewer_subprocess()
+    await _stop_viewers()
     await update.message.reply_text("🧨 Program kapatılıyor...")
     logger.info("Bot kullanıcı tarafından kapatıldı.")
     os._exit(0)
@@ -736,83 +3222,47 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if should_exit:
         await update.message.reply_text("⛔ Bot şu anda duraklatılmış durumda. /devam komutu ile tekrar aktif edebilirsiniz.")
         return
+
+    # Album parts arrive as separate messages; gather them into one slideshow.
+    if update.message.media_group_id and _is_album_image(update.message):
+        await _collect_album_part(update)
+        return
         
     file_path = None
+    status = _StatusMessage(update.message)
     try:
         logger.info(f"Processing media from {update.effective_user.id}")
 
-        if update.message.photo:
-            file = await update.message.photo[-1].get_file()
-            file_extension = os.path.splitext(file.file_path or '')[-1] or '.jpg'
-            file_path = os.path.join(tempfile.gettempdir(), f"hack_photo_{int(time.time())}{file_extension}")
-            await file.download_to_drive(file_path)
-
-            _start_viewer_subprocess('image', file_path, DEFAULT_DISPLAY_TIME)
-            await update.message.reply_text("✅ Görsel gösteriliyor (viewer açıldı).")
-            await _ensure_viewer_started_or_report(update, 'image')
-            return
-
-        if update.message.document:
-            mime_type = update.message.document.mime_type or ''
-            file_name = update.message.document.file_name or ''
-            file_extension = os.path.splitext(file_name)[-1].lower()
-            
-            if 'image' in mime_type:
-                file = await update.message.document.get_file()
-                file_extension = os.path.splitext(file_name)[-1] or '.jpg'
-                file_path = os.path.join(tempfile.gettempdir(), f"hack_doc_{int(time.time())}{file_extension}")
-                await file.download_to_drive(file_path)
-                _start_viewer_subprocess('image', file_path, DEFAULT_DISPLAY_TIME)
-                await update.message.reply_text("✅ Görsel gösteriliyor (viewer açıldı).")
-                await _ensure_viewer_started_or_report(update, 'image')
-                return
-            
-            # Handle audio files (MP3, WAV, etc.)
-            elif 'audio' in mime_type or file_extension in ['.mp3', '.wav', '.m4a', '.ogg', '.flac']:
-                file = await update.message.document.get_file()
-                file_path = os.path.join(tempfile.gettempdir(), f"hack_audio_{int(time.time())}{file_extension}")
-                await file.download_to_drive(file_path)
-                _start_viewer_subprocess('audio', file_path, DEFAULT_DISPLAY_TIME)
-                await update.message.reply_text("🎵 Ses dosyası çalınıyor (arka planda).")
-                await _ensure_viewer_started_or_report(update, 'audio')
-                return
-
-        if update.message.video:
-            file = await update.message.video.get_file()
-            file_extension = os.path.splitext(file.file_path or '')[-1] or '.mp4'
-            file_path = os.path.join(tempfile.gettempdir(), f"hack_video_{int(time.time())}{file_extension}")
-            await file.download_to_drive(file_path)
-            _start_viewer_subprocess('video', file_path, DEFAULT_DISPLAY_TIME)
-            await update.message.reply_text("✅ Video gösteriliyor (sesli, viewer açıldı).")
-            await _ensure_viewer_started_or_report(update, 'video')
+        media = _message_media(update.message)
+        if media is None:
+            await update.message.reply_text("❌ Lütfen bir resim, video, ses dosyası veya sesli mesaj gönderin.")
             return
-
-        # Handle audio messages (voice notes)
-        if update.message.audio:
-            file = await update.message.audio.get_file()
-            file_extension = os.path.splitext(update.message.audio.file_name or '')[-1] or '.mp3'
-            file_path = os.path.join(tempfile.gettempdir(), f"hack_voice_{int(time.time())}{file_extension}")
-            await file.download_to_drive(file_path)
-            _start_viewer_subprocess('audio', file_path, DEFAULT_DISPLAY_TIME)
-            await update.message.reply_text("🎵 Ses mesajı çalınıyor (arka planda).")
-            await _ensure_viewer_started_or_report(update, 'audio')
+        if await _reject_if_player_missing(status, media['kind']):
             return
-
-        # Handle voice notes
-        if update.message.voice:
-            file = await update.message.voice.get_file()
-            file_path = os.path.join(tempfile.gettempdir(), f"hack_voice_{int(time.time())}.ogg")
-            await file.download_to_drive(file_path)
-            _start_viewer_subprocess('audio', file_path, DEFAULT_DISPLAY_TIME)
-            await update.message.reply_text("🎵 Sesli mesaj çalınıyor (arka planda).")
-            await _ensure_viewer_started_or_report(update, 'audio')
+        try:
+            playback = _playback_options(media['kind'], update.message)
+        except ValueError as e:
+            await status.set(f"❌ {e}")
             return
 
-        await update.message.reply_text("❌ Lütfen bir resim, video, ses dosyası veya sesli mesaj gönderin.")
+        file_path = await _download_media(media, status)
+        await _present_media(status, media['kind'], file_path, media['ack'], media.get('poster'), playback)
 
+    except DownloadError as e:
+        # The status message already tells the user; nothing was saved to clean up.
+        logger.error(f"Download failed: {e}")
+    except asyncio.CancelledError:
+        # Cancelled from the media lane by /iptal or /durdur
+        status.post("🧹 İptal edildi.")
+        try:
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception:
+            pass
+        raise
     except Exception as e:
         logger.error(f"Error processing media: {e}", exc_info=True)
-        await update.message.reply_text("❌ Medya işlenirken hata oluştu.")
+        await status.set("❌ Medya işlenirken hata oluştu.")
         try:
             if file_path and os.path.exists(file_path):
                 os.remove(file_path)
@@ -827,23 +3277,32 @@ def _is_authorized(update: Update) -> bool:
         return False
     return True
 
-def main() -> None:
-    """Botu başlat."""
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("Telegram bot token'ı bulunamadı. Lütfen TELEGRAM_BOT_TOKEN ortam değişkenini ayarlayın.")
-        return
-    
-    if not AUTHORIZED_USERS:
-        logger.warning("Yetkili kullanıcı belirtilmemiş. Bot hiçbir kullanıcıya yanıt vermeyecek.")
-    
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
+_cold_start_seconds: float | None = None  # process start -> first getUpdates
+
+
+class _ColdStartTimingRequest(HTTPXRequest):
+    """getUpdates transport that records how long the bot took to start polling."""
+
+    async def do_request(self, *args, **kwargs):
+        global _cold_start_seconds
+        if _cold_start_seconds is None:
+            _cold_start_seconds = time.perf_counter() - _PROCESS_STARTED
+            logger.info(f"İlk getUpdates çağrısı: başlangıçtan {_cold_start_seconds:.2f} sn sonra")
+        return await super().do_request(*args, **kwargs)
+
+
+def _add_handlers(application: Application) -> None:
+    """Register every command and media handler (shared with the soak harness)."""
     # Add command handlers
     application.add_handler(CommandHandler(["start", "basla"], start))
     application.add_handler(CommandHandler(["help", "yardim"], help_command))
     application.add_handler(CommandHandler(["time", "sure"], set_display_time))
     application.add_handler(CommandHandler(["status", "durum"], status))
+    application.add_handler(CommandHandler(["display", "ekran"], select_display))
+    application.add_handler(CommandHandler(["profile", "profil"], select_profile))
+    application.add_handler(CommandHandler(["renderer", "gosterici"], select_image_backend))
+    application.add_handler(CommandHandler(["seek", "sar"], seek_playback))
+    application.add_handler(CommandHandler(["schedule", "zamanla"], schedule_media))
     application.add_handler(CommandHandler(["cancel", "iptal"], cancel_view))
     application.add_handler(CommandHandler(["stop", "durdur"], emergency_stop))
     application.add_handler(CommandHandler(["resume", "devam", "restart", "yenidenbaslat"], start_bot))
@@ -854,6 +3313,409 @@ def main() -> None:
     
     # Log any errors
     application.add_error_handler(error_handler)
+
+
+_media_lane_tasks: set = set()  # media updates being processed or waiting for their turn
+
+
+_MEDIA_UPDATE_KINDS = ('photo', 'video', 'video_note', 'audio', 'voice', 'document')
+
+
+def _update_label(update: object) -> str:
+    """Short name of an update for lanes and timings: '/iptal', 'photo', 'text', ..."""
+    message = update.effective_message if isinstance(update, Update) else None
+    if message is None:
+        return 'other'
+    if message.text and message.text.startswith('/'):
+        return '/' + message.text.split()[0][1:].split('@')[0].lower()
+    for kind in _MEDIA_UPDATE_KINDS:
+        if getattr(message, kind):
+            return kind
+    return 'text' if message.text else 'other'
+
+
+def _is_media_update(update: object) -> bool:
+    label = _update_label(update)
+    if label.startswith('/'):
+        return label[1:] in MEDIA_LANE_COMMANDS
+    return label in _MEDIA_UPDATE_KINDS
+
+
+def _cancel_media_work() -> int:
+    """Cancel media updates that are downloading, presenting or still queued; returns how many."""
+    tasks = [task for task in _media_lane_tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        logger.info(f"{len(tasks)} medya işi iptal edildi")
+    return len(tasks)
+
+
+class _FairMediaLane:
+    """Per-user queues in front of MEDIA_LANE_SLOTS download slots, served by smooth weighted round-robin.
+
+    Every free slot goes to the waiting user with the most credit; each pick adds
+    a user's USER_PRIORITIES weight to its credit and takes the round's total off
+    the winner, so over a round every user gets turns in proportion to its weight.
+    An item gives its slot back once downloaded (``download_done``) but counts
+    against its user until ``release``, so a user never has more than
+    MEDIA_USER_MAX_IN_FLIGHT items between download and screen and its own
+    items keep their arrival order.
+    """
+
+    def __init__(self, slots: int):
+        self._slots = slots
+        self._busy = 0  # slots taken by items still downloading
+        self._waiting: dict[int, deque] = {}  # user id -> futures in arrival order
+        self._in_flight: Counter = Counter()
+        self._credit: Counter = Counter()
+
+    def queued(self, user_id: int) -> int:
+        return len(self._waiting.get(user_id, ()))
+
+    def in_flight(self, user_id: int) -> int:
+        return self._in_flight[user_id]
+
+    async def acquire(self, user_id: int) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(user_id)  # the slot was granted just as the task was cancelled
+            elif waiter in self._waiting.get(user_id, ()):
+                self._waiting[user_id].remove(waiter)
+                if not self._waiting[user_id]:
+                    del self._waiting[user_id]
+            raise
+
+    def download_done(self) -> None:
+        """An item has its file: free its slot for the next download."""
+        self._busy -= 1
+        self._dispatch()
+
+    def release(self, user_id: int, downloading: bool = True) -> None:
+        """The item is done; ``downloading`` if it never called ``download_done``."""
+        if downloading:
+            self._busy -= 1
+        self._in_flight[user_id] -= 1
+        if not self._in_flight[user_id]:
+            del self._in_flight[user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._busy < self._slots:
+            ready = [user for user, waiters in self._waiting.items()
+                     if self._in_flight[user] < MEDIA_USER_MAX_IN_FLIGHT]
+            if not ready:
+                break
+            for user in ready:
+                self._credit[user] += USER_PRIORITIES.get(user, 1)
+            chosen = max(ready, key=lambda user: self._credit[user])
+            self._credit[chosen] -= sum(USER_PRIORITIES.get(user, 1) for user in ready)
+            waiters = self._waiting[chosen]
+            waiter = waiters.popleft()
+            if not waiters:
+                del self._waiting[chosen]
+            if waiter.done():
+                continue  # cancelled, its task is unwinding
+            self._busy += 1
+            self._in_flight[chosen] += 1
+            waiter.set_result(None)
+        # A user with nothing waiting starts the next busy period without old credit or debt
+        for user in [user for user in self._credit if user not in self._waiting]:
+            del self._credit[user]
+
+
+_media_lane: _FairMediaLane | None = None  # set by _PriorityUpdateProcessor, read by /durum
+# {'lane', 'downloading'} of the media update running in this context, set by the processor
+_media_turn: contextvars.ContextVar[dict | None] = contextvars.ContextVar('media_turn', default=None)
+
+
+def _end_download_turn() -> None:
+    """Hand the current media update's download slot to the next waiting item."""
+    turn = _media_turn.get()
+    if turn and turn['downloading']:
+        turn['downloading'] = False
+        turn['lane'].download_done()
+
+
+_user_media_stats: dict[int, dict] = {}  # user id -> name, counts, queue waits, completion times
+
+
+def _user_stats(user) -> dict:
+    stats = _user_media_stats.get(user.id)
+    if stats is None:
+        stats = _user_media_stats[user.id] = {
+            'name': user.first_name or str(user.id), 'done': 0, 'rejected': 0,
+            'waits': deque(maxlen=STAGE_HISTORY_SIZE), 'durations': deque(maxlen=STAGE_HISTORY_SIZE),
+            'finished': deque(),
+        }
+    return stats
+
+
+def _user_media_summary() -> str:
+    now = time.monotonic()
+    lines = []
+    for user_id, stats in _user_media_stats.items():
+        finished = stats['finished']
+        while finished and finished[0] < now - USER_STATS_WINDOW:
+            finished.popleft()
+        waits, durations = sorted(stats['waits']), sorted(stats['durations'])
+        wait = f"{waits[len(waits) // 2]:.1f} sn (en çok {waits[-1]:.1f})" if waits else "-"
+        duration = f"{durations[len(durations) // 2]:.1f} sn" if durations else "-"
+        queued = _media_lane.queued(user_id) if _media_lane else 0
+        in_flight = _media_lane.in_flight(user_id) if _media_lane else 0
+        rate = len(finished) * 60 / USER_STATS_WINDOW
+        line = (f"   {stats['name']} ({user_id}): {stats['done']} medya, {rate:.1f}/dk, "
+                f"sıra bekleme {wait}, işlem {duration}, sırada {queued}, işlemde {in_flight}")
+        if stats['rejected']:
+            line += f", geri çevrilen {stats['rejected']}"
+        lines.append(line)
+    return "\n" + "\n".join(lines) if lines else "-"
+
+
+class _PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Two lanes on top of concurrent updates.
+
+    Control updates (/iptal, /durdur, /durum, ...) run as soon as they arrive.
+    Media updates wait in their sender's queue and are taken in turn through
+    _FairMediaLane, so one user sending a lot cannot starve the others. Every
+    media update, in flight or still queued, can be cancelled through
+    _cancel_media_work.
+    """
+
+    def __init__(self):
+        global _media_lane
+        super().__init__(max_concurrent_updates=MEDIA_LANE_MAX_UPDATES)
+        self._media_lane = _media_lane = _FairMediaLane(MEDIA_LANE_SLOTS)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        if _capture is not None:
+            _capture.record_update(update)
+        stage = f"update:{_update_label(update)}"
+        user = update.effective_user if isinstance(update, Update) else None
+        if not _is_media_update(update) or user is None:
+            with _timed_stage(stage):
+                await coroutine
+            return
+
+        if self._media_lane.queued(user.id) >= MEDIA_USER_MAX_QUEUED:
+            coroutine.close()
+            if user.id in AUTHORIZED_USERS:
+                _user_stats(user)['rejected'] += 1
+                logger.warning(f"Kullanıcı {user.id} medya kuyruğu dolu, gönderi atlandı")
+                await update.effective_message.reply_text(
+                    f"⏳ Sırada zaten {MEDIA_USER_MAX_QUEUED} medyanız var; bu gönderi atlandı. "
+                    "Öncekiler gösterildikçe yenilerini gönderebilirsiniz (hepsini bırakmak için /iptal)."
+                )
+            return
+
+        arrived = time.perf_counter()
+        task = asyncio.current_task()
+        _media_lane_tasks.add(task)
+        try:
+            await self._media_lane.acquire(user.id)
+            turn = {'lane': self._media_lane, 'downloading': True}
+            token = _media_turn.set(turn)
+            try:
+                waited = time.perf_counter() - arrived
+                _stage_timings['queue'].append(waited)
+                with _timed_stage(stage):
+                    await coroutine
+            finally:
+                # Tasks started by the handler inherit the turn; it must not free a slot twice.
+                downloading, turn['downloading'] = turn['downloading'], False
+                _media_turn.reset(token)
+                self._media_lane.release(user.id, downloading)
+            if user.id in AUTHORIZED_USERS:
+                stats = _user_stats(user)
+                stats['done'] += 1
+                stats['waits'].append(waited)
+                stats['durations'].append(time.perf_counter() - arrived - waited)
+                stats['finished'].append(time.monotonic())
+        except asyncio.CancelledError:
+            coroutine.close()  # cancelled while queued: it never ran
+            raise
+        finally:
+            _media_lane_tasks.discard(task)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()  # waiters are served in arrival order
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class _ChatRateLimiter(BaseRateLimiter):
+    """Per-chat and global token buckets in front of every Bot API call.
+
+    Sustained bursts are held to OUTBOUND_CHAT_RATE messages per second per
+    chat; a RetryAfter from Telegram is waited out and the call retried, so it
+    never reaches the error handler.
+    """
+
+    def __init__(self):
+        self._chats: dict[int | str, _TokenBucket] = {}
+        self._global = _TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = self._chats[chat_id] = _TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            await bucket.acquire()
+        if endpoint != 'getUpdates':
+            await self._global.acquire()
+
+        for attempt in itertools.count():
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= OUTBOUND_MAX_RETRIES:
+                    raise
+                delay = e.retry_after
+                delay = delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+                _metrics['retry_after'] += 1
+                logger.warning(f"{endpoint}: Telegram {delay:.0f} sn beklememizi istedi (deneme {attempt + 1})")
+                await asyncio.sleep(delay)
+
+
+_loop_heartbeat = time.monotonic()  # last time the event loop got to run the heartbeat
+_pending_stall: dict | None = None  # captured by the watchdog while the loop is still blocked
+_stall_history: deque = deque(maxlen=STALL_HISTORY_SIZE)
+_stall_counts: Counter = Counter()  # handler -> number of stalls
+
+
+# Coroutines that only route an update to its handler; a stall is charged to the handler below them.
+_STALL_ROUTING_CODES = {_PriorityUpdateProcessor.do_process_update.__code__}
+
+
+def _describe_stall(frame) -> dict:
+    """Name the handler and the blocking call site in a stack captured from the loop thread."""
+    this_file = os.path.abspath(__file__)
+    handler = site = None
+    while frame is not None:
+        code = frame.f_code
+        if os.path.abspath(code.co_filename) == this_file:
+            if site is None:
+                site = f"{code.co_name}:{frame.f_lineno}"
+            # The outermost coroutine of ours is the handler (or task) the loop was running.
+            if code.co_flags & inspect.CO_COROUTINE and code not in _STALL_ROUTING_CODES:
+                handler = code.co_name
+        frame = frame.f_back
+    return {'handler': handler or '?', 'site': site or '?'}
+
+
+def _stall_watchdog(loop_thread_id: int) -> None:
+    """Daemon thread: while the heartbeat is overdue, capture where the loop thread is stuck."""
+    global _pending_stall
+    while True:
+        time.sleep(STALL_HEARTBEAT_INTERVAL / 2)
+        overdue = time.monotonic() - _loop_heartbeat - STALL_HEARTBEAT_INTERVAL
+        if overdue < STALL_THRESHOLD or _pending_stall is not None:
+            continue
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            continue
+        stall = _describe_stall(frame)
+        stall['stack'] = ''.join(traceback.format_stack(frame))
+        _pending_stall = stall
+        logger.warning(f"Olay döngüsü {STALL_THRESHOLD * 1000:.0f} ms'den uzun bloke: "
+                       f"{stall['handler']} ({stall['site']})\n{stall['stack']}")
+
+
+async def _loop_heartbeat_task() -> None:
+    """Beat on the event loop and close the stall record once the loop runs again."""
+    global _loop_heartbeat, _pending_stall
+    while True:
+        _loop_heartbeat = time.monotonic()
+        await asyncio.sleep(STALL_HEARTBEAT_INTERVAL)
+        lag = time.monotonic() - _loop_heartbeat - STALL_HEARTBEAT_INTERVAL
+        if lag < STALL_THRESHOLD:
+            continue
+        # A stall shorter than the watchdog's polling can end before it is captured.
+        stall = _pending_stall or {'handler': '?', 'site': '?'}
+        _pending_stall = None
+        _stall_counts[stall['handler']] += 1
+        _stall_history.append({'handler': stall['handler'], 'site': stall['site'],
+                               'lag_ms': lag * 1000, 'at': time.time()})
+        logger.warning(f"Olay döngüsü {lag * 1000:.0f} ms bloke kaldı: {stall['handler']} ({stall['site']})")
+
+
+def _start_stall_watchdog() -> None:
+    """Start the heartbeat and its watchdog; call from the event loop thread."""
+    asyncio.get_running_loop().create_task(_loop_heartbeat_task())
+    threading.Thread(target=_stall_watchdog, args=(threading.get_ident(),), daemon=True,
+                     name="stall-watchdog").start()
+
+
+def _stall_summary() -> str:
+    if not _stall_history:
+        return "yok"
+    worst = max(_stall_history, key=lambda stall: stall['lag_ms'])
+    handlers = ", ".join(f"{handler} {count}" for handler, count in _stall_counts.most_common(3))
+    return (f"{sum(_stall_counts.values())} kez ({handlers}); "
+            f"son {len(_stall_history)} içinde en uzun {worst['lag_ms']:.0f} ms: {worst['handler']} ({worst['site']})")
+
+
+def main(record_dir: str | None = None) -> None:
+    """Botu başlat."""
+    global _capture
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("Telegram bot token'ı bulunamadı. Lütfen TELEGRAM_BOT_TOKEN ortam değişkenini ayarlayın.")
+        return
+    
+    if not AUTHORIZED_USERS:
+        logger.warning("Yetkili kullanıcı belirtilmemiş. Bot hiçbir kullanıcıya yanıt vermeyecek.")
+
+    if record_dir:
+        try:
+            _capture = _UpdateCapture(record_dir)
+        except FileExistsError:
+            logger.error(f"{record_dir} içinde zaten bir kayıt var; yeni kayıt için boş bir klasör verin.")
+            return
+        logger.info(f"Kayıt modu: güncellemeler ve medya {record_dir} klasörüne yazılıyor")
+    
+    # Create the Application
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .get_updates_request(_ColdStartTimingRequest())
+        .rate_limiter(_ChatRateLimiter())
+        .concurrent_updates(_PriorityUpdateProcessor())
+        .build()
+    )
+    _add_handlers(application)
     
     # Bot menüsü için komutları ayarla
     commands = [
@@ -861,17 +3723,30 @@ def main() -> None:
         BotCommand("help", "Yardım mesajını göster"),
         BotCommand("time", "Görüntüleme süresini ayarla"),
         BotCommand("status", "Bot durumunu göster"),
+        BotCommand("display", "Hedef ekranı seç"),
+        BotCommand("profile", "Video/ses başlatma profilini seç"),
+        BotCommand("renderer", "Resim gösterme motorunu seç"),
+        BotCommand("seek", "Oynayan video/sesi ileri/geri sar"),
+        BotCommand("schedule", "Medyayı belirli bir zamanda göster"),
         BotCommand("cancel", "Görüntüyü kapat"),
         BotCommand("stop", "Botu duraklat"),
         BotCommand("resume", "Botu devam ettir"),
         BotCommand("shutdown", "Programı kapat")
     ]
     
-    # Set up the bot commands
+    # Set up the bot commands and tool discovery in the background so polling is not held back by them
     async def post_init(application):
-        await application.bot.set_my_commands(commands)
+        application.create_task(application.bot.set_my_commands(commands))
+        # Locate ffplay/ffmpeg/ffprobe off the event loop; media handlers wait for it if needed
+        application.create_task(_media_tools_ready())
+        _start_stall_watchdog()
     
+    async def post_shutdown(application):
+        if _capture is not None:
+            _capture.close()
+
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
     
     # Botu başlat
     logger.info("Bot başlatılıyor...")
@@ -880,6 +3755,9 @@ def main() -> None:
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Güncellemelerden kaynaklanan hataları kaydeder."""
     logger.error(f"Hata: {context.error}", exc_info=context.error)
+    if isinstance(context.error, RetryAfter):
+        # Flood control: replying now would only draw another RetryAfter.
+        return
     
     # Sadece yetkili kullanıcılardan gelen hatalar için mesaj gönder
     if isinstance(update, Update) and update.effective_message and _is_authorized(update):
@@ -890,4 +3768,10 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 if __name__ == "__main__":
     if len(sys.argv) >= 2 and sys.argv[1] == '--viewer':
         raise SystemExit(_viewer_main(sys.argv))
-    main()
+    record_dir = None
+    if len(sys.argv) >= 2 and sys.argv[1] == '--record':
+        if len(sys.argv) < 3 or not sys.argv[2]:
+            print("Kullanım: python screen_display_bot.py --record <klasör>", file=sys.stderr)
+            raise SystemExit(2)
+        record_dir = sys.argv[2]  # capture updates and media for replay.py
+    main(record_dir)
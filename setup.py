@@ -10,8 +10,32 @@ import subprocess
 import platform
 import urllib.request
 import json
+import argparse
+import hashlib
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+WHEELHOUSE_DIR = Path("wheelhouse")
+CACHE_DIR = Path(".setup_cache")
+FFMPEG_URL = "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip"
+FFMPEG_CHECKSUMS_URL = "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/checksums.sha256"
+
+_phase_times = []
+
+@contextmanager
+def phase(name):
+    """Time a setup phase and remember it for the summary"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _phase_times.append((name, elapsed))
+        print(f"⏱️  {name}: {elapsed:.1f}s")
+
 def run_command(cmd, check=True, capture_output=False):
     """Run command with proper error handling"""
     try:
@@ -72,29 +96,127 @@ def get_python_command():
     else:
         return "venv/bin/python"
 
-def install_dependencies():
-    """Install required Python packages"""
+def install_dependencies(offline=False):
+    """Install required Python packages (from the local wheelhouse when offline)"""
     print("📚 Installing Python dependencies...")
     
     pip_cmd = get_pip_command()
     
+    if offline:
+        if not WHEELHOUSE_DIR.exists():
+            print(f"❌ Offline mode needs {WHEELHOUSE_DIR}/. Run 'python setup.py --build-cache' first.")
+            return False
+        print(f"📦 Installing requirements from {WHEELHOUSE_DIR}/ (offline)...")
+        result = run_command(f'{pip_cmd} install --no-index --find-links "{WHEELHOUSE_DIR}" -r requirements.txt')
+        if not result:
+            return False
+        print("✅ Dependencies installed")
+        return True
+    
     # Upgrade pip first
     print("🔄 Upgrading pip...")
     run_command(f"{pip_cmd} install --upgrade pip", check=False)
     
     # Install requirements
     print("📦 Installing requirements...")
-    result = run_command(f"{pip_cmd} install -r requirements.txt")
+    find_links = f' --find-links "{WHEELHOUSE_DIR}"' if WHEELHOUSE_DIR.exists() else ""
+    result = run_command(f"{pip_cmd} install{find_links} -r requirements.txt")
     if not result:
         return False
     
     print("✅ Dependencies installed")
     return True
 
+def build_wheelhouse():
+    """Download/build wheels for every requirement into the wheelhouse"""
+    print(f"🏗️  Building wheelhouse in {WHEELHOUSE_DIR}/...")
+    WHEELHOUSE_DIR.mkdir(exist_ok=True)
+    result = run_command(f'"{sys.executable}" -m pip wheel --wheel-dir "{WHEELHOUSE_DIR}" -r requirements.txt')
+    if not result:
+        return False
+    print("✅ Wheelhouse ready")
+    return True
+
+def sha256_of(path):
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fetch_ffmpeg_checksum():
+    """Published SHA-256 of the FFmpeg archive, or None if it cannot be fetched"""
+    archive_name = FFMPEG_URL.rsplit("/", 1)[-1]
+    try:
+        with urllib.request.urlopen(FFMPEG_CHECKSUMS_URL, timeout=30) as response:
+            for line in response.read().decode().splitlines():
+                parts = line.split()
+                if len(parts) == 2 and parts[1].lstrip("*") == archive_name:
+                    return parts[0].lower()
+    except Exception as e:
+        print(f"⚠️  Could not fetch FFmpeg checksums: {e}")
+    return None
+
+def get_ffmpeg_archive(offline=False):
+    """Return a checksum-verified FFmpeg archive, downloading it only when needed"""
+    CACHE_DIR.mkdir(exist_ok=True)
+    archive_path = CACHE_DIR / FFMPEG_URL.rsplit("/", 1)[-1]
+    checksum_path = archive_path.with_name(archive_path.name + ".sha256")
+    
+    if archive_path.exists() and checksum_path.exists():
+        if sha256_of(archive_path) == checksum_path.read_text().strip():
+            print("✅ Using cached FFmpeg archive (checksum OK)")
+            return archive_path
+        print("⚠️  Cached FFmpeg archive is corrupt, discarding it")
+        archive_path.unlink()
+    
+    if offline:
+        print(f"❌ No verified FFmpeg archive in {CACHE_DIR}/. Run 'python setup.py --build-cache' first.")
+        return None
+    
+    # Only the published checksum is trusted; the download's own hash proves nothing
+    expected = fetch_ffmpeg_checksum()
+    if expected is None:
+        print("❌ Published FFmpeg checksum unavailable, not downloading an archive that cannot be verified")
+        return None
+    
+    print("📥 Downloading FFmpeg...")
+    partial_path = archive_path.with_name(archive_path.name + ".part")
+    try:
+        urllib.request.urlretrieve(FFMPEG_URL, partial_path)
+    except Exception as e:
+        if partial_path.exists():
+            partial_path.unlink()
+        print(f"❌ FFmpeg download failed: {e}")
+        return None
+    if sha256_of(partial_path) != expected:
+        partial_path.unlink()
+        print("❌ FFmpeg download failed checksum verification")
+        return None
+    partial_path.replace(archive_path)
+    checksum_path.write_text(expected)
+    print("✅ FFmpeg archive cached (checksum verified)")
+    return archive_path
+
+def build_cache(include_ffmpeg):
+    """Prepare everything needed for offline installs: wheelhouse and FFmpeg archive"""
+    # Both are plain downloads that never prompt, so they can share the terminal
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        wheels = pool.submit(build_wheelhouse)
+        ffmpeg = pool.submit(get_ffmpeg_archive) if include_ffmpeg else None
+        wheels_ok = wheels.result()
+        ffmpeg_ok = ffmpeg is None or ffmpeg.result() is not None
+    return wheels_ok and ffmpeg_ok
+
 def check_ffmpeg():
     """Check if FFmpeg is installed"""
     system = platform.system().lower()
     
+    # A previous run may already have installed it locally
+    if system == "windows" and (Path("ffmpeg") / "bin" / "ffplay.exe").exists():
+        return True
+    
     if system == "windows":
         ffmpeg_cmd = "ffmpeg.exe"
         ffplay_cmd = "ffplay.exe"
@@ -102,21 +224,23 @@ def check_ffmpeg():
         ffmpeg_cmd = "ffmpeg"
         ffplay_cmd = "ffplay"
     
-    ffmpeg_exists = run_command(f"which {ffmpeg_cmd}" if system != "windows" else f"where {ffmpeg_cmd}", check=False)
-    ffplay_exists = run_command(f"which {ffplay_cmd}" if system != "windows" else f"where {ffplay_cmd}", check=False)
-    
-    return ffmpeg_exists is not None and ffplay_exists is not None
+    # run_command(check=False) returns a result even when which/where fails, so ask shutil
+    return shutil.which(ffmpeg_cmd) is not None and shutil.which(ffplay_cmd) is not None
 
-def install_ffmpeg():
+def install_ffmpeg(offline=False):
     """Install FFmpeg based on platform"""
     system = platform.system().lower()
     
+    if offline and system != "windows":
+        print("❌ --offline cannot install FFmpeg: Homebrew and the system package managers need the network.")
+        print("   Install FFmpeg on this machine first, then run 'python setup.py --offline' again.")
+        return False
+    
     print("🎬 Installing FFmpeg...")
     
     if system == "darwin":  # macOS
         # Check if Homebrew is installed
-        brew_exists = run_command("which brew", check=False)
-        if not brew_exists:
+        if not shutil.which("brew"):
             print("🍺 Installing Homebrew...")
             install_cmd = '/bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)"'
             result = run_command(install_cmd)
@@ -138,16 +262,15 @@ def install_ffmpeg():
         # Try to download and extract FFmpeg automatically
         try:
             print("🔄 Attempting automatic FFmpeg installation...")
-            ffmpeg_url = "https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip"
             
             import zipfile
             import tempfile
             
+            zip_path = get_ffmpeg_archive(offline)
+            if zip_path is None:
+                return False
+            
             with tempfile.TemporaryDirectory() as temp_dir:
-                zip_path = os.path.join(temp_dir, "ffmpeg.zip")
-                print("📥 Downloading FFmpeg...")
-                urllib.request.urlretrieve(ffmpeg_url, zip_path)
-                
                 print("📂 Extracting FFmpeg...")
                 with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                     zip_ref.extractall(temp_dir)
@@ -164,7 +287,6 @@ def install_ffmpeg():
                     local_ffmpeg = Path("ffmpeg")
                     local_ffmpeg.mkdir(exist_ok=True)
                     
-                    import shutil
                     for item in os.listdir(ffmpeg_dir):
                         s = os.path.join(ffmpeg_dir, item)
                         d = os.path.join(local_ffmpeg, item)
@@ -191,8 +313,7 @@ def install_ffmpeg():
         ]
         
         for pm, cmd in package_managers:
-            pm_exists = run_command(f"which {pm}", check=False)
-            if pm_exists:
+            if shutil.which(pm):
                 print(f"📦 Using {pm} to install FFmpeg...")
                 result = run_command(cmd)
                 return result is not None
@@ -250,8 +371,43 @@ python screen_display_bot.py
         os.chmod("start_bot.sh", 0o755)
         print("✅ Created start_bot.sh")
 
+def setup_python_environment(offline):
+    """Virtual environment followed by the Python dependencies"""
+    with phase("Virtual environment"):
+        if not setup_virtual_environment():
+            return False
+    with phase("Python dependencies"):
+        return install_dependencies(offline)
+
+def setup_ffmpeg(offline):
+    """Check and install FFmpeg"""
+    with phase("FFmpeg"):
+        if not check_ffmpeg():
+            print("⚠️  FFmpeg not found. Installing...")
+            if not install_ffmpeg(offline):
+                print("❌ FFmpeg installation failed. Please install manually.")
+                return False
+        return True
+
+def print_phase_summary():
+    """Print how long each phase took"""
+    print("\n⏱️  Time per phase:")
+    for name, elapsed in _phase_times:
+        print(f"   {name}: {elapsed:.1f}s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cross-platform setup for the Telegram screen display bot")
+    parser.add_argument("--build-cache", action="store_true",
+                        help=f"build {WHEELHOUSE_DIR}/ (and the Windows FFmpeg archive in {CACHE_DIR}/) for offline installs, then exit")
+    parser.add_argument("--with-ffmpeg-archive", action="store_true",
+                        help="with --build-cache: also cache the Windows FFmpeg archive on non-Windows hosts")
+    parser.add_argument("--offline", action="store_true",
+                        help=f"install only from {WHEELHOUSE_DIR}/ and {CACHE_DIR}/, without network access")
+    return parser.parse_args()
+
 def main():
     """Main setup function"""
+    args = parse_args()
     print("🚀 Telegram Bot Setup - Cross Platform")
     print("=" * 50)
     
@@ -259,20 +415,37 @@ def main():
     if not check_python_version():
         return False
     
-    # Setup virtual environment
-    if not setup_virtual_environment():
-        return False
+    if args.build_cache:
+        include_ffmpeg = args.with_ffmpeg_archive or platform.system().lower() == "windows"
+        with phase("Build offline cache"):
+            success = build_cache(include_ffmpeg)
+        print_phase_summary()
+        if success:
+            print(f"\n🎉 Offline cache ready. Copy the project (with {WHEELHOUSE_DIR}/ and {CACHE_DIR}/) "
+                  "to each box and run: python setup.py --offline")
+        return success
     
-    # Install dependencies
-    if not install_dependencies():
+    system = platform.system().lower()
+    if args.offline and system != "windows" and not check_ffmpeg():
+        # Fail before pip runs: only a package manager with network access could add FFmpeg here
+        install_ffmpeg(offline=True)
         return False
     
-    # Check and install FFmpeg
-    if not check_ffmpeg():
-        print("⚠️  FFmpeg not found. Installing...")
-        if not install_ffmpeg():
-            print("❌ FFmpeg installation failed. Please install manually.")
-            return False
+    with phase("Total install"):
+        if system == "windows":
+            # Unpacking the cached or downloaded FFmpeg archive never prompts: run it beside pip
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                python_env = pool.submit(setup_python_environment, args.offline)
+                ffmpeg = pool.submit(setup_ffmpeg, args.offline)
+                python_ok, ffmpeg_ok = python_env.result(), ffmpeg.result()
+        else:
+            # sudo apt-get/yum/dnf/pacman, the Homebrew installer and brew may ask for a password
+            # or confirmation, so they run alone in the foreground before the Python environment
+            ffmpeg_ok = setup_ffmpeg(args.offline)
+            python_ok = setup_python_environment(args.offline)
+    if not (python_ok and ffmpeg_ok):
+        print_phase_summary()
+        return False
     
     # Create .env file
     create_env_file()
@@ -280,12 +453,12 @@ def main():
     # Create startup scripts
     create_startup_scripts()
     
+    print_phase_summary()
     print("\n🎉 Setup completed successfully!")
     print("\n📋 Next steps:")
     print("1. Edit .env file with your bot token and user ID")
     print("2. Run start_bot.bat (Windows) or start_bot.sh (Mac/Linux)")
     print("\n🔧 To run manually:")
-    system = platform.system().lower()
     if system == "windows":
         print("   venv\\Scripts\\activate")
         print("   python screen_display_bot.py")
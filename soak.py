@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Soak harness for the screen display bot.
+
+Pushes tens of thousands of synthetic updates through the real handlers
+(Application.process_update -> handle_media, /iptal, /durum, albums) with a
+stubbed Telegram network and a fake viewer process, and samples file
+descriptors, child processes, threads, temp-dir usage, RSS and event-loop
+lag along the way. Exits with status 1 when any of them keeps growing.
+
+Usage:
+    python soak.py                      # 20000 updates
+    python soak.py --updates 200000 --sample-every 2000
+    python soak.py --image-backend ffplay   # photos handed over between running viewers
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+FAKE_VIEWER_MAX_SECONDS = 0.2  # fake viewers exit on their own within this, unless cancelled first
+# When set (seconds), fake viewers stay up until cancelled and then take this long to exit.
+SLOW_EXIT_ENV = 'SOAK_VIEWER_SLOW_EXIT'
+
+
+def fake_viewer(argv):
+    """Stand-in for `screen_display_bot.py --viewer`: same arguments, same cleanup contract.
+
+    Viewers that play through ffplay also take handed-over items from stdin, like the real one.
+    """
+    kind, media_path = argv[2], argv[3]
+    options = dict(arg.partition('=')[::2] for arg in argv[5:])
+    stopped = False
+    handed = []  # paths of handed-over items, newest last
+    playing = threading.Lock()  # held by the reader while it takes an item; items are refused once closing
+    closing = False
+
+    def signal_handler(signum, frame):
+        nonlocal stopped
+        stopped = True
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, signal_handler)
+
+    def read_commands():
+        nonlocal deadline
+        for line in sys.stdin:
+            command = json.loads(line)
+            with playing:
+                if command.get('cmd') == 'play' and not closing:
+                    print(json.dumps({'event': 'loaded', 'path': command['path']}), flush=True)
+                    print(json.dumps({'event': 'shown', 'kind': command['kind']}), flush=True)
+                    handed.append(command['path'])
+                    deadline = time.monotonic() + random.uniform(0, FAKE_VIEWER_MAX_SECONDS)
+
+    slow_exit = float(os.environ.get(SLOW_EXIT_ENV) or 0)
+    deadline = time.monotonic() + (float('inf') if slow_exit else random.uniform(0, FAKE_VIEWER_MAX_SECONDS))
+    if kind in ('video', 'audio') or options.get('backend') == 'ffplay':
+        threading.Thread(target=read_commands, daemon=True).start()
+        print(json.dumps({'event': 'shown', 'kind': kind}), flush=True)
+    while not stopped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with playing:
+        closing = True
+    time.sleep(slow_exit)
+
+    paths = [media_path, *handed]
+    if kind == 'slideshow':
+        with open(media_path, encoding='utf-8') as f:
+            paths.extend(json.load(f))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print(json.dumps({'event': 'memory', 'kind': kind, 'peak_rss': None,
+                      'children_peak_rss': None, 'budget': None}), flush=True)
+    return 0
+
+
+# Fake viewers re-run this file; keep them light by exiting before the bot/telegram imports.
+if __name__ == '__main__' and sys.argv[1:2] == ['--viewer']:
+    raise SystemExit(fake_viewer(sys.argv))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+# Allowed growth over the steady-state part of the run (after warm-up)
+TREND_LIMITS = {
+    'fds': 4,
+    'children': 1,
+    'zombies': 1,
+    'threads': 2,
+    'temp_files': 2,
+    'temp_kb': 256,
+    'rss_mb': 24,
+    'lag_ms': 50,
+}
+WARMUP_FRACTION = 0.2  # samples ignored while caches fill up
+LAG_PROBE_INTERVAL = 0.05
+
+
+class StubRequest(BaseRequest):
+    """Telegram Bot API stand-in: answers every call locally and serves the synthetic files."""
+
+    def __init__(self, files: dict[str, bytes], chat_id: int):
+        self._files = files
+        self._chat_id = chat_id
+        self._message_ids = itertools.count(1_000_000)
+        self.calls = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, text: str) -> dict:
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': self._chat_id, 'type': 'private'}, 'text': text}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        if '/file/bot' in url:
+            # Each file is served once, like a download, so the harness itself does not grow.
+            return 200, self._files.pop(url.rsplit('/', 1)[-1], b'')
+
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Soak', 'username': 'soak_bot'}
+        elif endpoint == 'getFile':
+            file_id = params['file_id']
+            result = {'file_id': file_id, 'file_unique_id': file_id,
+                      'file_size': len(self._files.get(file_id, b'')), 'file_path': f"soak/{file_id}"}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            result = self._message(params.get('text', ''))
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class UpdateFactory:
+    """Deterministic mix of media, albums and control commands."""
+
+    def __init__(self, files: dict[str, bytes], user_id: int, seed: int):
+        self._files = files
+        self._user_id = user_id
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._jpeg = self._make_jpeg()
+
+    @staticmethod
+    def _make_jpeg() -> bytes:
+        from io import BytesIO
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), (200, 40, 40)).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def _file(self, prefix: str, payload: bytes) -> str:
+        file_id = f"{prefix}-{next(self._ids)}"
+        # Unique trailing bytes give every item its own content hash, so caches really churn.
+        self._files[file_id] = payload + self._random.randbytes(16)
+        return file_id
+
+    def _update(self, user_id: int | None = None, **message) -> dict:
+        update_id = next(self._ids)
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id or self._user_id, 'type': 'private'},
+                'from': {'id': user_id or self._user_id, 'is_bot': False, 'first_name': 'Soak'},
+                **message,
+            },
+        }
+
+    def _photo(self) -> list[dict]:
+        file_id = self._file('photo', self._jpeg)
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 64, 'height': 48,
+                 'file_size': len(self._files[file_id])}]
+
+    def photo_update(self, user_id: int | None = None) -> dict:
+        return self._update(user_id, photo=self._photo())
+
+    def command_update(self, text: str) -> dict:
+        command_length = len(text.split()[0])
+        return self._update(text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': command_length}])
+
+    def next_batch(self) -> list[dict]:
+        roll = self._random.random()
+        if roll < 0.30:
+            return [self.photo_update()]
+        if roll < 0.45:
+            file_id = self._file('doc', self._jpeg)
+            return [self._update(document={'file_id': file_id, 'file_unique_id': file_id,
+                                           'file_name': 'image.jpg', 'mime_type': 'image/jpeg'})]
+        if roll < 0.60:
+            file_id = self._file('voice', b'OggS')
+            return [self._update(voice={'file_id': file_id, 'file_unique_id': file_id, 'duration': 1,
+                                        'mime_type': 'audio/ogg'})]
+        if roll < 0.70:
+            file_id = self._file('audio', b'ID3')
+            return [self._update(document={'file_id': file_id, 'file_unique_id': file_id,
+                                           'file_name': 'song.mp3', 'mime_type': 'audio/mpeg'})]
+        if roll < 0.75:
+            group_id = f"album-{next(self._ids)}"
+            return [self._update(photo=self._photo(), media_group_id=group_id) for _ in range(3)]
+        if roll < 0.85:
+            return [self.command_update('/iptal')]
+        if roll < 0.90:
+            return [self.command_update('/durum')]
+        if roll < 0.93:
+            # Unauthorized sender: must be ignored without leaving anything behind
+            photo = self._photo()
+            del self._files[photo[0]['file_id']]  # never downloaded
+            return [self._update(user_id=self._user_id + 1, photo=photo)]
+        return [self._update(text='merhaba')]
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.last = None
+
+    def emit(self, record):
+        self.count += 1
+        self.last = record.getMessage()
+
+
+def _open_fds() -> int | None:
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def _children() -> tuple[int | None, int | None]:
+    """(live, zombie) direct children of this process; Linux only."""
+    if not os.path.isdir('/proc'):
+        return None, None
+    live = zombies = 0
+    my_pid = str(os.getpid())
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # "pid (comm) state ppid ..." -- comm may contain spaces, so split after ')'
+                state, ppid = f.read().rsplit(')', 1)[1].split()[:2]
+        except (OSError, ValueError):
+            continue
+        if ppid == my_pid:
+            if state == 'Z':
+                zombies += 1
+            else:
+                live += 1
+    return live, zombies
+
+
+def _rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def _temp_usage(temp_dir: str) -> tuple[int, float]:
+    files, size = 0, 0
+    for path in Path(temp_dir).rglob('*'):
+        try:
+            if path.is_file():
+                files += 1
+                size += path.stat().st_size
+        except OSError:
+            pass
+    return files, size / 1024
+
+
+async def _watch_loop_lag(state: dict) -> None:
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        lag = (time.monotonic() - started - LAG_PROBE_INTERVAL) * 1000
+        state['max_lag_ms'] = max(state['max_lag_ms'], lag)
+
+
+def _sample(updates: int, temp_dir: str, lag_state: dict) -> dict:
+    live, zombies = _children()
+    temp_files, temp_kb = _temp_usage(temp_dir)
+    sample = {
+        'updates': updates,
+        'fds': _open_fds(),
+        'children': live,
+        'zombies': zombies,
+        'threads': threading.active_count(),
+        'temp_files': temp_files,
+        'temp_kb': temp_kb,
+        'rss_mb': _rss_mb(),
+        'lag_ms': lag_state['max_lag_ms'],
+    }
+    lag_state['max_lag_ms'] = 0.0
+    return sample
+
+
+def _print_sample(sample: dict) -> None:
+    print(f"{sample['updates']:>8} " + " ".join(
+        f"{'-' if sample[name] is None else round(sample[name], 1):>10}" for name in TREND_LIMITS
+    ), flush=True)
+
+
+def _growth(samples: list[dict], name: str) -> float | None:
+    """Least-squares slope of ``name`` over the steady-state samples, times the span covered."""
+    points = [(s['updates'], s[name]) for s in samples if s[name] is not None]
+    if len(points) < 3:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+    return slope * (points[-1][0] - points[0][0])
+
+
+def load_bot(temp_dir: str, host_tools: bool = False):
+    """Import the bot with its temp files in ``temp_dir`` and fake viewers.
+
+    Unless ``host_tools`` is set, host FFmpeg is hidden too (no ffprobe, loudness
+    analysis or poster extraction), so results do not depend on the machine.
+    """
+    tempfile.tempdir = temp_dir
+    import screen_display_bot as bot
+
+    logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger('telegram').setLevel(logging.ERROR)
+    bot.VIEWER_COMMAND = [sys.executable, os.path.abspath(__file__)]
+    bot.VIEWER_STARTUP_GRACE = 0.0
+    bot.ALBUM_COLLECT_WINDOW = 0.05
+    bot._displays = [(0, 0, 1920, 1080)]
+    # Caches that live beside the script
+    bot.LOUDNESS_RENDITION_DIR = os.path.join(temp_dir, 'loudnorm')
+    bot.POSTER_CACHE_DIR = os.path.join(temp_dir, 'posters')
+    if not host_tools:
+        bot.LOUDNESS_TARGET_LUFS = None
+        # Pretend ffplay exists but skip ffprobe/ffmpeg.
+        bot._media_tools = {'ffplay': {'path': sys.executable, 'version': 'soak'}, 'ffmpeg': None, 'ffprobe': None}
+    return bot
+
+
+async def soak(args) -> int:
+    temp_dir = tempfile.mkdtemp(prefix='soak_')
+    # Every temp file the bot creates lands here, so the directory size is the leak signal.
+    bot = load_bot(temp_dir)
+    bot._image_backend = args.image_backend
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+
+    user_id = bot.AUTHORIZED_USERS[0]
+    files: dict[str, bytes] = {}
+    request = StubRequest(files, user_id)
+    application = (
+        Application.builder()
+        .token(bot.TELEGRAM_BOT_TOKEN or '1:soak')
+        .request(request)
+        .get_updates_request(StubRequest(files, user_id))
+        .updater(None)
+        .concurrent_updates(bot._PriorityUpdateProcessor())
+        .build()
+    )
+    bot._add_handlers(application)
+    factory = UpdateFactory(files, user_id, args.seed)
+
+    lag_state = {'max_lag_ms': 0.0}
+    lag_task = asyncio.create_task(_watch_loop_lag(state=lag_state))
+    bot._start_stall_watchdog()  # names the handlers behind the lag reported below
+    samples = []
+    print(f"Soak: {args.updates} updates, temp dir {temp_dir}")
+    print(f"{'updates':>8} " + " ".join(f"{name:>10}" for name in TREND_LIMITS))
+
+    started = time.monotonic()
+    await application.initialize()
+    try:
+        processed = 0
+        next_sample = 0
+        while processed < args.updates:
+            for data in factory.next_batch():
+                await application.process_update(Update.de_json(data, application.bot))
+                processed += 1
+            if processed >= next_sample:
+                samples.append(_sample(processed, temp_dir, lag_state))
+                _print_sample(samples[-1])
+                next_sample += args.sample_every
+
+        # Drain: let pending albums flush, close the last viewer, reap everything.
+        await asyncio.sleep(bot.ALBUM_COLLECT_WINDOW * 4)
+        while bot._album_buffers:
+            await asyncio.sleep(0.05)
+        bot._stop_viewer_subprocess()
+        await asyncio.sleep(0.2)
+        drained = _sample(processed, temp_dir, lag_state)
+    finally:
+        lag_task.cancel()
+        await application.shutdown()
+
+    elapsed = time.monotonic() - started
+    print(f"\n{processed} updates in {elapsed:.0f}s ({processed / elapsed:.0f}/s), "
+          f"{request.calls} API calls, {errors.count} logged errors")
+    print(f"Loop stalls: {bot._stall_summary()}")
+
+    failures = []
+    steady = samples[int(len(samples) * WARMUP_FRACTION):]
+    for name, limit in TREND_LIMITS.items():
+        growth = _growth(steady, name)
+        if growth is not None and growth > limit:
+            failures.append(f"{name} grew by {growth:.1f} (limit {limit})")
+    for name in ('children', 'zombies', 'temp_files'):
+        if drained[name]:
+            failures.append(f"{drained[name]} {name} left after draining")
+    if errors.count:
+        failures.append(f"{errors.count} errors logged, last: {errors.last}")
+
+    if failures:
+        print(f"❌ Soak failed (temp dir kept for inspection: {temp_dir}):")
+        for failure in failures:
+            print(f"   - {failure}")
+        return 1
+    print("✅ No upward trends")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak harness for leaks, zombies and temp-file growth")
+    parser.add_argument("--updates", type=int, default=20000, help="synthetic updates to process")
+    parser.add_argument("--sample-every", type=int, default=500, help="updates between resource samples")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the update mix")
+    parser.add_argument("--image-backend", choices=('tk', 'ffplay'), default='tk',
+                        help="ffplay: photos go to viewers that take handed-over items")
+    args = parser.parse_args()
+    return asyncio.run(soak(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())